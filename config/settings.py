@@ -168,6 +168,11 @@ REST_FRAMEWORK = {
         'rest_framework.schemas.coreapi.AutoSchema',
 }
 
+# Наибольшее число привычек в одном запросе пакетного API (habits/batch/)
+HABITS_BATCH_MAX_SIZE = 100
+# Вывод списков привычек из выборки .values() (habits.projections) вместо HabitSerializer, ответ тот же
+HABIT_LIST_PROJECTION_ENABLED = os.getenv('HABIT_LIST_PROJECTION_ENABLED') == 'True'
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=160),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
@@ -199,6 +204,79 @@ CSRF_TRUSTED_ORIGINS = ['http://*.localhost', 'http://127.0.0.1', 'http://*.exam
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 TELEGRAM_MAIN_URL = os.getenv('TELEGRAM_MAIN_URL')
+# Число одновременных запросов к Telegram Bot API при пакетной отправке и таймаут запроса, секунды
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv('TELEGRAM_SEND_CONCURRENCY', 10))
+TELEGRAM_SEND_TIMEOUT = 10
+TELEGRAM_MESSAGE_MAX_LENGTH = 4096
+# Лимиты Telegram Bot API, сообщений в секунду: общий, на личный чат и на групповой чат
+TELEGRAM_GLOBAL_RATE_LIMIT = 30
+TELEGRAM_CHAT_RATE_LIMIT = 1
+TELEGRAM_GROUP_RATE_LIMIT = 20 / 60
+# Сколько раз повторять отправку сообщения после ответа 429 в рамках одного пакета
+TELEGRAM_SEND_MAX_RETRIES = 3
+# Выключатель запросов к Telegram Bot API: размыкается, если за окно (секунды) было не меньше минимального
+# числа запросов и доля ошибок соединения и ответов 5xx достигла порога; пробный запрос — через таймаут, секунды
+TELEGRAM_CIRCUIT_FAILURE_RATE = 0.5
+TELEGRAM_CIRCUIT_MIN_REQUESTS = 10
+TELEGRAM_CIRCUIT_WINDOW = 60
+TELEGRAM_CIRCUIT_OPEN_TIMEOUT = 30
+
+# Размер пакета напоминаний: сообщения пакета отправляются параллельно,
+# а отметки об отправке записываются в базу одним запросом на пакет
+REMINDER_BATCH_SIZE = 500
+# На сколько параллельных подзадач (шардов по user_id) делится каждая рассылка
+REMINDER_DISPATCH_SHARDS = int(os.getenv('REMINDER_DISPATCH_SHARDS', 4))
+
+# Очередь напоминаний (outbox): размер пакета доставки, на сколько пакет закрепляется за задачей доставки,
+# сколько раз и с какой начальной задержкой повторять неудачную отправку, сколько хранить отправленные напоминания
+OUTBOX_BATCH_SIZE = 1000
+OUTBOX_LEASE = timedelta(minutes=5)
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_DELAY = timedelta(seconds=30)
+OUTBOX_RETENTION = timedelta(days=7)
+
+# Режим сводки: напоминания одному пользователю, доставляемые одновременно, объединяются в одно сообщение
+REMINDER_DIGEST_ENABLED = os.getenv('REMINDER_DIGEST_ENABLED') == 'True'
+
+# Общие расписания: привычки с одинаковым временем по дням недели ссылаются на одну строку Schedule
+SCHEDULE_INTERNING_ENABLED = os.getenv('SCHEDULE_INTERNING_ENABLED') == 'True'
+
+# Аренда блокировки, не позволяющей запускам рассылки одного шарда перекрываться (продлевается, пока запуск идет)
+DISPATCH_LOCK_LEASE = timedelta(seconds=60)
+
+# Сколько минут назад (в пределах текущего дня) искать пропущенные напоминания по расписанию
+SCHEDULED_REMINDER_LOOKBACK_MINUTES = 60
+
+# Планировщик напоминаний с интервалом: 'db' (выборка из БД по next_fire_at) или 'redis'
+# (сортированные множества в Redis; после включения или изменения REMINDER_DISPATCH_SHARDS
+# очередь нужно собрать командой rebuild_reminder_queue)
+REMINDER_SCHEDULER_BACKEND = os.getenv('REMINDER_SCHEDULER_BACKEND', 'db')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+# Время аренды привычек, забранных из очереди Redis: если задача упала, не вернув их в очередь,
+# по его окончании привычки снова забираются в обработку
+REMINDER_QUEUE_LEASE = timedelta(minutes=5)
+
+# Кеш страниц ленты публичных привычек в Redis (сбрасывается при изменении публичных привычек,
+# см. habits.cache); таймаут ограничивает устаревание при массовых обновлениях в обход сигналов
+CACHE_ENABLED = os.getenv('CACHE_ENABLED') == 'True'
+if CACHE_ENABLED:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+PUBLIC_FEED_CACHE_TIMEOUT = 60
+# Как часто (в секундах) веб-запросы записывают накопленные метрики в Redis
+METRICS_FLUSH_INTERVAL = 10
+# Токен доступа к метрикам (/metrics/ с заголовком Authorization: Bearer <токен>); если не задан, метрики закрыты
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Диспетчер напоминаний (команда run_reminder_dispatcher) вместо периодических рассылок celery beat:
+# на какой срок вперед загружать напоминания в колесо таймеров и шаг колеса в секундах
+REMINDER_DISPATCHER_ENABLED = os.getenv('REMINDER_DISPATCHER_ENABLED') == 'True'
+REMINDER_DISPATCHER_HORIZON = timedelta(hours=1)
+REMINDER_DISPATCHER_TICK = 1
 
 # Celery Configuration Options
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
@@ -207,6 +285,10 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
+CELERY_TASK_ROUTES = {
+    'habits.tasks.task_deliver_reminders_shard': {'queue': 'delivery'},
+}
+
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
 CELERY_BEAT_SCHEDULE = {
@@ -218,6 +300,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'habits.tasks.task_send_interval_reminder',
         'schedule': timedelta(seconds=30)
     },
+    'deliver reminders': {
+        'task': 'habits.tasks.task_deliver_reminders',
+        'schedule': timedelta(seconds=30)
+    },
+    'cleanup reminder outbox': {
+        'task': 'habits.tasks.task_cleanup_reminder_outbox',
+        'schedule': timedelta(days=1)
+    },
     'cleanup_expired_results': {
         'task': 'django_celery_results.tasks.cleanup_expired_results',
         'schedule': timedelta(weeks=4),
@@ -21,6 +21,8 @@ from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 from rest_framework_simplejwt import authentication
 
+from habits.views import metrics_view
+
 schema_view = get_schema_view(
     openapi.Info(
         title="API Documentation",
@@ -39,6 +41,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('habits/', include('habits.urls')),
     path('users/', include('users.urls')),
+    path('metrics/', metrics_view, name='metrics'),
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from habits.models import Habit, Schedule, Interval
+from habits.models import Habit, Schedule, Interval, ReminderOutbox
 
 
 @admin.register(Habit)
@@ -16,4 +16,10 @@ class ScheduleAdmin(admin.ModelAdmin):
 
 @admin.register(Interval)
 class IntervalAdmin(admin.ModelAdmin):
-    list_display = ('id', 'interval', 'start_time', 'end_time', 'last_event')
\ No newline at end of file
+    list_display = ('id', 'interval', 'start_time', 'end_time', 'last_event')
+
+
+@admin.register(ReminderOutbox)
+class ReminderOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'habit', 'fire_slot', 'chat_id', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from habits.cache import bump_public_feed_generation
+from habits.dispatcher import notify_habit_changes
+from habits.models import Habit, Schedule, ScheduleFireTime, Interval, DAYS_OF_WEEK_FIELDS
+from habits.scheduler import schedule_interval_habits
+from habits.services import get_interval_next_fire_at, get_or_create_schedule
+from users.models import User
+
+# Поля привычки, которые изменяются пакетным редактированием напрямую (расписание и интервал - отдельно)
+HABIT_UPDATE_FIELDS = ('place', 'operation', 'is_enjoyable', 'reward', 'lead_time', 'is_public', 'related_habit')
+
+
+@transaction.atomic
+def bulk_create_habits(user: User, habits_data: list[dict]) -> list[Habit]:
+    """
+    Функция создания привычек пользователя по проверенным данным сериализатора (HabitSerializer.validated_data).
+
+    Расписания, интервалы и привычки создаются несколькими запросами bulk_create, производные данные
+    (минуты срабатывания расписаний, время следующего напоминания, is_deliverable) заполняются здесь же,
+    т.к. bulk_create не вызывает save() и сигналы
+    """
+
+    schedules = iter(bulk_create_schedules([data['schedule'] for data in habits_data if data.get('schedule')]))
+    intervals = iter(bulk_create_intervals([data['interval'] for data in habits_data if data.get('interval')]))
+
+    habits = []
+    for data in habits_data:
+        habit = Habit(user=user, **{key: value for key, value in data.items() if key not in ('schedule', 'interval')})
+        if data.get('schedule'):
+            habit.schedule = next(schedules)
+        if data.get('interval'):
+            habit.interval = next(intervals)
+        habit.update_delivery()
+        habits.append(habit)
+    Habit.objects.bulk_create(habits)
+
+    on_habits_changed(habits)
+    return habits
+
+
+@transaction.atomic
+def bulk_update_habits(changes: list[tuple[Habit, dict]]) -> list[Habit]:
+    """
+    Функция изменения привычек по проверенным данным сериализатора (частичное обновление), по смыслу как
+    HabitSerializer.update: собственное расписание изменяется на месте, общее заменяется другим,
+    при смене расписания на интервал (и наоборот) прежнее удаляется. Привычки должны быть выбраны
+    с расписанием, интервалом и пользователем (select_related).
+
+    Записи выполняются пакетами: новые расписания и интервалы создаются bulk_create, измененные
+    сохраняются bulk_update, поэтому время изменения (updated_at) выставляется явно
+    """
+
+    now = timezone.now()
+    habits = []
+    new_schedules, new_intervals = [], []
+    changed_schedules, changed_intervals = [], []
+    deleted_schedule_ids, deleted_interval_ids = set(), set()
+
+    for habit, data in changes:
+        data = dict(data)
+        schedule_data = data.pop('schedule', None)
+        interval_data = data.pop('interval', None)
+        for key, value in data.items():
+            setattr(habit, key, value)
+
+        if schedule_data:
+            if habit.schedule and not habit.schedule.digest and not settings.SCHEDULE_INTERNING_ENABLED:
+                for key, value in schedule_data.items():
+                    setattr(habit.schedule, key, value)
+                habit.schedule.updated_at = now
+                changed_schedules.append(habit.schedule)
+            else:
+                if habit.schedule:
+                    # Общее расписание не изменяется: привычке назначается расписание с новым временем
+                    schedule_data = {
+                        **{field_name: getattr(habit.schedule, field_name) for field_name in DAYS_OF_WEEK_FIELDS},
+                        **schedule_data
+                    }
+                    if not habit.schedule.digest:
+                        deleted_schedule_ids.add(habit.schedule_id)
+                new_schedules.append((habit, schedule_data))
+                if habit.interval:
+                    deleted_interval_ids.add(habit.interval_id)
+                    habit.interval = None
+
+        if interval_data:
+            if habit.interval:
+                for key, value in interval_data.items():
+                    setattr(habit.interval, key, value)
+                habit.interval.next_fire_at = get_interval_next_fire_at(habit.interval, now)
+                habit.interval.updated_at = now
+                changed_intervals.append(habit.interval)
+            else:
+                new_intervals.append((habit, interval_data))
+                if habit.schedule:
+                    if not habit.schedule.digest:
+                        deleted_schedule_ids.add(habit.schedule_id)
+                    habit.schedule = None
+        habits.append(habit)
+
+    for (habit, _), schedule in zip(new_schedules, bulk_create_schedules([data for _, data in new_schedules])):
+        habit.schedule = schedule
+    for (habit, _), interval in zip(new_intervals, bulk_create_intervals([data for _, data in new_intervals])):
+        habit.interval = interval
+
+    if changed_schedules:
+        Schedule.objects.bulk_update(changed_schedules, [*DAYS_OF_WEEK_FIELDS, 'updated_at'])
+        ScheduleFireTime.objects.filter(schedule__in=changed_schedules).delete()
+        bulk_create_fire_times(changed_schedules)
+    if changed_intervals:
+        Interval.objects.bulk_update(changed_intervals,
+                                     ['interval', 'start_time', 'end_time', 'next_fire_at', 'updated_at'])
+
+    was_public = any(getattr(habit, '_loaded_is_public', True) for habit in habits)
+    for habit in habits:
+        habit.update_delivery()
+        habit.updated_at = now
+        habit._loaded_is_public = habit.is_public
+    Habit.objects.bulk_update(
+        habits, [*HABIT_UPDATE_FIELDS, 'schedule', 'interval', 'is_deliverable', 'chat_id', 'updated_at']
+    )
+
+    # Замененные расписания и интервалы удаляются после того, как на них перестали ссылаться привычки,
+    # иначе каскадное удаление удалило бы и привычки
+    deleted_schedule_ids -= {habit.schedule_id for habit in habits}
+    Schedule.objects.filter(pk__in=deleted_schedule_ids, digest__isnull=True).delete()
+    Interval.objects.filter(pk__in=deleted_interval_ids).delete()
+
+    on_habits_changed(habits, was_public=was_public)
+    return habits
+
+
+@transaction.atomic
+def bulk_delete_habits(habits: list[Habit]) -> int:
+    """Функция удаления привычек одним запросом (сигналы удаления при этом срабатывают для каждой привычки)"""
+
+    deleted_count, _ = Habit.objects.filter(pk__in=[habit.pk for habit in habits]).delete()
+    return deleted_count
+
+
+def bulk_create_schedules(schedules_data: list[dict]) -> list[Schedule]:
+    """
+    Создает расписания (в режиме SCHEDULE_INTERNING_ENABLED находит или создает общие) в порядке `schedules_data`
+    вместе с минутами срабатывания
+    """
+
+    if not schedules_data:
+        return []
+    if not settings.SCHEDULE_INTERNING_ENABLED:
+        schedules = Schedule.objects.bulk_create([Schedule(**data) for data in schedules_data])
+        bulk_create_fire_times(schedules)
+        return schedules
+
+    digests = [Schedule.get_digest(data) for data in schedules_data]
+    schedules = {schedule.digest: schedule for schedule in Schedule.objects.filter(digest__in=digests)}
+    missing = {digest: data for digest, data in zip(digests, schedules_data) if digest not in schedules}
+    if missing:
+        try:
+            with transaction.atomic():
+                created = Schedule.objects.bulk_create(
+                    [Schedule(digest=digest, **data) for digest, data in missing.items()]
+                )
+                bulk_create_fire_times(created)
+        except IntegrityError:
+            # Такое же расписание одновременно создал другой запрос: общие расписания создаются по одному
+            created = [get_or_create_schedule(data) for data in missing.values()]
+        schedules.update((schedule.digest, schedule) for schedule in created)
+    return [schedules[digest] for digest in digests]
+
+
+def bulk_create_fire_times(schedules: list[Schedule]) -> None:
+    ScheduleFireTime.objects.bulk_create(
+        ScheduleFireTime(schedule=schedule, minute_of_week=minute)
+        for schedule in schedules
+        for minute in schedule.get_minutes_of_week()
+    )
+
+
+def bulk_create_intervals(intervals_data: list[dict]) -> list[Interval]:
+    now = timezone.now()
+    intervals = [Interval(**data) for data in intervals_data]
+    for interval in intervals:
+        interval.next_fire_at = get_interval_next_fire_at(interval, now)
+    return Interval.objects.bulk_create(intervals)
+
+
+def on_habits_changed(habits: list[Habit], was_public: bool = False) -> None:
+    """
+    То, что для отдельной привычки делают сигналы и сериализатор: очередь напоминаний в Redis,
+    уведомление диспетчера и сброс кеша ленты публичных привычек
+    """
+
+    transaction.on_commit(lambda: schedule_interval_habits(habits))
+    if settings.REMINDER_DISPATCHER_ENABLED:
+        for habit in habits:
+            notify_habit_changes('habit', habit.pk)
+    if settings.CACHE_ENABLED and (was_public or any(habit.is_public for habit in habits)):
+        transaction.on_commit(bump_public_feed_generation)
@@ -0,0 +1,66 @@
+import hashlib
+import logging
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_FEED_GENERATION_KEY = 'habits:public_feed:generation'
+
+
+def get_public_feed_generation() -> int:
+    """
+    Поколение кеша ленты публичных привычек: входит в ключи страниц, поэтому после его увеличения
+    все закешированные страницы перестают использоваться и вытесняются по таймауту.
+
+    Начальное значение - текущее время, чтобы после потери ключа в Redis не вернуться к старым страницам
+    """
+
+    generation = cache.get(PUBLIC_FEED_GENERATION_KEY)
+    if generation is None:
+        cache.add(PUBLIC_FEED_GENERATION_KEY, time.time_ns(), None)
+        generation = cache.get(PUBLIC_FEED_GENERATION_KEY)
+    return generation
+
+
+def bump_public_feed_generation() -> None:
+    """Сбрасывает кеш ленты публичных привычек (ошибки Redis только логируются)"""
+
+    if not settings.CACHE_ENABLED:
+        return
+    try:
+        try:
+            cache.incr(PUBLIC_FEED_GENERATION_KEY)
+        except ValueError:
+            cache.add(PUBLIC_FEED_GENERATION_KEY, time.time_ns(), None)
+    except redis.RedisError:
+        logger.exception('Не удалось сбросить кеш ленты публичных привычек')
+
+
+def get_public_feed_page_key(generation: int, url: str) -> str:
+    return f'habits:public_feed:{generation}:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def get_cached_public_feed_page(url: str) -> tuple[str | None, dict | None]:
+    """
+    Ключ и закешированные данные страницы ленты по ее адресу (с параметрами постраничного вывода).
+
+    Если Redis недоступен, возвращается (None, None): страница строится без кеша
+    """
+
+    try:
+        key = get_public_feed_page_key(get_public_feed_generation(), url)
+        return key, cache.get(key)
+    except redis.RedisError:
+        logger.exception('Не удалось прочитать кеш ленты публичных привычек')
+        return None, None
+
+
+def set_cached_public_feed_page(key: str, data: dict) -> None:
+    try:
+        cache.set(key, data, settings.PUBLIC_FEED_CACHE_TIMEOUT)
+    except redis.RedisError:
+        logger.exception('Не удалось записать кеш ленты публичных привычек')
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель (circuit breaker) запросов к внешнему сервису.
+
+    В закрытом состоянии запросы проходят, а их исходы запоминаются за последние `window` секунд.
+    Если в окне не меньше `min_requests` запросов и доля неудачных достигла `failure_rate`, выключатель
+    размыкается: запросы сразу отклоняются, не дожидаясь таймаута. Через `open_timeout` секунд выключатель
+    переходит в полуоткрытое состояние и пропускает один пробный запрос: если он удачный, выключатель
+    замыкается, если нет, снова размыкается на `open_timeout`. Пока пробный запрос выполняется, выключатель
+    считается разомкнутым (is_open), а пробный запрос, не сообщивший результат за `open_timeout`,
+    считается неудачным
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self,
+                 failure_rate: float,
+                 min_requests: int,
+                 window: float,
+                 open_timeout: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_timeout = open_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_started_at = 0.0
+        self.outcomes = deque()
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """Можно ли выполнить запрос; в полуоткрытом состоянии разрешается только один пробный запрос"""
+
+        with self._lock:
+            self._expire_probe()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() >= self.opened_at + self.open_timeout:
+                self.state = self.HALF_OPEN
+                self.probe_started_at = self.clock()
+                return True
+            return False
+
+    def retry_after(self) -> float:
+        """
+        Через сколько секунд выключатель пропустит пробный запрос (0, если запросы проходят);
+        пока пробный запрос выполняется - через сколько секунд он будет считаться неудачным
+        """
+
+        with self._lock:
+            self._expire_probe()
+            if self.state == self.OPEN:
+                return max(self.opened_at + self.open_timeout - self.clock(), 0.0)
+            if self.state == self.HALF_OPEN:
+                return max(self.probe_started_at + self.open_timeout - self.clock(), 0.0)
+            return 0.0
+
+    def is_open(self) -> bool:
+        return self.retry_after() > 0
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._close()
+            elif self.state == self.CLOSED:
+                self._record(False)
+
+    def record_failure(self) -> bool:
+        """Запоминает неудачный запрос и возвращает True, если выключатель из-за него разомкнулся"""
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return True
+            if self.state == self.OPEN:
+                return False
+            self._record(True)
+            if len(self.outcomes) >= self.min_requests and self.failures >= self.failure_rate * len(self.outcomes):
+                self._open()
+                return True
+            return False
+
+    def _expire_probe(self) -> None:
+        if self.state == self.HALF_OPEN and self.clock() >= self.probe_started_at + self.open_timeout:
+            self._open()
+
+    def _record(self, is_failure: bool) -> None:
+        now = self.clock()
+        self.outcomes.append((now, is_failure))
+        self.failures += is_failure
+        while self.outcomes and self.outcomes[0][0] <= now - self.window:
+            _, expired_failure = self.outcomes.popleft()
+            self.failures -= expired_failure
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = self.clock()
+        self.outcomes.clear()
+        self.failures = 0
+
+    def _close(self) -> None:
+        self.state = self.CLOSED
+        self.outcomes.clear()
+        self.failures = 0
@@ -0,0 +1,205 @@
+import logging
+import select
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from habits import services, tasks
+from habits.metrics import metrics
+from habits.models import Habit, DAYS_OF_WEEK_FIELDS, get_minute_of_week
+from habits.timing_wheel import HierarchicalTimingWheel
+
+logger = logging.getLogger(__name__)
+
+# Канал Postgres LISTEN/NOTIFY, в который сигналы пишут изменения привычек вида 'habit:1', 'schedule:2'
+HABIT_CHANGES_CHANNEL = 'habit_changes'
+
+# Поля, нужные для расчета времени следующего напоминания привычки
+TIMER_HABIT_FIELDS = (
+    'is_deliverable', 'schedule', 'interval', *(f'schedule__{field_name}' for field_name in DAYS_OF_WEEK_FIELDS),
+    'interval__interval', 'interval__start_time', 'interval__end_time', 'interval__last_event',
+)
+
+
+def notify_habit_changes(kind: str, pk: int) -> None:
+    """
+    Сообщает диспетчеру напоминаний об изменении объекта (habit, schedule, interval или user).
+
+    NOTIFY выполняется в текущей транзакции, поэтому диспетчер получит уведомление только после ее фиксации
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [HABIT_CHANGES_CHANNEL, f'{kind}:{pk}'])
+
+
+class ReminderDispatcher:
+    """
+    Диспетчер напоминаний: долго работающий процесс вместо периодического опроса БД задачами celery beat.
+
+    Ближайшие (в пределах REMINDER_DISPATCHER_HORIZON) времена напоминаний загружаются в иерархическое колесо
+    таймеров, и напоминания ставятся в очередь в момент срабатывания таймера только для сработавших привычек.
+    Изменения привычек, расписаний, интервалов и чатов пользователей приходят через Postgres LISTEN/NOTIFY
+    (см. habits.signals), поэтому повторно просматривать все привычки не нужно: колесо дополняется
+    следующим отрезком горизонта, когда пройдена его половина
+    """
+
+    def __init__(self,
+                 horizon: timedelta | None = None,
+                 tick: float | None = None,
+                 clock: Callable[[], datetime] = timezone.now):
+        self.horizon = horizon or settings.REMINDER_DISPATCHER_HORIZON
+        self.tick = tick or settings.REMINDER_DISPATCHER_TICK
+        self.clock = clock
+        now = clock()
+        self.wheel = HierarchicalTimingWheel(tick=self.tick, start=now.timestamp())
+        self.loaded_until = now
+        self.running = False
+
+    def run(self) -> None:
+        """Основной цикл: ожидание уведомлений об изменениях не дольше тика, затем продвижение колеса"""
+
+        self.running = True
+        self.listen()
+        self.catch_up()
+        logger.info(f'Диспетчер напоминаний запущен, таймеров: {len(self.wheel)}')
+        while self.running:
+            changes = self.wait_for_changes(self.tick)
+            if changes:
+                self.apply_changes(changes)
+            self.step(self.clock())
+        logger.info('Диспетчер напоминаний остановлен')
+
+    def stop(self) -> None:
+        self.running = False
+
+    def listen(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {HABIT_CHANGES_CHANNEL}')
+
+    def wait_for_changes(self, timeout: float) -> list[str]:
+        """Ждет уведомлений об изменениях не дольше `timeout` секунд и возвращает их"""
+
+        pg_connection = connection.connection
+        if select.select([pg_connection], [], [], timeout)[0]:
+            pg_connection.poll()
+        changes = [notify.payload for notify in pg_connection.notifies]
+        pg_connection.notifies.clear()
+        return changes
+
+    def catch_up(self) -> None:
+        """Рассылка пропущенных, пока диспетчер не работал, напоминаний и первая загрузка колеса"""
+
+        now = self.clock()
+        count = services.send_scheduled_reminder(current_datetime=now) + services.send_interval_reminder(
+            current_datetime=now)
+        if count:
+            tasks.task_deliver_reminders.delay()
+        self.loaded_until = now
+        self.refill(now)
+
+    def step(self, now: datetime) -> list[int]:
+        """Продвигает колесо до `now`, ставит в очередь сработавшие напоминания и возвращает id их привычек"""
+
+        if self.loaded_until - now <= self.horizon / 2:
+            self.refill(now)
+
+        habit_ids = self.wheel.advance(now.timestamp())
+        if habit_ids:
+            self.fire(habit_ids, now)
+        return habit_ids
+
+    def fire(self, habit_ids: list[int], now: datetime) -> int:
+        start = time.monotonic()
+        count = services.send_scheduled_reminder(current_datetime=now, habit_ids=habit_ids) + \
+            services.send_interval_reminder(current_datetime=now, habit_ids=habit_ids)
+        if count:
+            tasks.task_deliver_reminders.delay()
+        self.reload(Q(pk__in=habit_ids), now, habit_ids)
+        metrics.observe('habits_dispatch_tick_seconds', time.monotonic() - start, kind='dispatcher')
+        metrics.flush()
+        return count
+
+    def refill(self, now: datetime) -> None:
+        """Загружает в колесо напоминания следующего отрезка горизонта"""
+
+        start, self.loaded_until = self.loaded_until, now + self.horizon
+        habits = self.get_habits(self.get_fire_window_q(start, self.loaded_until)).distinct()
+        self.load(habits.iterator(chunk_size=settings.REMINDER_BATCH_SIZE), now)
+
+    def apply_changes(self, changes: Iterable[str]) -> None:
+        """Пересчитывает таймеры привычек, затронутых изменениями вида 'habit:1'"""
+
+        ids = {'habit': set(), 'schedule': set(), 'interval': set(), 'user': set()}
+        for change in changes:
+            kind, _, pk = change.partition(':')
+            if kind in ids and pk.isdigit():
+                ids[kind].add(int(pk))
+
+        self.reload(
+            Q(pk__in=ids['habit']) | Q(schedule_id__in=ids['schedule']) | Q(interval_id__in=ids['interval'])
+            | Q(user_id__in=ids['user']),
+            self.clock(),
+            ids['habit']
+        )
+
+    def reload(self, query: Q, now: datetime, habit_ids: Iterable[int] = ()) -> None:
+        """Пересчитывает таймеры привычек из выборки `query`, таймеры удаленных привычек `habit_ids` отменяются"""
+
+        loaded_ids = self.load(self.select_timer_fields(Habit.objects.filter(query)), now)
+        for habit_id in set(habit_ids) - loaded_ids:
+            self.wheel.remove(habit_id)
+
+    def load(self, habits: Iterable[Habit], now: datetime) -> set[int]:
+        """Ставит таймеры привычек на время следующего напоминания, если оно в пределах загруженного горизонта"""
+
+        loaded_ids = set()
+        for habit in habits:
+            loaded_ids.add(habit.pk)
+            fire_at = self.get_next_fire_at(habit, now)
+            if fire_at is not None and fire_at <= self.loaded_until:
+                self.wheel.add(habit.pk, fire_at.timestamp())
+            else:
+                self.wheel.remove(habit.pk)
+        return loaded_ids
+
+    @staticmethod
+    def get_next_fire_at(habit: Habit, now: datetime) -> datetime | None:
+        if not habit.is_deliverable:
+            return None
+        if habit.schedule:
+            return services.get_schedule_next_fire_at(habit.schedule, now)
+        if habit.interval:
+            return services.get_interval_next_fire_at(habit.interval, now)
+        return None
+
+    @classmethod
+    def get_habits(cls, query: Q):
+        return cls.select_timer_fields(Habit.objects.filter(query, is_deliverable=True))
+
+    @staticmethod
+    def select_timer_fields(habits):
+        return habits.select_related('schedule', 'interval').only(*TIMER_HABIT_FIELDS)
+
+    @staticmethod
+    def get_fire_window_q(start: datetime, end: datetime) -> Q:
+        """Условие выборки привычек, напоминания которых могут сработать в промежутке от `start` до `end`"""
+
+        interval_q = Q(interval__isnull=False) & (
+            Q(interval__next_fire_at__isnull=True) | Q(interval__next_fire_at__lte=end)
+        )
+        if end - start >= timedelta(weeks=1):
+            return interval_q | Q(schedule__isnull=False)
+
+        first_minute = get_minute_of_week(start.weekday(), start.time())
+        last_minute = get_minute_of_week(end.weekday(), end.time())
+        if first_minute <= last_minute:
+            schedule_q = Q(schedule__fire_times__minute_of_week__range=(first_minute, last_minute))
+        else:
+            schedule_q = Q(schedule__fire_times__minute_of_week__gte=first_minute) | Q(
+                schedule__fire_times__minute_of_week__lte=last_minute)
+        return interval_q | schedule_q
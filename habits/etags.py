@@ -0,0 +1,131 @@
+import hashlib
+from typing import Callable
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from habits.models import Habit
+from habits.projections import get_habit_rows, render_habit_rows
+
+
+def make_etag(*parts) -> str:
+    return quote_etag(hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest())
+
+
+def get_timestamp(value) -> float | None:
+    return value.timestamp() if value is not None else None
+
+
+def get_habit_etag(habit: Habit) -> str:
+    """ETag привычки по времени изменения ее, ее расписания и интервала, без сериализации тела ответа"""
+
+    return make_etag(
+        habit.pk,
+        get_timestamp(habit.updated_at),
+        get_timestamp(habit.schedule.updated_at) if habit.schedule_id else None,
+        get_timestamp(habit.interval.updated_at) if habit.interval_id else None,
+    )
+
+
+def get_habit_row_etag(row: dict) -> str:
+    """То же, что get_habit_etag, для строки выборки habits.projections.get_habit_rows"""
+
+    return make_etag(row['id'], *(get_timestamp(row[key]) for key in (
+        'updated_at', 'schedule__updated_at', 'interval__updated_at'
+    )))
+
+
+def get_etag_response(request, etag: str, get_response: Callable[[], HttpResponse]) -> HttpResponse:
+    """
+    Ответ на условный запрос: 304 для GET с совпавшим If-None-Match, 412 при несовпавшем If-Match,
+    иначе ответ `get_response` (тело строится и запись выполняется только в этом случае).
+    Если ETag не задан самим ответом, в него добавляется `etag`
+    """
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = get_response()
+    if not response.has_header('ETag') and response.status_code != 204:
+        response['ETag'] = etag
+    return response
+
+
+class HabitListETagMixin:
+    """
+    Примесь к представлению списка привычек: ETag страницы строится по ее привычкам (get_habit_etag)
+    и данным постраничного вывода (число записей, ссылки), поэтому на GET с совпавшим If-None-Match
+    страница выбирается из БД, но не сериализуется.
+
+    При HABIT_LIST_PROJECTION_ENABLED привычки выбираются словарями (.values()) и выводятся
+    render_habit_rows вместо HabitSerializer с тем же результатом
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        projection = settings.HABIT_LIST_PROJECTION_ENABLED
+        if projection:
+            queryset = get_habit_rows(queryset)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            habits, pagination = list(queryset), {}
+        else:
+            habits, pagination = page, self.get_paginated_response([]).data
+        etag = make_etag(*(f'{key}={value}' for key, value in pagination.items() if key != 'results'),
+                         *map(get_habit_row_etag if projection else get_habit_etag, habits))
+
+        def get_response():
+            if projection:
+                data = render_habit_rows(habits)
+            else:
+                data = self.get_serializer(habits, many=True).data
+            return self.get_paginated_response(data) if page is not None else Response(data)
+
+        return get_etag_response(request, etag, get_response)
+
+
+class HabitETagMixin:
+    """
+    Примесь к представлению привычки: GET с If-None-Match возвращает 304 без сериализации,
+    изменение и удаление с If-Match выполняются, только если привычка не менялась (иначе 412).
+    Привычка на время проверки и записи блокируется (SELECT ... FOR UPDATE), чтобы параллельный запрос
+    не изменил ее между сравнением ETag и сохранением
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method in ('PUT', 'PATCH', 'DELETE'):
+            queryset = queryset.select_for_update(of=('self',))
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return get_etag_response(request, get_habit_etag(instance),
+                                 lambda: Response(self.get_serializer(instance).data))
+
+    @transaction.atomic
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        instance = self.get_object()
+
+        def perform_update():
+            serializer = self.get_serializer(instance, data=request.data, partial=partial)
+            serializer.is_valid(raise_exception=True)
+            self.perform_update(serializer)
+            return Response(serializer.data, headers={'ETag': get_habit_etag(serializer.instance)})
+
+        return get_etag_response(request, get_habit_etag(instance), perform_update)
+
+    @transaction.atomic
+    def destroy(self, request, *args, **kwargs):
+        instance = self.get_object()
+
+        def perform_destroy():
+            self.perform_destroy(instance)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        return get_etag_response(request, get_habit_etag(instance), perform_destroy)
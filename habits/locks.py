@@ -0,0 +1,118 @@
+import logging
+import threading
+import uuid
+from typing import Callable, TypeVar
+
+import redis
+from django.conf import settings
+
+from habits.metrics import metrics
+from habits.scheduler import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class LeaderLock:
+    """
+    Распределенная блокировка в Redis с арендой (lease).
+
+    Блокировка ставится на `lease` секунд (SET NX PX), пока она удерживается, фоновый поток продлевает аренду
+    каждые lease / 3 секунды. Если процесс, удерживающий блокировку, завис или упал, аренда истекает
+    и блокировку может взять другой процесс. Продление и снятие проверяют владельца (WATCH/MULTI),
+    чтобы не снять чужую блокировку после истечения своей аренды
+    """
+
+    def __init__(self, client: redis.Redis, name: str, lease: float):
+        self.client = client
+        self.key = f'habits:dispatch_lock:{name}'
+        self.rerun_key = f'{self.key}:rerun'
+        self.lease_ms = int(lease * 1000)
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._renewal = None
+
+    def acquire(self) -> bool:
+        return bool(self.client.set(self.key, self.token, nx=True, px=self.lease_ms))
+
+    def renew(self) -> bool:
+        """Продлевает аренду, если блокировка все еще принадлежит этому процессу"""
+
+        def extend(pipe):
+            is_owner = pipe.get(self.key) == self.token.encode()
+            pipe.multi()
+            if is_owner:
+                pipe.pexpire(self.key, self.lease_ms)
+            return is_owner
+
+        return self.client.transaction(extend, self.key, value_from_callable=True)
+
+    def release(self) -> None:
+        def delete(pipe):
+            is_owner = pipe.get(self.key) == self.token.encode()
+            pipe.multi()
+            if is_owner:
+                pipe.delete(self.key)
+
+        self.client.transaction(delete, self.key)
+
+    def request_rerun(self) -> None:
+        """Просит владельца блокировки выполнить работу еще раз после текущего запуска"""
+
+        self.client.set(self.rerun_key, 1, px=self.lease_ms)
+
+    def pop_rerun(self) -> bool:
+        return bool(self.client.getdel(self.rerun_key))
+
+    def __enter__(self):
+        self._stop.clear()
+        self._renewal = threading.Thread(target=self._renew_until_stopped, daemon=True)
+        self._renewal.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._renewal.join()
+        self.release()
+
+    def _renew_until_stopped(self) -> None:
+        while not self._stop.wait(self.lease_ms / 1000 / 3):
+            try:
+                if not self.renew():
+                    logger.error(f'Потеряна блокировка {self.key}: аренда истекла до продления')
+                    return
+            except redis.RedisError:
+                logger.exception(f'Ошибка при продлении блокировки {self.key}')
+
+
+def run_exclusive(name: str, func: Callable[[], T], combine: Callable[[T, T], T]) -> T | None:
+    """
+    Выполняет `func` под блокировкой `name`, чтобы запуски одной задачи не перекрывались.
+
+    Если блокировка занята, запуск пропускается (возвращается None) и учитывается в метрике пропущенных,
+    а владельца блокировки просят выполнить работу еще раз после завершения: сколько бы запусков ни было
+    пропущено, они сливаются в один повторный. Результаты повторных запусков объединяются через `combine`.
+    Если Redis недоступен, работа выполняется без блокировки (повторная постановка в очередь безопасна
+    благодаря уникальности напоминаний в ReminderOutbox)
+    """
+
+    lock = LeaderLock(get_redis_client(), name, settings.DISPATCH_LOCK_LEASE.total_seconds())
+    try:
+        acquired = lock.acquire()
+        if not acquired:
+            lock.request_rerun()
+    except redis.RedisError:
+        logger.exception(f'Блокировка {name} недоступна, задача выполняется без нее')
+        return func()
+
+    if not acquired:
+        logger.warning(f'Задача {name} уже выполняется, запуск объединен с текущим')
+        metrics.inc('habits_dispatch_skipped_ticks_total', task=name)
+        return None
+
+    with lock:
+        result = func()
+        while lock.pop_rerun():
+            result = combine(result, func())
+    return result
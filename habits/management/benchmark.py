@@ -0,0 +1,85 @@
+import uuid
+from typing import Callable
+
+from django.db.models import Max, QuerySet
+
+from habits.models import Habit, Schedule, ScheduleFireTime, Interval
+from users.models import User
+
+
+def create_benchmark_users(count: int, with_chats: bool = False) -> tuple[str, list[User]]:
+    """
+    Создает пользователей нагрузочного замера с общим случайным префиксом имени и возвращает префикс
+    и пользователей. С `with_chats` пользователям назначаются чаты telegram подряд после последнего
+    существующего, поэтому их диапазон (get_benchmark_chat_ids) не пересекается с чатами других пользователей
+    """
+
+    prefix = f'benchmark_{uuid.uuid4().hex[:8]}_'
+    first_chat_id = (User.objects.aggregate(value=Max('telegram_user_id'))['value'] or 0) + 1
+    users = User.objects.bulk_create(
+        User(
+            username=f'{prefix}{i}',
+            telegram_username=f'@{prefix}{i}',
+            telegram_user_id=first_chat_id + i if with_chats else None,
+            password='!'
+        )
+        for i in range(count)
+    )
+    return prefix, users
+
+
+def create_benchmark_habits(users: list[User],
+                            intervals: list[Interval],
+                            schedules: list[Schedule],
+                            get_fields: Callable[[int], dict] | None = None) -> list[Habit]:
+    """
+    Создает интервалы, расписания (с минутами срабатывания) и по привычке на каждый из них:
+    сначала с интервалом, затем по расписанию, пользователи назначаются по кругу.
+    `get_fields` возвращает дополнительные поля i-й привычки
+    """
+
+    intervals = Interval.objects.bulk_create(intervals)
+    schedules = Schedule.objects.bulk_create(schedules)
+    ScheduleFireTime.objects.bulk_create(
+        ScheduleFireTime(schedule=schedule, minute_of_week=minute)
+        for schedule in schedules
+        for minute in schedule.get_minutes_of_week()
+    )
+
+    periodicity = [{'interval': interval} for interval in intervals] + [
+        {'schedule': schedule} for schedule in schedules
+    ]
+    habits = []
+    for i, fields in enumerate(periodicity):
+        habit = Habit(
+            user=users[i % len(users)],
+            place='дома',
+            operation=f'выполнить привычку {i}',
+            reward='отдохнуть',
+            **fields,
+            **(get_fields(i) if get_fields else {})
+        )
+        habit.update_delivery()
+        habits.append(habit)
+    return Habit.objects.bulk_create(habits)
+
+
+def get_benchmark_habits(prefix: str) -> QuerySet:
+    return Habit.objects.filter(user__username__startswith=prefix)
+
+
+def get_benchmark_chat_ids(users: list[User]) -> range:
+    """Диапазон чатов пользователей, созданных create_benchmark_users с чатами"""
+
+    return range(users[0].telegram_user_id, users[-1].telegram_user_id + 1)
+
+
+def delete_benchmark_data(prefix: str) -> None:
+    """Удаляет созданные данные: расписания, интервалы и пользователей (привычки и очередь удаляются каскадно)"""
+
+    habits = get_benchmark_habits(prefix)
+    schedule_ids = list(habits.filter(schedule__isnull=False).values_list('schedule_id', flat=True))
+    interval_ids = list(habits.filter(interval__isnull=False).values_list('interval_id', flat=True))
+    Schedule.objects.filter(pk__in=schedule_ids).delete()
+    Interval.objects.filter(pk__in=interval_ids).delete()
+    User.objects.filter(username__startswith=prefix).delete()
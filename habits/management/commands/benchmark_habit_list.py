@@ -0,0 +1,87 @@
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from habits.management.benchmark import create_benchmark_users, create_benchmark_habits, get_benchmark_habits, \
+    delete_benchmark_data
+from habits.models import Schedule, Interval
+from habits.projections import get_habit_rows, render_habit_rows
+from habits.serializers import HabitSerializer
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный замер вывода списка привычек: HabitSerializer по моделям против render_habit_rows
+    по выборке .values(). Создает синтетического пользователя с привычками (по расписанию и с интервалом),
+    затем несколько раз выбирает их и выводит в JSON обоими способами. Выводит скорость в строках в секунду
+    и проверяет, что JSON побайтно совпадает
+    """
+
+    help = 'Нагрузочный замер вывода списка привычек (сериализатор и выборка .values())'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--habits', type=int, default=5000, help='Число привычек')
+        parser.add_argument('--repeat', type=int, default=5, help='Число повторов каждого способа')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные данные')
+
+    def handle(self, *args, **options):
+        seed_start = time.perf_counter()
+        prefix = self.seed(options['habits'])
+        self.stdout.write(f'Данные созданы за {time.perf_counter() - seed_start:.2f} с.')
+
+        try:
+            habits = get_benchmark_habits(prefix).order_by('id')
+            renderer = JSONRenderer()
+            serializer_time, serializer_json = self.measure(options['repeat'], lambda: renderer.render(
+                HabitSerializer(habits.select_related('schedule', 'interval'), many=True).data
+            ))
+            projection_time, projection_json = self.measure(options['repeat'], lambda: renderer.render(
+                render_habit_rows(get_habit_rows(habits))
+            ))
+        finally:
+            if not options['keep']:
+                delete_benchmark_data(prefix)
+
+        if serializer_json != projection_json:
+            raise CommandError('JSON сериализатора и выборки .values() не совпадает')
+
+        rows = options['habits']
+        self.stdout.write(f'HabitSerializer: {rows / serializer_time:.0f} строк/с')
+        self.stdout.write(f'Выборка .values(): {rows / projection_time:.0f} строк/с '
+                          f'(быстрее в {serializer_time / projection_time:.1f} раза)')
+        self.stdout.write('JSON совпадает побайтно')
+
+    @staticmethod
+    def measure(repeat: int, render) -> tuple[float, bytes]:
+        """Лучшее время из `repeat` запусков (выборка из БД и вывод в JSON) и полученный JSON"""
+
+        best, content = float('inf'), b''
+        for _ in range(repeat):
+            start = time.perf_counter()
+            content = render()
+            best = min(best, time.perf_counter() - start)
+        return best, content
+
+    def seed(self, habits_count: int) -> str:
+        """Создает пользователя с привычками, возвращает префикс его имени"""
+
+        prefix, users = create_benchmark_users(1)
+        now = timezone.now()
+        intervals_count = habits_count // 2
+        create_benchmark_habits(
+            users,
+            [
+                Interval(interval=timedelta(hours=i % 24 + 1), start_time='08:00', end_time='22:00', last_event=now,
+                         next_fire_at=now)
+                for i in range(intervals_count)
+            ],
+            [
+                Schedule(monday='09:00', wednesday='09:00', friday=f'18:{i % 60:02}')
+                for i in range(habits_count - intervals_count)
+            ],
+            lambda i: {'lead_time': timedelta(seconds=i % 120) or None, 'is_public': bool(i % 2)}
+        )
+        return prefix
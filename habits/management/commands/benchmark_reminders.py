@@ -0,0 +1,165 @@
+import math
+import resource
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from habits import services
+from habits.management.benchmark import create_benchmark_users, create_benchmark_habits, get_benchmark_habits, \
+    get_benchmark_chat_ids, delete_benchmark_data
+from habits.models import Schedule, Interval, DAYS_OF_WEEK_FIELDS
+from habits.ratelimit import TelegramRateLimiter
+from habits.telegram import TelegramSender
+from habits.testing.fake_telegram import FakeTelegramServer
+
+
+class QueryCounter:
+    """Обертка для выполнения запросов к БД, считающая их количество"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Процентиль по методу ближайшего ранга"""
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный замер рассылки напоминаний.
+
+    Создает синтетических пользователей и привычки (по расписанию и с интервалом), затем выполняет
+    несколько тиков рассылки: постановку напоминаний в очередь и доставку через локальный сервер,
+    имитирующий Telegram. Рассылка ограничена созданными привычками и их чатами, поэтому напоминания
+    настоящих пользователей не затрагиваются (интервалы при этом выбираются из БД, а не из очереди Redis).
+    Выводит скорость, число запросов к БД на напоминание, пиковую память процесса (RSS) и длительность тиков.
+    Каждый тик соответствует следующей минуте, напоминания распределены по тикам поровну.
+    С --trace-memory дополнительно выводится пиковая память, выделенная при постановке напоминаний в очередь
+    (tracemalloc замедляет рассылку, поэтому скорость в этом режиме не показательна)
+    """
+
+    help = 'Нагрузочный замер рассылки напоминаний на синтетических данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Число пользователей')
+        parser.add_argument('--habits-per-user', type=int, default=2, help='Число привычек у пользователя')
+        parser.add_argument('--interval-share', type=float, default=0.5,
+                            help='Доля привычек с интервалом (остальные по расписанию)')
+        parser.add_argument('--ticks', type=int, default=10, help='Число тиков рассылки')
+        parser.add_argument('--latency', type=float, default=0.0, help='Задержка ответа Telegram, секунды')
+        parser.add_argument('--concurrency', type=int, default=settings.TELEGRAM_SEND_CONCURRENCY,
+                            help='Число параллельных отправок')
+        parser.add_argument('--shards', type=int, default=1, help='Число шардов рассылки')
+        parser.add_argument('--telegram-limits', action='store_true',
+                            help='Соблюдать лимиты Telegram (по умолчанию отправка без ограничения скорости)')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='Измерять память, выделяемую при постановке напоминаний в очередь')
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные данные')
+
+    def handle(self, *args, **options):
+        ticks = options['ticks']
+        base_datetime = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=ticks + 1)
+
+        seed_start = time.perf_counter()
+        prefix, chat_ids = self.seed(options, base_datetime)
+        self.stdout.write(f'Данные созданы за {time.perf_counter() - seed_start:.2f} с.')
+
+        try:
+            with FakeTelegramServer(latency=options['latency']) as server:
+                stats = self.run_ticks(options, base_datetime, server, prefix, chat_ids)
+        finally:
+            if not options['keep']:
+                delete_benchmark_data(prefix)
+
+        self.report(stats)
+
+    def seed(self, options: dict, base_datetime) -> tuple[str, range]:
+        """Создает пользователей и привычки, возвращает префикс имен созданных пользователей и диапазон их чатов"""
+
+        prefix, users = create_benchmark_users(options['users'], with_chats=True)
+        habits_count = options['users'] * options['habits_per_user']
+        intervals_count = round(habits_count * options['interval_share'])
+        fire_times = [base_datetime + timedelta(minutes=i % options['ticks'] + 1) for i in range(habits_count)]
+
+        create_benchmark_habits(
+            users,
+            [
+                Interval(interval=timedelta(days=1), next_fire_at=fire_time)
+                for fire_time in fire_times[:intervals_count]
+            ],
+            [
+                Schedule(**{field_name: fire_time.time() for field_name in DAYS_OF_WEEK_FIELDS})
+                for fire_time in fire_times[intervals_count:]
+            ]
+        )
+        return prefix, get_benchmark_chat_ids(users)
+
+    def run_ticks(self, options: dict, base_datetime, server: FakeTelegramServer, prefix: str, chat_ids: range) -> dict:
+        """Выполняет тики рассылки по созданным привычкам и собирает показатели"""
+
+        shards = options['shards']
+        habit_ids = get_benchmark_habits(prefix).values_list('pk', flat=True)
+        limiter = None
+        if not options['telegram_limits']:
+            limiter = TelegramRateLimiter(global_rate=float('inf'), chat_rate=float('inf'), group_rate=float('inf'))
+        sender = TelegramSender(concurrency=options['concurrency'], limiter=limiter)
+        sender.url = server.url + settings.TELEGRAM_TOKEN + '/sendMessage'
+
+        stats = {'enqueued': 0, 'sent': 0, 'durations': [], 'scan_memory': None}
+        counter = QueryCounter()
+        if options['trace_memory']:
+            tracemalloc.start()
+            stats['scan_memory'] = 0
+        with sender, connection.execute_wrapper(counter):
+            for tick in range(1, options['ticks'] + 1):
+                current_datetime = base_datetime + timedelta(minutes=tick)
+                start = time.perf_counter()
+                for shard in range(shards):
+                    if options['trace_memory']:
+                        tracemalloc.reset_peak()
+                        allocated_before, _ = tracemalloc.get_traced_memory()
+                    stats['enqueued'] += services.send_scheduled_reminder(shard, shards, current_datetime, habit_ids)
+                    stats['enqueued'] += services.send_interval_reminder(shard, shards, current_datetime, habit_ids)
+                    if options['trace_memory']:
+                        _, peak = tracemalloc.get_traced_memory()
+                        stats['scan_memory'] = max(stats['scan_memory'], peak - allocated_before)
+                for shard in range(shards):
+                    stats['sent'] += services.deliver_reminders(shard, shards, sender, chat_ids)
+                stats['durations'].append(time.perf_counter() - start)
+        if options['trace_memory']:
+            tracemalloc.stop()
+        stats['peak_memory'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stats['queries'] = counter.count
+        stats['received'] = len(server.messages)
+        return stats
+
+    def report(self, stats: dict) -> None:
+        durations = stats['durations']
+        total_duration = sum(durations)
+        sent = stats['sent']
+
+        self.stdout.write(f"Поставлено в очередь: {stats['enqueued']}, отправлено: {sent}, "
+                          f"получено сервером: {stats['received']}")
+        self.stdout.write(f"Скорость: {sent / total_duration if total_duration else 0:.1f} напоминаний/с")
+        self.stdout.write(f"Запросов к БД на напоминание: {stats['queries'] / sent if sent else 0:.3f} "
+                          f"(всего {stats['queries']})")
+        self.stdout.write(f"Пиковая память процесса: {stats['peak_memory'] / 1024:.1f} МБ")
+        if stats['scan_memory'] is not None:
+            self.stdout.write(f"Пиковая память постановки в очередь: {stats['scan_memory'] / 1024 / 1024:.1f} МБ")
+        self.stdout.write(f"Длительность тика: p50 {percentile(durations, 50):.3f} с, "
+                          f"p99 {percentile(durations, 99):.3f} с")
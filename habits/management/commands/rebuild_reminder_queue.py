@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand, CommandError
+
+from habits.models import Habit
+from habits.scheduler import get_due_queue, schedule_interval_habits
+from habits.services import stream
+
+
+class Command(BaseCommand):
+    """
+    Команда для пересборки очереди напоминаний с интервалом в Redis по данным из БД.
+
+    Нужна при включении планировщика Redis, после изменения числа шардов рассылки
+    и для восстановления очереди, если данные в Redis были потеряны
+    """
+
+    help = 'Пересобирает очередь напоминаний с интервалом в Redis по данным из БД'
+
+    BATCH_SIZE = 1000
+
+    def handle(self, *args, **options):
+        queue = get_due_queue()
+        if queue is None:
+            raise CommandError('Планировщик Redis не используется (REMINDER_SCHEDULER_BACKEND).')
+
+        queue.clear()
+        habits = Habit.objects.filter(
+            is_deliverable=True,
+            is_enjoyable=False,
+            interval__isnull=False
+        ).select_related('interval').only('is_deliverable', 'chat_id', 'interval__next_fire_at')
+
+        count = 0
+        for batch in stream(habits, self.BATCH_SIZE):
+            count += schedule_interval_habits(batch)
+        self.stdout.write(f'В очередь добавлено привычек: {count}.')
@@ -0,0 +1,26 @@
+import signal
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from habits.dispatcher import ReminderDispatcher
+
+
+class Command(BaseCommand):
+    """
+    Команда запуска диспетчера напоминаний (колесо таймеров вместо периодических рассылок celery beat).
+
+    Требует REMINDER_DISPATCHER_ENABLED=True: тогда изменения привычек передаются диспетчеру,
+    а периодические задачи рассылки пропускаются. Останавливается по SIGINT или SIGTERM
+    """
+
+    help = 'Запускает диспетчер напоминаний'
+
+    def handle(self, *args, **options):
+        if not settings.REMINDER_DISPATCHER_ENABLED:
+            raise CommandError('Диспетчер напоминаний выключен (REMINDER_DISPATCHER_ENABLED).')
+
+        dispatcher = ReminderDispatcher()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *args: dispatcher.stop())
+        dispatcher.run()
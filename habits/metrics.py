@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import NamedTuple
+
+import redis
+
+from habits.scheduler import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = 'habits:metrics'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+class Metric(NamedTuple):
+    """Описание метрики: тип (counter или histogram), описание и границы корзин гистограммы"""
+
+    type: str
+    help: str
+    buckets: tuple = ()
+
+
+METRICS = {
+    'habits_dispatch_tick_seconds': Metric('histogram', 'Длительность запуска рассылки', DURATION_BUCKETS),
+    'habits_dispatch_rows_scanned_total': Metric('counter', 'Число привычек, просмотренных рассылкой'),
+    'habits_dispatch_reminders_due_total': Metric('counter', 'Число напоминаний, поставленных в очередь'),
+    'habits_dispatch_skipped_ticks_total': Metric('counter', 'Число запусков, пропущенных из-за занятой блокировки'),
+    'habits_telegram_send_seconds': Metric('histogram', 'Длительность запроса к Telegram Bot API', DURATION_BUCKETS),
+    'habits_telegram_send_failures_total': Metric('counter', 'Число неудачных отправок по коду ответа'),
+    'habits_telegram_circuit_opened_total': Metric('counter', 'Число размыканий выключателя запросов к Telegram'),
+    'habits_telegram_circuit_rejected_total': Metric('counter',
+                                                     'Число отправок, отложенных разомкнутым выключателем'),
+    'habits_public_feed_cache_total': Metric('counter', 'Число запросов ленты публичных привычек по исходу кеша'),
+    'habits_reminder_lag_seconds': Metric('histogram', 'Задержка отправки напоминания от его времени по расписанию',
+                                          LAG_BUCKETS),
+}
+
+
+def format_series(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + '{' + ','.join(f'{key}="{value}"' for key, value in sorted(labels.items())) + '}'
+
+
+class MetricsBuffer:
+    """
+    Метрики рассылки, общие для всех процессов (веб-сервер, воркеры celery, диспетчер).
+
+    Значения накапливаются в памяти процесса и записываются в хеш Redis одним пакетом (flush) в конце
+    запуска задачи, а не при каждом событии. Ошибки Redis не прерывают рассылку: накопленные значения
+    в этом случае теряются
+    """
+
+    def __init__(self):
+        self.values = defaultdict(float)
+        self.flushed_at = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Увеличивает счетчик"""
+
+        with self._lock:
+            self.values[format_series(name, labels)] += value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Добавляет наблюдение в гистограмму"""
+
+        with self._lock:
+            for bucket in METRICS[name].buckets:
+                if value <= bucket:
+                    self.values[format_series(f'{name}_bucket', {**labels, 'le': bucket})] += 1
+            self.values[format_series(f'{name}_bucket', {**labels, 'le': '+Inf'})] += 1
+            self.values[format_series(f'{name}_sum', labels)] += value
+            self.values[format_series(f'{name}_count', labels)] += 1
+
+    def flush(self, min_interval: float = 0) -> None:
+        """
+        Записывает накопленные значения в Redis; с `min_interval` - не чаще раза в `min_interval` секунд
+        (для веб-запросов, где запись на каждый запрос обходилась бы дороже самого запроса)
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            if min_interval and now - self.flushed_at < min_interval:
+                return
+            self.flushed_at = now
+            values, self.values = self.values, defaultdict(float)
+        if not values:
+            return
+        try:
+            pipe = get_redis_client().pipeline(transaction=False)
+            for series, value in values.items():
+                pipe.hincrbyfloat(METRICS_KEY, series, value)
+            pipe.execute()
+        except redis.RedisError:
+            logger.exception('Не удалось записать метрики рассылки')
+
+
+metrics = MetricsBuffer()
+
+
+def render_metrics() -> str:
+    """Метрики в текстовом формате Prometheus (гистограммы выводятся со всеми корзинами, в том числе пустыми)"""
+
+    values = {
+        series.decode(): float(value) for series, value in get_redis_client().hgetall(METRICS_KEY).items()
+    }
+
+    lines = []
+    for name, metric in METRICS.items():
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        if metric.type == 'counter':
+            series_names = sorted(series for series in values if get_series_name(series) == name)
+        else:
+            series_names = []
+            for count_series in sorted(series for series in values if get_series_name(series) == f'{name}_count'):
+                labels = get_series_labels(count_series)
+                series_names.extend(
+                    format_series(f'{name}_bucket', {**labels, 'le': bucket}) for bucket in (*metric.buckets, '+Inf')
+                )
+                series_names.extend([format_series(f'{name}_sum', labels), count_series])
+        lines.extend(f'{series} {format_value(values.get(series, 0))}' for series in series_names)
+    return '\n'.join(lines) + '\n'
+
+
+def get_series_name(series: str) -> str:
+    return series.split('{')[0]
+
+
+def get_series_labels(series: str) -> dict:
+    if '{' not in series:
+        return {}
+    pairs = series[series.index('{') + 1:-1].split(',')
+    return dict((key, value.strip('"')) for key, value in (pair.split('=', 1) for pair in pairs))
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
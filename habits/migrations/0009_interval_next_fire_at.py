@@ -0,0 +1,32 @@
+# Generated by Django 4.2.6 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+def fill_next_fire_at(apps, schema_editor):
+    """
+    Заполняет время следующего напоминания для уже существующих интервалов.
+    Интервалы без отправленных напоминаний остаются пустыми и считаются готовыми к отправке,
+    окно активности учитывается при первой же обработке.
+    """
+
+    Interval = apps.get_model('habits', 'Interval')
+    Interval.objects.filter(last_event__isnull=False).update(
+        next_fire_at=models.F('last_event') + models.F('interval')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0008_schedule_last_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interval',
+            name='next_fire_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Время следующего напоминания'),
+        ),
+        migrations.RunPython(fill_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.6 on 2026-10-18 20:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+DAYS_OF_WEEK_FIELDS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def fill_fire_times(apps, schema_editor):
+    """Заполняет таблицу минут срабатывания для уже существующих расписаний"""
+
+    Schedule = apps.get_model('habits', 'Schedule')
+    ScheduleFireTime = apps.get_model('habits', 'ScheduleFireTime')
+
+    fire_times = []
+    for schedule in Schedule.objects.iterator():
+        for day_of_week, field_name in enumerate(DAYS_OF_WEEK_FIELDS):
+            value = getattr(schedule, field_name)
+            if value:
+                minute_of_week = day_of_week * 24 * 60 + value.hour * 60 + value.minute
+                fire_times.append(ScheduleFireTime(schedule_id=schedule.pk, minute_of_week=minute_of_week))
+    ScheduleFireTime.objects.bulk_create(fire_times, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0009_interval_next_fire_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleFireTime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute_of_week', models.PositiveSmallIntegerField(verbose_name='Минута от начала недели')),
+                ('schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fire_times', to='habits.schedule', verbose_name='Расписание')),
+            ],
+            options={
+                'verbose_name': 'Время срабатывания расписания',
+                'verbose_name_plural': 'Время срабатывания расписаний',
+                'indexes': [models.Index(fields=['minute_of_week', 'schedule'], name='habits_fire_time_minute_idx')],
+            },
+        ),
+        migrations.RunPython(fill_fire_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.6 on 2026-10-18 20:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0010_schedule_fire_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReminderOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fire_slot', models.DateTimeField(verbose_name='Время срабатывания')),
+                ('chat_id', models.BigIntegerField(verbose_name='Идентификатор чата телеграм')),
+                ('text', models.TextField(verbose_name='Текст напоминания')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('sent', 'Отправлено'), ('failed', 'Не удалось отправить')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Число попыток отправки')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время следующей попытки')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время постановки в очередь')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Время отправки')),
+                ('habit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='habits.habit', verbose_name='Привычка')),
+            ],
+            options={
+                'verbose_name': 'Напоминание в очереди',
+                'verbose_name_plural': 'Очередь напоминаний',
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at'], name='habits_outbox_pending_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reminderoutbox',
+            constraint=models.UniqueConstraint(fields=('habit', 'fire_slot'), name='habits_outbox_habit_fire_slot_uniq'),
+        ),
+    ]
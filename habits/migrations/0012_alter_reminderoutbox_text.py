@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0011_reminder_outbox'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reminderoutbox',
+            name='text',
+            field=models.TextField(verbose_name='Текст напоминания (без общего заголовка)'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.6 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+def fill_is_deliverable(apps, schema_editor):
+    """Отмечает привычки, по которым отправляются напоминания"""
+
+    Habit = apps.get_model('habits', 'Habit')
+    Habit.objects.filter(
+        models.Q(schedule__isnull=False) | models.Q(interval__isnull=False),
+        user__telegram_user_id__isnull=False,
+        user__telegram_blocked=False,
+        is_enjoyable=False
+    ).update(is_deliverable=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0012_alter_reminderoutbox_text'),
+        ('users', '0003_user_telegram_blocked'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='is_deliverable',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Напоминания доставляются'),
+        ),
+        migrations.RunPython(fill_is_deliverable, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(condition=models.Q(('is_deliverable', True), ('is_enjoyable', False), ('schedule__isnull', False)), fields=['schedule'], name='habits_deliv_schedule_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='habit',
+            index=models.Index(condition=models.Q(('interval__isnull', False), ('is_deliverable', True), ('is_enjoyable', False)), fields=['interval'], name='habits_deliv_interval_idx'),
+        ),
+    ]
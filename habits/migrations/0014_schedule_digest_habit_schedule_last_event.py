@@ -0,0 +1,48 @@
+# Generated by Django 4.2.6 on 2026-10-18 21:34
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_last_event(apps, schema_editor):
+    """Переносит дату последней отправки напоминания из расписания в привычку"""
+
+    Habit = apps.get_model('habits', 'Habit')
+    Schedule = apps.get_model('habits', 'Schedule')
+    Habit.objects.filter(schedule__last_event__isnull=False).update(
+        schedule_last_event=Subquery(Schedule.objects.filter(pk=OuterRef('schedule_id')).values('last_event')[:1])
+    )
+
+
+def restore_last_event(apps, schema_editor):
+    Habit = apps.get_model('habits', 'Habit')
+    Schedule = apps.get_model('habits', 'Schedule')
+    Schedule.objects.update(last_event=Subquery(
+        Habit.objects.filter(schedule_id=OuterRef('pk')).order_by('-schedule_last_event').values(
+            'schedule_last_event')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0013_habit_is_deliverable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='schedule_last_event',
+            field=models.DateField(blank=True, null=True, verbose_name='Дата последней отправки напоминания по расписанию'),
+        ),
+        migrations.RunPython(copy_last_event, restore_last_event),
+        migrations.RemoveField(
+            model_name='schedule',
+            name='last_event',
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='digest',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='Хеш времени по дням недели (у общих расписаний)'),
+        ),
+    ]
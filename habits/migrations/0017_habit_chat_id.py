@@ -0,0 +1,29 @@
+# Generated by Django 4.2.6 on 2026-10-18 22:11
+
+from django.db import migrations, models
+
+
+def fill_chat_id(apps, schema_editor):
+    """Копирует чат telegram пользователя в привычки, по которым отправляются напоминания"""
+
+    Habit = apps.get_model('habits', 'Habit')
+    User = apps.get_model('users', 'User')
+    Habit.objects.filter(is_deliverable=True).update(
+        chat_id=models.Subquery(User.objects.filter(pk=models.OuterRef('user_id')).values('telegram_user_id'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('habits', '0016_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='habit',
+            name='chat_id',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='Идентификатор чата телеграм'),
+        ),
+        migrations.RunPython(fill_chat_id, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,45 @@
-from datetime import timedelta
+import hashlib
+from datetime import timedelta, time
 
 from django.db import models
+from django.utils import timezone
 
 from users.models import User
 
 
 NULLABLE = {'null': True, 'blank': True}
 
+DAYS_OF_WEEK_FIELDS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+MINUTES_IN_DAY = 24 * 60
+
+
+def get_minute_of_week(day_of_week: int, value: time) -> int:
+    """Номер минуты от начала недели (понедельник, 00:00) для заданного дня недели и времени"""
+
+    return day_of_week * MINUTES_IN_DAY + value.hour * 60 + value.minute
+
+
+def get_deliverable_q(prefix: str = '') -> models.Q:
+    """
+    Условие, при котором по привычке отправляются напоминания: у пользователя есть доступный чат telegram,
+    привычка не приятная и у нее есть расписание или интервал (то же, что Habit.get_is_deliverable)
+    """
+
+    return models.Q(**{
+        f'{prefix}user__telegram_user_id__isnull': False,
+        f'{prefix}user__telegram_blocked': False,
+        f'{prefix}is_enjoyable': False,
+    }) & (models.Q(**{f'{prefix}schedule__isnull': False}) | models.Q(**{f'{prefix}interval__isnull': False}))
+
 
 class Schedule(models.Model):
-    """Расписание для привычки по дням недели"""
+    """
+    Расписание для привычки по дням недели
+
+    В режиме SCHEDULE_INTERNING_ENABLED привычки с одинаковым временем по дням недели ссылаются
+    на одно общее расписание, найденное по хешу (digest). Общие расписания не изменяются и не удаляются:
+    при изменении расписания привычке назначается другое (см. services.get_or_create_schedule)
+    """
 
     monday = models.TimeField(**NULLABLE, verbose_name='Понедельник, время выполнения')
     tuesday = models.TimeField(**NULLABLE, verbose_name='Вторник, время выполнения')
@@ -19,7 +49,9 @@ class Schedule(models.Model):
     saturday = models.TimeField(**NULLABLE, verbose_name='Суббота, время выполнения')
     sunday = models.TimeField(**NULLABLE, verbose_name='Воскресенье, время выполнения')
 
-    last_event = models.DateField(**NULLABLE, verbose_name='Дата последней отправки напоминания')
+    digest = models.CharField(max_length=64, unique=True, **NULLABLE, editable=False,
+                              verbose_name='Хеш времени по дням недели (у общих расписаний)')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения')
 
     def __str__(self):
         days_of_week = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
@@ -34,11 +66,70 @@ class Schedule(models.Model):
 
         return ', '.join(schedule)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & set(DAYS_OF_WEEK_FIELDS):
+            self.sync_fire_times()
+
+    @classmethod
+    def get_digest(cls, values: dict) -> str:
+        """Хеш времени по дням недели: одинаковый у расписаний с одинаковым временем во все дни"""
+
+        parts = []
+        for field_name in DAYS_OF_WEEK_FIELDS:
+            value = cls._meta.get_field(field_name).to_python(values.get(field_name))
+            parts.append(f'{field_name}={value.isoformat() if value else ""}')
+        return hashlib.sha256(';'.join(parts).encode()).hexdigest()
+
+    def get_minutes_of_week(self) -> list[int]:
+        """Минуты недели, в которые по расписанию должно отправляться напоминание"""
+
+        minutes = []
+        for day_of_week, field_name in enumerate(DAYS_OF_WEEK_FIELDS):
+            value = self._meta.get_field(field_name).to_python(getattr(self, field_name))
+            if value:
+                minutes.append(get_minute_of_week(day_of_week, value))
+        return minutes
+
+    def sync_fire_times(self) -> None:
+        """Пересобирает таблицу минут недели, в которые срабатывает расписание"""
+
+        self.fire_times.all().delete()
+        ScheduleFireTime.objects.bulk_create(
+            ScheduleFireTime(schedule=self, minute_of_week=minute) for minute in self.get_minutes_of_week()
+        )
+
     class Meta:
         verbose_name = 'Расписание'
         verbose_name_plural = 'Расписания'
 
 
+class ScheduleFireTime(models.Model):
+    """
+    Производная от расписания таблица: минута недели, в которую срабатывает расписание.
+
+    Поддерживается в актуальном состоянии при сохранении расписания и позволяет
+    находить привычки, по которым пора отправить напоминание, одним поиском по индексу
+    """
+
+    schedule = models.ForeignKey(Schedule,
+                                 on_delete=models.CASCADE,
+                                 related_name='fire_times',
+                                 verbose_name='Расписание')
+    minute_of_week = models.PositiveSmallIntegerField(verbose_name='Минута от начала недели')
+
+    def __str__(self):
+        return f'{self.schedule_id}: {self.minute_of_week}'
+
+    class Meta:
+        verbose_name = 'Время срабатывания расписания'
+        verbose_name_plural = 'Время срабатывания расписаний'
+        indexes = [
+            models.Index(fields=['minute_of_week', 'schedule'], name='habits_fire_time_minute_idx'),
+        ]
+
+
 class Interval(models.Model):
     """Интервал между напоминаниями о привычке"""
 
@@ -46,6 +137,8 @@ class Interval(models.Model):
     start_time = models.TimeField(**NULLABLE, verbose_name='Время старта')
     end_time = models.TimeField(**NULLABLE, verbose_name='Время окончания')
     last_event = models.DateTimeField(**NULLABLE, verbose_name='Время последнего напоминания')
+    next_fire_at = models.DateTimeField(**NULLABLE, db_index=True, verbose_name='Время следующего напоминания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения')
 
     def __str__(self):
         return f'Интервал продолжительностью в {self.interval} часов'
@@ -78,6 +171,16 @@ class Habit(models.Model):
                                       **NULLABLE,
                                       on_delete=models.SET_NULL,
                                       verbose_name='Связанная привычка')
+    schedule_last_event = models.DateField(**NULLABLE, verbose_name='Дата последней отправки напоминания по расписанию')
+
+    # Производные поля (get_deliverable_q и чат telegram пользователя, если напоминания доставляются):
+    # пересчитываются при сохранении привычки и при изменении чата пользователя (sync_habits_deliverable),
+    # чтобы рассылки выбирали привычки по частичному индексу и делили их на шарды без users_user
+    is_deliverable = models.BooleanField(default=False, editable=False, verbose_name='Напоминания доставляются')
+    chat_id = models.BigIntegerField(**NULLABLE, editable=False, verbose_name='Идентификатор чата телеграм')
+    # Время изменения привычки (и в ETag - ее расписания и интервала, см. habits.etags): массовые обновления
+    # полей, которые видны в API, должны обновлять его сами
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Время изменения')
 
     def __str__(self):
         primary_text = f'{self.operation}'
@@ -90,6 +193,91 @@ class Habit(models.Model):
         else:
             return (primary_text + place).capitalize()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Была ли привычка публичной при загрузке (None, если поле не загружено): по нему сигналы решают,
+        # нужно ли сбросить кеш ленты публичных привычек
+        instance._loaded_is_public = instance.__dict__.get('is_public')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & {'user', 'is_enjoyable', 'schedule', 'interval'}:
+            self.update_delivery()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'is_deliverable', 'chat_id'}
+        super().save(*args, **kwargs)
+
+    def update_delivery(self) -> None:
+        """Пересчитывает производные поля is_deliverable и chat_id (без сохранения)"""
+
+        self.is_deliverable = self.get_is_deliverable()
+        self.chat_id = self.user.telegram_user_id if self.is_deliverable else None
+
+    def get_is_deliverable(self) -> bool:
+        return bool(
+            self.user.telegram_user_id and not self.user.telegram_blocked
+            and not self.is_enjoyable and (self.schedule_id or self.interval_id)
+        )
+
     class Meta:
         verbose_name = 'Привычка'
-        verbose_name_plural = 'Привычки'
\ No newline at end of file
+        verbose_name_plural = 'Привычки'
+        indexes = [
+            models.Index(fields=['schedule'],
+                         condition=models.Q(is_deliverable=True, is_enjoyable=False, schedule__isnull=False),
+                         name='habits_deliv_schedule_idx'),
+            models.Index(fields=['interval'],
+                         condition=models.Q(is_deliverable=True, is_enjoyable=False, interval__isnull=False),
+                         name='habits_deliv_interval_idx'),
+            # Постраничный вывод по курсору (HabitCursorPagination): списки привычек пользователя и публичных
+            models.Index(fields=['user', 'id'], name='habits_user_id_idx'),
+            models.Index(fields=['id'], condition=models.Q(is_public=True), name='habits_public_id_idx'),
+        ]
+
+
+class ReminderOutbox(models.Model):
+    """
+    Очередь напоминаний к отправке (transactional outbox).
+
+    Сканеры рассылок только добавляют сюда готовые сообщения в той же транзакции,
+    в которой отмечают привычку обработанной, а отправкой занимается отдельная задача доставки.
+    Ключ идемпотентности - привычка и время срабатывания, поэтому одно напоминание не попадет в очередь дважды
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Не удалось отправить'),
+    )
+
+    habit = models.ForeignKey(Habit, on_delete=models.CASCADE, verbose_name='Привычка')
+    fire_slot = models.DateTimeField(verbose_name='Время срабатывания')
+    chat_id = models.BigIntegerField(verbose_name='Идентификатор чата телеграм')
+    text = models.TextField(verbose_name='Текст напоминания (без общего заголовка)')
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='Статус')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Число попыток отправки')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='Время следующей попытки')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Время постановки в очередь')
+    sent_at = models.DateTimeField(**NULLABLE, verbose_name='Время отправки')
+
+    def __str__(self):
+        return f'Напоминание для чата {self.chat_id} на {self.fire_slot}'
+
+    class Meta:
+        verbose_name = 'Напоминание в очереди'
+        verbose_name_plural = 'Очередь напоминаний'
+        constraints = [
+            models.UniqueConstraint(fields=['habit', 'fire_slot'], name='habits_outbox_habit_fire_slot_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['next_attempt_at'],
+                         condition=models.Q(status='pending'),
+                         name='habits_outbox_pending_idx'),
+        ]
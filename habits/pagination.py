@@ -1,6 +1,37 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 
 class FiveObjectsPagination(PageNumberPagination):
     page_size = 5
     max_page_size = 10
+
+
+class HabitCursorPagination(CursorPagination):
+    """
+    Постраничный вывод по курсору (keyset): следующая страница выбирается условием id > id последней записи,
+    без COUNT(*) и OFFSET, поэтому любая страница стоит одинаково при индексе, заканчивающемся на id.
+    Размер страницы задается параметром page_size, но не больше max_page_size
+    """
+
+    ordering = 'id'
+    page_size = 5
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class CursorPaginationMixin:
+    """
+    Примесь к представлению списка: постраничный вывод по курсору включается параметром запроса
+    pagination=cursor (он сохраняется в ссылках next и previous), по умолчанию используется pagination_class
+    """
+
+    cursor_pagination_class = HabitCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class() if self.pagination_class else None
+        return self._paginator
@@ -0,0 +1,67 @@
+from django.db.models import QuerySet
+from rest_framework import serializers
+
+from habits.models import DAYS_OF_WEEK_FIELDS
+from habits.serializers import format_interval, format_lead_time
+
+# Поля выборки .values() для списка привычек: все, что выводит HabitSerializer, и время изменения для ETag
+HABIT_LIST_VALUES = (
+    'id', 'user_id', 'place', 'operation', 'is_enjoyable', 'reward', 'lead_time', 'is_public', 'related_habit_id',
+    'updated_at', 'schedule_id', *(f'schedule__{field_name}' for field_name in DAYS_OF_WEEK_FIELDS),
+    'schedule__updated_at', 'interval_id', 'interval__interval', 'interval__start_time', 'interval__end_time',
+    'interval__last_event', 'interval__updated_at',
+)
+
+# Те же поля сериализатора, что выводят время и дату, чтобы формат совпадал с HabitSerializer
+time_field = serializers.TimeField()
+datetime_field = serializers.DateTimeField()
+
+
+def get_habit_rows(habits: QuerySet) -> QuerySet:
+    """Выборка привычек в виде словарей (без создания моделей) для render_habit_rows"""
+
+    return habits.values(*HABIT_LIST_VALUES)
+
+
+def render_time(value):
+    return None if value is None else time_field.to_representation(value)
+
+
+def render_habit_rows(rows: list[dict]) -> list[dict]:
+    """
+    Данные списка привычек из строк get_habit_rows, совпадающие с выводом HabitSerializer(many=True)
+    (те же ключи в том же порядке и те же значения), но без экземпляров моделей и полей сериализатора
+    """
+
+    data = []
+    for row in rows:
+        schedule = None
+        if row['schedule_id'] is not None:
+            schedule = {'id': row['schedule_id']}
+            for field_name in DAYS_OF_WEEK_FIELDS:
+                schedule[field_name] = render_time(row[f'schedule__{field_name}'])
+
+        interval = None
+        if row['interval_id'] is not None:
+            last_event = row['interval__last_event']
+            interval = {
+                'id': row['interval_id'],
+                'interval_string': format_interval(row['interval__interval']),
+                'start_time': render_time(row['interval__start_time']),
+                'end_time': render_time(row['interval__end_time']),
+                'last_event': None if last_event is None else datetime_field.to_representation(last_event),
+            }
+
+        data.append({
+            'user': row['user_id'],
+            'place': row['place'],
+            'operation': row['operation'],
+            'is_enjoyable': row['is_enjoyable'],
+            'reward': row['reward'],
+            'lead_time_string': format_lead_time(row['lead_time']),
+            'is_public': row['is_public'],
+            'schedule': schedule,
+            'interval': interval,
+            'related_habit': row['related_habit_id'],
+        })
+    return data
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from typing import Callable
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ведро токенов, реализованное через теоретическое время прибытия (GCRA).
+
+    Вместо хранения числа токенов хранится момент, когда ведро снова станет полным (tat);
+    это позволяет заранее резервировать время отправки и не превышать заданную скорость
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.capacity = capacity
+        self.tat = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self.tolerance = (self.capacity - 1) * self.interval
+
+    def available_at(self) -> float:
+        """Самый ранний момент, когда в ведре будет токен"""
+
+        return self.tat - self.tolerance
+
+    def consume(self, at: float) -> None:
+        """Забирает токен в момент `at` (не раньше available_at)"""
+
+        self.tat = max(self.tat, at) + self.interval
+
+
+class TelegramRateLimiter:
+    """
+    Ограничитель скорости отправки сообщений в Telegram.
+
+    Учитывает общий лимит бота, лимит на личный чат и отдельный лимит для групповых чатов
+    (у групп chat_id отрицательный). После ответа 429 отправка приостанавливается на retry_after секунд
+    """
+
+    MAX_IDLE_CHATS = 10000
+
+    def __init__(self,
+                 global_rate: float,
+                 chat_rate: float,
+                 group_rate: float,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_buckets = {}
+        self.paused_until = 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+
+    def acquire(self, chat_id: int) -> float:
+        """
+        Ожидает, пока сообщение в чат можно будет отправить, не нарушая лимитов, и возвращает момент отправки.
+
+        Общий лимит резервируется только когда подошла очередь чата,
+        чтобы ожидание одного чата не задерживало сообщения в другие чаты
+        """
+
+        while True:
+            with self._lock:
+                now = self.clock()
+                chat_bucket = self._get_chat_bucket(chat_id, now)
+                ready_at = max(self.paused_until, chat_bucket.available_at())
+                if ready_at <= now:
+                    send_at = max(now, self.global_bucket.available_at())
+                    chat_bucket.consume(send_at)
+                    self.global_bucket.consume(send_at)
+                    break
+            self.sleep(ready_at - now)
+
+        if send_at > now:
+            self.sleep(send_at - now)
+        return send_at
+
+    def pause(self, retry_after: float) -> None:
+        """Приостанавливает все отправки на retry_after секунд (ответ 429 от Telegram)"""
+
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + retry_after)
+
+    def _get_chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_IDLE_CHATS:
+                self.chat_buckets = {
+                    key: value for key, value in self.chat_buckets.items() if value.tat > now
+                }
+            bucket = TokenBucket(self.group_rate if chat_id < 0 else self.chat_rate)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+
+class RedisTelegramRateLimiter(TelegramRateLimiter):
+    """
+    Ограничитель скорости отправки в Telegram, общий для всех процессов и шардов рассылки.
+
+    Теоретическое время прибытия (GCRA) общего лимита бота и лимитов чатов, а также пауза после ответа 429
+    хранятся в Redis и проверяются одним скриптом Lua, поэтому параллельные воркеры вместе не превышают
+    лимиты Telegram. Время берется из `clock` (по умолчанию time.time, часы серверов должны быть
+    синхронизированы). Если Redis недоступен, используется ограничитель в памяти процесса
+    """
+
+    # Проверка лимитов и резерв времени отправки: возвращает {1, время отправки}
+    # или {0, время, раньше которого отправлять нельзя}. Время передается строкой, чтобы не терять дробную часть
+    ACQUIRE_SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local chat_tat = tonumber(redis.call('GET', KEYS[2]) or 0)
+    local ready_at = math.max(tonumber(redis.call('GET', KEYS[1]) or 0), chat_tat)
+    if ready_at > now then
+        return {0, tostring(ready_at)}
+    end
+    local send_at = math.max(now, tonumber(redis.call('GET', KEYS[3]) or 0))
+    chat_tat = math.max(chat_tat, send_at) + tonumber(ARGV[2])
+    local global_tat = send_at + tonumber(ARGV[3])
+    redis.call('SET', KEYS[2], tostring(chat_tat), 'PX', math.ceil((chat_tat - now) * 1000) + 1000)
+    redis.call('SET', KEYS[3], tostring(global_tat), 'PX', math.ceil((global_tat - now) * 1000) + 1000)
+    return {1, tostring(send_at)}
+    """
+
+    PAUSE_SCRIPT = """
+    local paused_until = tonumber(ARGV[1])
+    if paused_until > tonumber(redis.call('GET', KEYS[1]) or 0) then
+        redis.call('SET', KEYS[1], tostring(paused_until), 'PX', math.ceil(tonumber(ARGV[2]) * 1000) + 1000)
+    end
+    """
+
+    def __init__(self,
+                 client: redis.Redis,
+                 global_rate: float,
+                 chat_rate: float,
+                 group_rate: float,
+                 clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], None] = time.sleep,
+                 key_prefix: str = 'habits:telegram_rate'):
+        super().__init__(global_rate, chat_rate, group_rate, clock=clock, sleep=sleep)
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def acquire(self, chat_id: int) -> float:
+        """
+        То же, что TelegramRateLimiter.acquire, но с лимитами в Redis.
+        Ключи чатов удаляются сами, когда их лимит перестает влиять на отправку (PX)
+        """
+
+        keys = (f'{self.key_prefix}:paused', f'{self.key_prefix}:chat:{chat_id}', f'{self.key_prefix}:global')
+        chat_interval = 1 / (self.group_rate if chat_id < 0 else self.chat_rate)
+        while True:
+            now = self.clock()
+            try:
+                is_ready, at = self.client.eval(self.ACQUIRE_SCRIPT, len(keys), *keys,
+                                                repr(now), repr(chat_interval), repr(self.global_bucket.interval))
+            except redis.RedisError as e:
+                logger.warning(f"Redis недоступен, лимиты Telegram проверяются в памяти процесса. Ошибка: {e}")
+                return super().acquire(chat_id)
+            at = float(at)
+            if is_ready:
+                break
+            self.sleep(at - now)
+
+        if at > now:
+            self.sleep(at - now)
+        return at
+
+    def pause(self, retry_after: float) -> None:
+        """Приостанавливает отправки всех процессов (и ограничителя в памяти на случай недоступности Redis)"""
+
+        super().pause(retry_after)
+        try:
+            self.client.eval(self.PAUSE_SCRIPT, 1, f'{self.key_prefix}:paused',
+                             repr(self.clock() + retry_after), repr(retry_after))
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось записать паузу отправки в Redis. Ошибка: {e}")
@@ -0,0 +1,125 @@
+import time
+from datetime import datetime, timedelta
+from typing import Iterable
+
+import redis
+from django.conf import settings
+from django.utils import timezone
+
+from habits.models import Habit
+
+
+class RedisDueQueue:
+    """
+    Очередь напоминаний с интервалом в сортированных множествах Redis.
+
+    Элемент множества — id привычки, вес — время следующего напоминания (timestamp).
+    Привычки распределяются по множествам шардов по остатку от деления идентификатора чата telegram,
+    как и в рассылке из базы данных (filter_shard), поэтому при изменении REMINDER_DISPATCH_SHARDS
+    очередь нужно пересобрать командой rebuild_reminder_queue
+    """
+
+    def __init__(self, client: redis.Redis, shards: int, key_prefix: str = 'habits:interval_due'):
+        self.client = client
+        self.shards = max(shards, 1)
+        self.key_prefix = key_prefix
+
+    def key(self, shard: int) -> str:
+        return f'{self.key_prefix}:{shard}'
+
+    def add(self, items: Iterable[tuple[int, int, datetime]]) -> None:
+        """Добавляет (или переносит) привычки вида (id привычки, id чата, время напоминания)"""
+
+        pipe = self.client.pipeline(transaction=False)
+        for habit_id, chat_id, fire_at in items:
+            pipe.zadd(self.key(chat_id % self.shards), {habit_id: fire_at.timestamp()})
+        pipe.execute()
+
+    def remove(self, habit_ids: Iterable[int]) -> None:
+        """Удаляет привычки из очереди (из множеств всех шардов)"""
+
+        habit_ids = list(habit_ids)
+        if not habit_ids:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for shard in range(self.shards):
+            pipe.zrem(self.key(shard), *habit_ids)
+        pipe.execute()
+
+    # Выборка подошедших привычек и перенос их веса на время окончания аренды одним атомарным скриптом
+    CLAIM_SCRIPT = """
+    local members = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+    for _, member in ipairs(members) do
+        redis.call('ZADD', KEYS[1], ARGV[3], member)
+    end
+    return members
+    """
+
+    def claim_due(self, shard: int, until: datetime, count: int, lease: timedelta | None = None) -> list[int]:
+        """
+        Забирает в обработку не более `count` привычек шарда, время напоминания которых не позже `until`.
+
+        Привычки не удаляются из очереди, а получают вес на `lease` (REMINDER_QUEUE_LEASE) позже
+        текущего времени: выборка и перенос выполняются одним скриптом Lua, поэтому параллельные задачи
+        не заберут одну привычку дважды. После записи в БД привычки возвращаются в очередь со временем
+        следующего напоминания (add) или удаляются (remove); если обработчик упал раньше, привычки снова
+        станут доступны по окончании аренды и не потеряются
+        """
+
+        if lease is None:
+            lease = settings.REMINDER_QUEUE_LEASE
+        leased_until = max(time.time(), until.timestamp()) + lease.total_seconds()
+        members = self.client.eval(self.CLAIM_SCRIPT, 1, self.key(shard), until.timestamp(), count, leased_until)
+        return [int(member) for member in members]
+
+    def clear(self) -> None:
+        """Удаляет множества всех шардов (в том числе оставшиеся от прежнего числа шардов)"""
+
+        keys = list(self.client.scan_iter(match=f'{self.key_prefix}:*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+_client = None
+_queue = None
+
+
+def get_redis_client() -> redis.Redis:
+    """Общий для процесса клиент Redis (REDIS_URL)"""
+
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def get_due_queue() -> RedisDueQueue | None:
+    """Очередь Redis, если выбран планировщик REMINDER_SCHEDULER_BACKEND='redis', иначе None (очередь в БД)"""
+
+    global _queue
+    if settings.REMINDER_SCHEDULER_BACKEND != 'redis':
+        return None
+    if _queue is None or _queue.shards != settings.REMINDER_DISPATCH_SHARDS:
+        _queue = RedisDueQueue(get_redis_client(), settings.REMINDER_DISPATCH_SHARDS)
+    return _queue
+
+
+def schedule_interval_habits(habits: Iterable[Habit]) -> int:
+    """
+    Добавляет привычки с интервалом в очередь Redis (если она используется) со временем interval.next_fire_at.
+
+    Привычки пользователей без чата telegram (или с недоступным чатом) в очередь не попадают, их добавляют,
+    когда пользователь начинает диалог с ботом. Возвращается число добавленных привычек
+    """
+
+    queue = get_due_queue()
+    if queue is None:
+        return 0
+
+    items = [
+        (habit.pk, habit.chat_id, habit.interval.next_fire_at or timezone.now())
+        for habit in habits
+        if habit.interval_id and habit.is_deliverable
+    ]
+    queue.add(items)
+    return len(items)
@@ -1,9 +1,25 @@
 from datetime import timedelta
 
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
-from habits.models import Habit, Schedule, Interval
+from habits.models import Habit, Schedule, Interval, DAYS_OF_WEEK_FIELDS
+from habits.scheduler import schedule_interval_habits
+from habits.services import get_interval_next_fire_at, get_or_create_schedule
+
+
+def format_interval(interval: timedelta) -> str:
+    total_seconds = round(interval.total_seconds())
+    return f'Через каждые {total_seconds // 3600} часов'
+
+
+def format_lead_time(lead_time: timedelta | None) -> str | None:
+    if lead_time:
+        seconds = round(lead_time.total_seconds())
+        return f'В течение {seconds} секунд'
+    return None
 
 
 class ScheduleSerializer(serializers.ModelSerializer):
@@ -11,7 +27,7 @@ class ScheduleSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Schedule
-        exclude = ('last_event', )
+        exclude = ('digest', 'updated_at')
 
     def validate(self, attrs):
         if not any(attrs.values()):
@@ -48,8 +64,7 @@ class IntervalSerializer(serializers.ModelSerializer):
         return super().validate(value)
 
     def get_interval_string(self, obj):
-        total_seconds = round(obj.interval.total_seconds())
-        return f'Через каждые {total_seconds // 3600} часов'
+        return format_interval(obj.interval)
 
 
 class HabitSerializer(serializers.ModelSerializer):
@@ -117,25 +132,36 @@ class HabitSerializer(serializers.ModelSerializer):
         interval_data = validated_data.pop('interval', None)
 
         if schedule_data is not None:
-            validated_data['schedule'] = Schedule.objects.create(**schedule_data)
+            validated_data['schedule'] = self.get_schedule(schedule_data)
 
         if interval_data is not None:
-            validated_data['interval'] = Interval.objects.create(**interval_data)
+            interval = Interval(**interval_data)
+            interval.next_fire_at = get_interval_next_fire_at(interval, timezone.now())
+            interval.save()
+            validated_data['interval'] = interval
 
-        return super().create(validated_data)
+        habit = super().create(validated_data)
+        transaction.on_commit(lambda: schedule_interval_habits([habit]))
+        return habit
 
     @transaction.atomic
     def update(self, instance, validated_data):
         schedule_data = validated_data.pop('schedule', None)
         interval_data = validated_data.pop('interval', None)
 
+        replaced_schedule = None
         if schedule_data:
-            if instance.schedule:
+            if instance.schedule and not instance.schedule.digest and not settings.SCHEDULE_INTERNING_ENABLED:
                 for key, value in schedule_data.items():
                     setattr(instance.schedule, key, value)
                 instance.schedule.save()
+            elif instance.schedule:
+                # Общее расписание не изменяется: привычке назначается расписание с новым временем
+                values = {field_name: getattr(instance.schedule, field_name) for field_name in DAYS_OF_WEEK_FIELDS}
+                replaced_schedule = instance.schedule
+                instance.schedule = self.get_schedule({**values, **schedule_data})
             else:
-                instance.schedule = Schedule.objects.create(**schedule_data)
+                instance.schedule = self.get_schedule(schedule_data)
                 if instance.interval:
                     interval = instance.interval
                     instance.interval = None
@@ -145,23 +171,35 @@ class HabitSerializer(serializers.ModelSerializer):
             if instance.interval:
                 for key, value in interval_data.items():
                     setattr(instance.interval, key, value)
+                instance.interval.next_fire_at = get_interval_next_fire_at(instance.interval, timezone.now())
                 instance.interval.save()
             else:
-                instance.interval = Interval.objects.create(**interval_data)
+                interval = Interval(**interval_data)
+                interval.next_fire_at = get_interval_next_fire_at(interval, timezone.now())
+                interval.save()
+                instance.interval = interval
                 if instance.schedule:
-                    schedule = instance.schedule
+                    replaced_schedule = instance.schedule
                     instance.schedule = None
-                    schedule.delete()
 
         instance.save()
+        if replaced_schedule is not None and not replaced_schedule.digest and replaced_schedule != instance.schedule:
+            replaced_schedule.delete()
+
+        habit = super().update(instance, validated_data)
+        transaction.on_commit(lambda: schedule_interval_habits([habit]))
+        return habit
+
+    @staticmethod
+    def get_schedule(schedule_data: dict) -> Schedule:
+        """Общее расписание с заданным временем в режиме SCHEDULE_INTERNING_ENABLED, иначе отдельное"""
 
-        return super().update(instance, validated_data)
+        if settings.SCHEDULE_INTERNING_ENABLED:
+            return get_or_create_schedule(schedule_data)
+        return Schedule.objects.create(**schedule_data)
 
     def get_lead_time_string(self, obj):
-        if obj.lead_time:
-            seconds = round(obj.lead_time.total_seconds())
-            return f'В течение {seconds} секунд'
-        return
+        return format_lead_time(obj.lead_time)
 
 
 
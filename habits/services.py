@@ -1,68 +1,532 @@
 import logging
-from datetime import time
+from datetime import time, datetime, timedelta
+from itertools import islice
+from typing import Iterable, Iterator
 
-import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, F, Value, QuerySet, ExpressionWrapper, DateTimeField, Subquery, OuterRef
+from django.db.models.functions import Mod
 from django.utils import timezone
 
-from config import settings
-from habits.models import Habit
+from habits.models import Habit, Schedule, Interval, ReminderOutbox, DAYS_OF_WEEK_FIELDS, MINUTES_IN_DAY, \
+    get_minute_of_week, get_deliverable_q
+from habits.metrics import metrics
+from habits.scheduler import RedisDueQueue, get_due_queue, schedule_interval_habits
+from habits.telegram import TelegramMessage, TelegramSender, get_telegram_sender
 from users.models import User
 
 logger = (logging.getLogger(__name__))
 
+REMINDER_HEADER = 'Напоминание! Формируем привычку, следуй указанию\n\n'
+REMINDER_SEPARATOR = '\n'
+REMINDER_FOOTER = 'Успехов!'
 
-def send_scheduled_reminder() -> None:
-    """Функция для отправки напоминаний о привычке в соответствии с недельным расписанием"""
+# Поля, которые читаются при постановке напоминания в очередь и формировании его текста
+# (связанная привычка выводится через Habit.__str__, которому нужны ее расписание и интервал)
+REMINDER_HABIT_FIELDS = (
+    'place', 'operation', 'reward', 'lead_time', 'schedule', 'interval', 'is_deliverable', 'chat_id',
+    'related_habit__place', 'related_habit__operation', 'related_habit__interval__interval',
+    *(f'related_habit__schedule__{field_name}' for field_name in DAYS_OF_WEEK_FIELDS),
+)
+REMINDER_INTERVAL_FIELDS = ('interval__interval', 'interval__start_time', 'interval__end_time',
+                            'interval__last_event', 'interval__next_fire_at')
 
-    days_fields = [
-        'monday', 'tuesday', 'wednesday',
-        'thursday', 'friday', 'saturday', 'sunday'
-    ]
 
-    current_datetime = timezone.now()
-    current_date = timezone.now().date()
-    current_time = current_datetime.time().replace(second=0, microsecond=0)
+def send_scheduled_reminder(shard: int = 0,
+                            shards: int = 1,
+                            current_datetime: datetime | None = None,
+                            habit_ids: Iterable[int] | None = None) -> int:
+    """
+    Функция для постановки в очередь напоминаний о привычке в соответствии с недельным расписанием
+
+    Расписания выбираются по таблице минут срабатывания: текущая минута недели
+    плюс пропущенные минуты сегодняшнего дня в пределах SCHEDULED_REMINDER_LOOKBACK_MINUTES.
+    Время напоминания вычисляется один раз для каждого расписания, после чего напоминания ставятся
+    всем привычкам с этим расписанием (при общих расписаниях их может быть много).
+    Напоминания добавляются в очередь (ReminderOutbox) в одной транзакции с отметкой об отправке,
+    отправляет их deliver_reminders.
+    Обрабатываются только пользователи шарда `shard` из `shards`, возвращается число напоминаний в очереди.
+    Момент рассылки `current_datetime` по умолчанию текущий (задается явно в нагрузочных замерах),
+    `habit_ids` ограничивает рассылку заданными привычками (их передает диспетчер напоминаний)
+    """
+
+    current_datetime = current_datetime or timezone.now()
+    current_date = current_datetime.date()
     day_of_week = current_datetime.weekday()
 
-    current_day_field = days_fields[day_of_week]
+    current_day_field = DAYS_OF_WEEK_FIELDS[day_of_week]
+
+    current_minute = get_minute_of_week(day_of_week, current_datetime.time())
+    first_minute = max(current_minute - settings.SCHEDULED_REMINDER_LOOKBACK_MINUTES,
+                       day_of_week * MINUTES_IN_DAY)
+
+    schedules = Schedule.objects.filter(fire_times__minute_of_week__range=(first_minute, current_minute))
+    if habit_ids is not None:
+        schedules = schedules.filter(habit__pk__in=habit_ids).distinct()
+    schedules = schedules.only(current_day_field)
+
+    enqueued_count = 0
+    for schedule_batch in stream(schedules, settings.REMINDER_BATCH_SIZE):
+        fire_times = {schedule.pk: getattr(schedule, current_day_field) for schedule in schedule_batch}
+
+        habits = Habit.objects.filter(
+            is_deliverable=True,
+            is_enjoyable=False,
+            schedule_id__in=list(fire_times)
+        ).exclude(schedule_last_event=current_date)
+        if habit_ids is not None:
+            habits = habits.filter(pk__in=habit_ids)
+        habits = filter_shard(select_reminder_fields(habits), shard, shards)
+
+        for batch in stream(habits, settings.REMINDER_BATCH_SIZE):
+            reminders = []
+            for habit in batch:
+                time_habit = fire_times[habit.schedule_id]
+                reminders.append(ReminderOutbox(
+                    habit=habit,
+                    fire_slot=datetime.combine(current_date, time_habit, tzinfo=current_datetime.tzinfo),
+                    chat_id=habit.chat_id,
+                    text=get_reminder_body(habit, time_habit),
+                    next_attempt_at=current_datetime
+                ))
+
+            with transaction.atomic():
+                ReminderOutbox.objects.bulk_create(reminders, ignore_conflicts=True)
+                Habit.objects.filter(pk__in=[habit.pk for habit in batch]).update(schedule_last_event=current_date)
+            enqueued_count += len(reminders)
+            metrics.inc('habits_dispatch_rows_scanned_total', len(batch), kind='scheduled')
+            metrics.inc('habits_dispatch_reminders_due_total', len(reminders), kind='scheduled')
+
+    return enqueued_count
+
+
+def send_interval_reminder(shard: int = 0,
+                           shards: int = 1,
+                           current_datetime: datetime | None = None,
+                           habit_ids: Iterable[int] | None = None) -> int:
+    """
+    Функция для постановки в очередь напоминаний о привычке с заданным интервалом
+
+    Выбираются только интервалы, у которых подошло время следующего напоминания (next_fire_at),
+    а проверки промежутка активности и истечения интервала выполняются в базе данных (get_interval_due_q).
+    После обработки время следующего напоминания пересчитывается, в том числе у интервалов, напоминание
+    по которым подошло при закрытом промежутке активности (reschedule_idle_intervals).
+    Напоминания добавляются в очередь (ReminderOutbox) в одной транзакции с отметкой об отправке,
+    отправляет их deliver_reminders.
+    Обрабатываются только пользователи шарда `shard` из `shards`, возвращается число напоминаний в очереди.
+    Момент рассылки `current_datetime` по умолчанию текущий (задается явно в нагрузочных замерах).
+    Если выбран планировщик Redis, привычки берутся из его очереди (send_interval_reminder_from_queue),
+    кроме случая, когда привычки `habit_ids` заданы явно (их передает диспетчер напоминаний)
+    """
+
+    current_datetime = current_datetime or timezone.now()
+    queue = get_due_queue()
+    if queue is not None and habit_ids is None:
+        return send_interval_reminder_from_queue(queue, shard, shards, current_datetime)
 
     habits = Habit.objects.filter(
-        user__telegram_user_id__isnull=False,
-        **{f'schedule__{current_day_field}__isnull': False,}
-    ).exclude(schedule__last_event=current_date).select_related('user', 'schedule')
+        Q(interval__next_fire_at__isnull=True) | Q(interval__next_fire_at__lte=current_datetime),
+        is_deliverable=True,
+        is_enjoyable=False,
+        interval__isnull=False
+    )
+    if habit_ids is not None:
+        habits = habits.filter(pk__in=habit_ids)
+    habits = filter_shard(habits, shard, shards)
+    due_q = get_interval_due_q(current_datetime)
+    due_habits = select_reminder_fields(habits.filter(due_q), *REMINDER_INTERVAL_FIELDS)
 
-    for habit in habits:
-        if getattr(habit.schedule, current_day_field).replace(second=0, microsecond=0) <= current_time:
-            time_habit = getattr(habit.schedule, current_day_field)
-            text = get_reminder_text(habit, time_habit)
-            send_reminder(habit.user, text)
-            habit.schedule.last_event = current_date
-            habit.schedule.save(update_fields=['last_event'])
+    enqueued_count = 0
+    for batch in stream(due_habits, settings.REMINDER_BATCH_SIZE):
+        enqueued_count += enqueue_interval_reminders(batch, batch, current_datetime)
+        metrics.inc('habits_dispatch_rows_scanned_total', len(batch), kind='interval')
 
+    reschedule_idle_intervals(habits.exclude(due_q), current_datetime)
+    return enqueued_count
 
-def send_interval_reminder() -> None:
-    """Функция для отправки напоминаний о привычке с заданным интервалом"""
+
+def reschedule_idle_intervals(habits: QuerySet, current_datetime: datetime) -> int:
+    """
+    Вспомогательная функция переноса напоминаний, время которых подошло, но отправить их нельзя
+    (промежуток активности закрыт или интервал с последнего напоминания еще не истек): next_fire_at
+    интервалов привычек `habits` переносится на время, рассчитанное get_interval_next_fire_at, чтобы
+    следующие запуски рассылки не выбирали их повторно до этого времени. Возвращается число перенесенных
+    """
+
+    intervals = Interval.objects.filter(pk__in=habits.values('interval_id')).only(
+        'interval', 'start_time', 'end_time', 'last_event', 'next_fire_at')
+
+    rescheduled_count = 0
+    for batch in stream(intervals, settings.REMINDER_BATCH_SIZE):
+        rescheduled = []
+        for interval in batch:
+            next_fire_at = get_interval_next_fire_at(interval, current_datetime)
+            if next_fire_at > current_datetime:
+                interval.next_fire_at = next_fire_at
+                rescheduled.append(interval)
+        Interval.objects.bulk_update(rescheduled, ['next_fire_at'])
+        rescheduled_count += len(rescheduled)
+        metrics.inc('habits_dispatch_rows_scanned_total', len(batch), kind='interval')
+    return rescheduled_count
+
+
+def send_interval_reminder_from_queue(queue: RedisDueQueue, shard: int, shards: int, current_datetime: datetime) -> int:
+    """
+    Постановка в очередь напоминаний с интервалом по очереди Redis (REMINDER_SCHEDULER_BACKEND='redis')
+
+    Из сортированного множества шарда пакетами забираются в обработку (claim_due) привычки, время напоминания
+    которых подошло. Проверка промежутка активности выполняется здесь же: если он закрыт, привычка возвращается
+    в очередь со временем его начала. После записи в БД все привычки пакета возвращаются в очередь с новым
+    временем следующего напоминания; привычки, которых уже нет в БД (или у них больше нет интервала),
+    из очереди удаляются.
+
+    Число шардов `shards` должно совпадать с числом шардов очереди (REMINDER_DISPATCH_SHARDS), иначе
+    выбрасывается ValueError: привычки шарда `shard` лежат в другом множестве
+    """
+
+    if shards != queue.shards:
+        raise ValueError(f'Очередь Redis разделена на {queue.shards} шардов, а рассылка - на {shards}')
+
+    enqueued_count = 0
+    while True:
+        habit_ids = queue.claim_due(shard, current_datetime, settings.REMINDER_BATCH_SIZE)
+        if not habit_ids:
+            break
+
+        habits = Habit.objects.filter(pk__in=habit_ids, is_deliverable=True, is_enjoyable=False, interval__isnull=False)
+        batch = list(select_reminder_fields(habits, *REMINDER_INTERVAL_FIELDS))
+        due_habits = []
+        for habit in batch:
+            next_fire_at = get_interval_next_fire_at(habit.interval, current_datetime)
+            if next_fire_at <= current_datetime:
+                due_habits.append(habit)
+            else:
+                habit.interval.next_fire_at = next_fire_at
+
+        enqueued_count += enqueue_interval_reminders(batch, due_habits, current_datetime)
+        schedule_interval_habits(batch)
+        queue.remove(set(habit_ids).difference(habit.pk for habit in batch))
+        metrics.inc('habits_dispatch_rows_scanned_total', len(habit_ids), kind='interval')
+        if len(habit_ids) < settings.REMINDER_BATCH_SIZE:
+            break
+
+    return enqueued_count
+
+
+def enqueue_interval_reminders(habits: list[Habit], due_habits: list[Habit], current_datetime: datetime) -> int:
+    """
+    Вспомогательная функция записи пакета напоминаний с интервалом: для привычек `due_habits` напоминания
+    добавляются в очередь (ReminderOutbox) и пересчитывается время следующего напоминания, интервалы всех
+    привычек пакета `habits` сохраняются в той же транзакции. Возвращается число напоминаний в очереди
+    """
+
+    current_time = current_datetime.time()
+    reminders = []
+    for habit in due_habits:
+        reminders.append(ReminderOutbox(
+            habit=habit,
+            fire_slot=habit.interval.next_fire_at or current_datetime,
+            chat_id=habit.chat_id,
+            text=get_reminder_body(habit, current_time),
+            next_attempt_at=current_datetime
+        ))
+        habit.interval.last_event = current_datetime
+        habit.interval.next_fire_at = get_interval_next_fire_at(habit.interval, current_datetime)
+
+    with transaction.atomic():
+        ReminderOutbox.objects.bulk_create(reminders, ignore_conflicts=True)
+        Interval.objects.bulk_update([habit.interval for habit in habits], ['last_event', 'next_fire_at'])
+        if due_habits:
+            # last_event виден в API: время изменения обновляется, чтобы сменился ETag привычки
+            Interval.objects.filter(pk__in=[habit.interval_id for habit in due_habits]).update(
+                updated_at=timezone.now())
+    metrics.inc('habits_dispatch_reminders_due_total', len(reminders), kind='interval')
+    return len(reminders)
+
+
+def deliver_reminders(shard: int = 0,
+                      shards: int = 1,
+                      sender: TelegramSender | None = None,
+                      chat_ids: range | None = None) -> int:
+    """
+    Функция отправки напоминаний из очереди (ReminderOutbox) пакетами по OUTBOX_BATCH_SIZE
+
+    Обрабатываются только чаты шарда `shard` из `shards`, очередь разбирается, пока в ней есть
+    готовые к отправке напоминания. Пока выключатель запросов к Telegram разомкнут (в том числе пока
+    выполняется пробный запрос), напоминания из очереди не забираются. Возвращается число отправленных напоминаний.
+    По умолчанию используется общий для процесса отправщик (get_telegram_sender),
+    `chat_ids` ограничивает отправку диапазоном чатов (его передают нагрузочные замеры)
+    """
+
+    sent_count = 0
+    sender = sender or get_telegram_sender()
+    while True:
+        if sender.breaker.is_open():
+            logger.warning('Доставка напоминаний отложена: Telegram Bot API недоступен')
+            break
+        reminders = claim_reminders(shard, shards, settings.OUTBOX_BATCH_SIZE, chat_ids)
+        if not reminders:
+            break
+        sent_count += deliver_reminder_batch(sender, reminders)
+        if len(reminders) < settings.OUTBOX_BATCH_SIZE:
+            break
+    return sent_count
+
+
+def claim_reminders(shard: int, shards: int, batch_size: int, chat_ids: range | None = None) -> list[ReminderOutbox]:
+    """
+    Вспомогательная функция, забирающая из очереди пакет напоминаний на отправку.
+
+    Строки блокируются только на время короткой транзакции (SKIP LOCKED позволяет нескольким
+    задачам доставки работать параллельно), после чего время следующей попытки сдвигается на OUTBOX_LEASE:
+    если задача доставки упадет, напоминания снова станут доступны по истечении этого срока
+    """
 
     current_datetime = timezone.now()
+    with transaction.atomic():
+        reminders = ReminderOutbox.objects.filter(
+            status=ReminderOutbox.STATUS_PENDING,
+            next_attempt_at__lte=current_datetime
+        )
+        if chat_ids is not None:
+            reminders = reminders.filter(chat_id__gte=chat_ids.start, chat_id__lt=chat_ids.stop)
+        reminders = list(
+            filter_shard(reminders, shard, shards, field='chat_id')
+            .order_by('next_attempt_at')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        ReminderOutbox.objects.filter(pk__in=[reminder.pk for reminder in reminders]).update(
+            next_attempt_at=current_datetime + settings.OUTBOX_LEASE
+        )
+    return reminders
+
+
+def deliver_reminder_batch(sender: TelegramSender, reminders: list[ReminderOutbox]) -> int:
+    """
+    Вспомогательная функция отправки пакета напоминаний из очереди и записи результатов
+
+    Результаты записываются и при прерывании пакета: отправленные напоминания не уйдут повторно,
+    а неудачные попытки будут повторены с нарастающей задержкой, но не более OUTBOX_MAX_ATTEMPTS раз.
+    Напоминания, отложенные разомкнутым выключателем, попытку не расходуют. Если чат недоступен
+    (бот заблокирован или чат не найден), напоминание сразу считается неудачным, а пользователь
+    исключается из рассылок (block_telegram_chats)
+    """
+
+    sent_ids = []
+    failed_reminders = []
+    blocked_chat_ids = set()
+    messages = get_reminder_messages(reminders)
+
+    def on_result(i, result):
+        _, message_reminders = messages[i]
+        if result.is_sent:
+            sent_ids.extend(reminder.pk for reminder in message_reminders)
+            sent_at = timezone.now()
+            for reminder in message_reminders:
+                metrics.observe('habits_reminder_lag_seconds', (sent_at - reminder.fire_slot).total_seconds())
+            return
+        if result.is_deferred:
+            for reminder in message_reminders:
+                reminder.next_attempt_at = timezone.now() + timedelta(seconds=result.retry_after)
+                failed_reminders.append(reminder)
+            return
+        if result.is_chat_unavailable:
+            blocked_chat_ids.add(result.message.chat_id)
+        for reminder in message_reminders:
+            reminder.attempts += 1
+            reminder.last_error = f'{result.status_code or ""} {result.description}'.strip()
+            if result.is_chat_unavailable or \
+                    result.retry_after is None and reminder.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                reminder.status = ReminderOutbox.STATUS_FAILED
+            retry_delay = result.retry_after or \
+                settings.OUTBOX_RETRY_DELAY.total_seconds() * 2 ** (reminder.attempts - 1)
+            reminder.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay)
+            failed_reminders.append(reminder)
+
+    try:
+        sender.send_batch([message for message, _ in messages], on_result=on_result)
+    finally:
+        if sent_ids:
+            ReminderOutbox.objects.filter(pk__in=sent_ids).update(
+                status=ReminderOutbox.STATUS_SENT,
+                sent_at=timezone.now()
+            )
+        if failed_reminders:
+            ReminderOutbox.objects.bulk_update(
+                failed_reminders, ['status', 'attempts', 'last_error', 'next_attempt_at']
+            )
+        if blocked_chat_ids:
+            block_telegram_chats(blocked_chat_ids)
+
+    return len(sent_ids)
+
+
+def block_telegram_chats(chat_ids: Iterable[int]) -> int:
+    """
+    Функция, исключающая недоступные чаты из рассылок
+
+    Пользователям ставится отметка telegram_blocked (ее снимает команда /start боту), а ожидающие отправки
+    напоминания в эти чаты отменяются. Возвращается число отмеченных пользователей
+    """
+
+    chat_ids = list(chat_ids)
+    blocked_count = User.objects.filter(telegram_user_id__in=chat_ids, telegram_blocked=False).update(
+        telegram_blocked=True
+    )
+    Habit.objects.filter(chat_id__in=chat_ids, is_deliverable=True).update(is_deliverable=False, chat_id=None)
+    ReminderOutbox.objects.filter(chat_id__in=chat_ids, status=ReminderOutbox.STATUS_PENDING).update(
+        status=ReminderOutbox.STATUS_FAILED,
+        last_error='Чат telegram недоступен'
+    )
+    logger.info(f'Чаты исключены из рассылки напоминаний: {len(chat_ids)}')
+    return blocked_count
+
+
+def sync_habits_deliverable(habits: QuerySet) -> None:
+    """
+    Функция пересчета производных полей is_deliverable и chat_id для выборки привычек
+
+    Нужна, когда меняются данные, от которых они зависят, в обход Habit.save (чат telegram пользователя)
+    """
+
+    habits.filter(get_deliverable_q()).exclude(is_deliverable=True, chat_id=F('user__telegram_user_id')).update(
+        is_deliverable=True,
+        chat_id=Subquery(User.objects.filter(pk=OuterRef('user_id')).values('telegram_user_id'))
+    )
+    habits.exclude(get_deliverable_q()).filter(is_deliverable=True).update(is_deliverable=False, chat_id=None)
+
+
+def get_or_create_schedule(schedule_data: dict) -> Schedule:
+    """
+    Функция получения общего расписания с заданным временем по дням недели (SCHEDULE_INTERNING_ENABLED)
+
+    Расписание ищется по хешу времени, а если такого еще нет, создается. Общее расписание нельзя изменять:
+    при изменении расписания привычки ей назначается другое общее расписание
+    """
+
+    schedule, _ = Schedule.objects.get_or_create(digest=Schedule.get_digest(schedule_data), defaults=schedule_data)
+    return schedule
+
+
+def cleanup_reminder_outbox() -> int:
+    """Функция удаления из очереди обработанных напоминаний старше OUTBOX_RETENTION"""
+
+    deleted_count, _ = ReminderOutbox.objects.filter(
+        status__in=(ReminderOutbox.STATUS_SENT, ReminderOutbox.STATUS_FAILED),
+        created_at__lt=timezone.now() - settings.OUTBOX_RETENTION
+    ).delete()
+    return deleted_count
+
+
+def get_schedule_next_fire_at(schedule: Schedule, current_datetime: datetime) -> datetime | None:
+    """Вспомогательная функция расчета ближайшего после `current_datetime` времени напоминания по расписанию"""
+
+    week_start = datetime.combine(current_datetime.date() - timedelta(days=current_datetime.weekday()), time(),
+                                  tzinfo=current_datetime.tzinfo)
+    fire_times = []
+    for minute in schedule.get_minutes_of_week():
+        fire_at = week_start + timedelta(minutes=minute)
+        if fire_at <= current_datetime:
+            fire_at += timedelta(weeks=1)
+        fire_times.append(fire_at)
+    return min(fire_times, default=None)
+
+
+def get_interval_due_q(current_datetime: datetime, prefix: str = 'interval__') -> Q:
+    """
+    Условие для выборки интервалов, по которым пора отправить напоминание.
+
+    Повторяет в базе данных проверки is_reminder_time_active (включая промежуток активности,
+    переходящий через полночь) и истечения интервала с последнего напоминания
+    """
+
+    start_time, end_time = f'{prefix}start_time', f'{prefix}end_time'
+    last_event, interval = f'{prefix}last_event', f'{prefix}interval'
     current_time = current_datetime.time()
 
-    habits = Habit.objects.filter(
-        interval__isnull=False,
-        user__telegram_user_id__isnull=False
-    ).select_related('user', 'interval')
-
-    for habit in habits:
-        start_time = habit.interval.start_time
-        end_time = habit.interval.end_time
-        if not is_reminder_time_active(current_time, start_time, end_time):
-            continue
-        if habit.interval.last_event and (habit.interval.last_event + habit.interval.interval) > current_datetime:
-            continue
-        text = get_reminder_text(habit, current_time)
-        send_reminder(habit.user, text)
-        habit.interval.last_event = current_datetime
-        habit.interval.save(update_fields=['last_event'])
-        continue
+    always_active = Q(**{f'{start_time}__isnull': True}) | Q(**{f'{end_time}__isnull': True}) \
+        | Q(**{start_time: F(end_time)})
+    daytime_window = Q(**{
+        f'{start_time}__lt': F(end_time),
+        f'{start_time}__lte': current_time,
+        f'{end_time}__gt': current_time,
+    })
+    overnight_window = Q(**{f'{start_time}__gt': F(end_time)}) & (
+        Q(**{f'{start_time}__lte': current_time}) | Q(**{f'{end_time}__gte': current_time})
+    )
+    interval_elapsed = Q(**{f'{last_event}__isnull': True}) | Q(**{
+        f'{last_event}__lte': ExpressionWrapper(Value(current_datetime) - F(interval), output_field=DateTimeField())
+    })
+
+    return (always_active | daytime_window | overnight_window) & interval_elapsed
+
+
+def get_interval_next_fire_at(interval: Interval, current_datetime: datetime) -> datetime:
+    """
+    Вспомогательная функция расчета времени следующего напоминания для интервала.
+
+    Напоминание отправляется не раньше, чем через заданный интервал после предыдущего,
+    и не раньше текущего момента. Если это время не попадает в промежуток активности рассылки,
+    напоминание переносится на ближайшее время старта
+    """
+
+    next_fire_at = current_datetime
+    if interval.last_event:
+        next_fire_at = max(interval.last_event + interval.interval, current_datetime)
+
+    start_time = interval.start_time
+    if is_reminder_time_active(next_fire_at.time(), start_time, interval.end_time):
+        return next_fire_at
+
+    window_start = datetime.combine(next_fire_at.date(), start_time, tzinfo=next_fire_at.tzinfo)
+    if window_start < next_fire_at:
+        window_start += timedelta(days=1)
+    return window_start
+
+
+def select_reminder_fields(habits: QuerySet, *fields: str) -> QuerySet:
+    """
+    Вспомогательная функция выборки привычек для напоминаний: все связанные объекты, нужные для текста
+    напоминания, загружаются одним запросом, а из таблиц читаются только нужные поля (REMINDER_HABIT_FIELDS
+    и `fields` для периодичности), так что число запросов на пакет не зависит от числа привычек
+    """
+
+    relations = {field.split('__')[0] for field in fields}
+    return habits.select_related(
+        'related_habit__schedule', 'related_habit__interval', *relations
+    ).only(*REMINDER_HABIT_FIELDS, *fields)
+
+
+def filter_shard(queryset: QuerySet, shard: int, shards: int, field: str = 'chat_id') -> QuerySet:
+    """
+    Вспомогательная функция отбора записей шарда: записи распределяются по шардам по остатку от деления
+    идентификатора чата telegram (Habit.chat_id и ReminderOutbox.chat_id, без соединения с users_user),
+    поэтому все сообщения одного чата и ставит в очередь, и доставляет один шард
+    """
+
+    if shards <= 1:
+        return queryset
+    return queryset.annotate(shard=Mod(field, shards)).filter(shard=shard)
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Вспомогательная функция разбиения последовательности на пакеты заданного размера"""
+
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def stream(queryset: QuerySet, size: int) -> Iterator[list]:
+    """
+    Вспомогательная функция чтения выборки пакетами через курсор на стороне сервера
+
+    В отличие от обхода самого QuerySet, объекты не накапливаются в его кеше: в памяти одновременно
+    находится только текущий пакет, сколько бы строк ни было в выборке
+    """
+
+    return chunked(queryset.iterator(chunk_size=size), size)
 
 
 def is_reminder_time_active(current_time: time, start_time: time, end_time: time) -> bool:
@@ -79,41 +543,76 @@ def is_reminder_time_active(current_time: time, start_time: time, end_time: time
     return True
 
 
-def send_reminder(user: User, text: str) -> None:
-    """Вспомогательная функция отправки пользователю напоминания о привычке через telegram"""
+def get_reminder_text(habit: Habit, row_time: time) -> str:
+    """Возвращает готовый текст напоминания о привычке для отправки пользователям"""
 
-    params = {
-        'chat_id': user.telegram_user_id,
-        'text': text
-    }
-    url = settings.TELEGRAM_MAIN_URL + settings.TELEGRAM_TOKEN + '/sendMessage'
-    try:
-        response = requests.post(url, params=params, timeout=10)
-        response.raise_for_status()
-        logger.info(f"Сообщение отправлено {user.telegram_username}. Ответ: {response.json()}")
-    except requests.RequestException as e:
-        logger.error(f"Ошибка при отправке сообщения пользователю {user.telegram_username}. Ошибка: {e}")
+    return get_reminder_message_text([get_reminder_body(habit, row_time)])
 
 
-def get_reminder_text(habit: Habit, row_time: time) -> str:
-    """Возвращает готовый текст напоминания о привычке для отправки пользователям"""
+def get_reminder_body(habit: Habit, row_time: time) -> str:
+    """Возвращает часть текста напоминания, относящуюся к самой привычке (без общего заголовка и пожелания)"""
 
     place = habit.place if habit.place else ''
     lead_time = f'В течение {habit.lead_time} секунд\n' if habit.lead_time else ''
     reward = f'В качестве поощрения: {habit.reward or habit.related_habit}\n' if habit.reward or habit.related_habit else ''
     formatted_time = row_time.strftime('%H:%M')
     time_habit = ''
-    if habit.schedule:
+    if habit.schedule_id:
         time_habit = f'Когда: сегодня в {formatted_time}'
-    elif habit.interval:
+    elif habit.interval_id:
         time_habit = f'Когда: сейчас, в {formatted_time}'
 
-    text = (f'Напоминание! Формируем привычку, следуй указанию\n'
-            f'\n'
-            f'{time_habit}\n'
+    body = (f'{time_habit}\n'
             f'Что сделать: {habit.operation} {place}\n'
             f'{lead_time}'
-            f'{reward}'
-            f'Успехов!')
+            f'{reward}')
+
+    return body
+
+
+def get_reminder_message_text(bodies: list[str]) -> str:
+    """
+    Собирает текст сообщения из одного или нескольких напоминаний (сводка),
+    текст обрезается до максимальной длины сообщения telegram
+    """
+
+    text = REMINDER_HEADER + REMINDER_SEPARATOR.join(bodies) + REMINDER_FOOTER
+    return text[:settings.TELEGRAM_MESSAGE_MAX_LENGTH]
+
+
+def get_reminder_messages(reminders: list[ReminderOutbox]) -> list[tuple[TelegramMessage, list[ReminderOutbox]]]:
+    """
+    Вспомогательная функция, превращающая напоминания из очереди в сообщения telegram
+
+    Возвращает пары (сообщение, напоминания, вошедшие в него). В режиме сводки (REMINDER_DIGEST_ENABLED)
+    напоминания одного чата объединяются в одно сообщение, которое при превышении
+    TELEGRAM_MESSAGE_MAX_LENGTH делится на несколько по границам напоминаний
+    """
+
+    if not settings.REMINDER_DIGEST_ENABLED:
+        return [
+            (TelegramMessage(reminder.chat_id, get_reminder_message_text([reminder.text])), [reminder])
+            for reminder in reminders
+        ]
+
+    reminders_by_chat = {}
+    for reminder in reminders:
+        reminders_by_chat.setdefault(reminder.chat_id, []).append(reminder)
 
-    return text
+    max_length = settings.TELEGRAM_MESSAGE_MAX_LENGTH - len(REMINDER_HEADER) - len(REMINDER_FOOTER)
+    messages = []
+    for chat_id, chat_reminders in reminders_by_chat.items():
+        parts = [[]]
+        length = 0
+        for reminder in chat_reminders:
+            added_length = len(reminder.text) + (len(REMINDER_SEPARATOR) if parts[-1] else 0)
+            if parts[-1] and length + added_length > max_length:
+                parts.append([])
+                added_length = len(reminder.text)
+                length = 0
+            parts[-1].append(reminder)
+            length += added_length
+        for part in parts:
+            text = get_reminder_message_text([reminder.text for reminder in part])
+            messages.append((TelegramMessage(chat_id, text), part))
+    return messages
@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from habits.cache import bump_public_feed_generation
+from habits.dispatcher import notify_habit_changes
+from habits.models import Habit, Schedule, Interval
+from habits.scheduler import get_due_queue, schedule_interval_habits
+from habits.services import sync_habits_deliverable
+from users.models import User
+
+HABIT_CHANGE_KINDS = {Habit: 'habit', Schedule: 'schedule', Interval: 'interval'}
+
+
+@receiver(post_save, sender=User)
+def reschedule_user_interval_habits(sender, instance: User, update_fields=None, **kwargs) -> None:
+    """
+    При изменении чата telegram пользователя его привычки с интервалом переносятся в очередь Redis
+    нужного шарда (пользователь без чата или с недоступным чатом в очереди не участвует,
+    пока не начнет диалог с ботом)
+    """
+
+    if update_fields is not None and {'telegram_user_id', 'telegram_blocked'}.isdisjoint(update_fields):
+        return
+    sync_habits_deliverable(Habit.objects.filter(user=instance))
+    if settings.REMINDER_DISPATCHER_ENABLED:
+        notify_habit_changes('user', instance.pk)
+    queue = get_due_queue()
+    if queue is None:
+        return
+
+    def reschedule():
+        habits = list(Habit.objects.filter(user=instance, interval__isnull=False).select_related('interval'))
+        queue.remove(habit.pk for habit in habits)
+        schedule_interval_habits(habits)
+
+    transaction.on_commit(reschedule)
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_save, sender=Schedule)
+@receiver(post_save, sender=Interval)
+@receiver(post_delete, sender=Habit)
+@receiver(post_delete, sender=Schedule)
+@receiver(post_delete, sender=Interval)
+def notify_dispatcher(sender, instance, **kwargs) -> None:
+    """Изменения привычек и их периодичности передаются диспетчеру напоминаний, если он используется"""
+
+    if settings.REMINDER_DISPATCHER_ENABLED:
+        notify_habit_changes(HABIT_CHANGE_KINDS[sender], instance.pk)
+
+
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=Habit)
+def invalidate_public_feed_habit(sender, instance: Habit, created=False, **kwargs) -> None:
+    """
+    Кеш ленты публичных привычек сбрасывается при сохранении или удалении привычки, которая публична сейчас
+    или была публичной при загрузке (если это неизвестно, кеш тоже сбрасывается)
+    """
+
+    if not settings.CACHE_ENABLED:
+        return
+    was_public = not created and getattr(instance, '_loaded_is_public', None) is not False
+    if instance.__dict__.get('is_public', True) or was_public:
+        transaction.on_commit(bump_public_feed_generation)
+    instance._loaded_is_public = instance.__dict__.get('is_public')
+
+
+@receiver(post_save, sender=Schedule)
+@receiver(post_save, sender=Interval)
+def invalidate_public_feed_periodicity(sender, instance, created=False, **kwargs) -> None:
+    """
+    Кеш ленты публичных привычек сбрасывается при изменении расписания или интервала публичной привычки
+    (при их удалении удаляются и привычки, что обрабатывается сигналом привычки)
+    """
+
+    if not settings.CACHE_ENABLED or created:
+        return
+    habits = Habit.objects.filter(is_public=True)
+    if sender is Schedule:
+        habits = habits.filter(schedule=instance)
+    else:
+        habits = habits.filter(interval=instance)
+    if habits.exists():
+        transaction.on_commit(bump_public_feed_generation)
+
+
+@receiver(pre_delete, sender=Habit)
+def touch_related_habits(sender, instance: Habit, **kwargs) -> None:
+    """
+    У привычек, ссылающихся на удаляемую, related_habit обнуляется в обход save(): время их изменения
+    (ETag) обновляется здесь, а если среди них есть публичные, сбрасывается кеш ленты
+    """
+
+    habits = Habit.objects.filter(related_habit=instance)
+    if habits.update(updated_at=timezone.now()) and settings.CACHE_ENABLED and habits.filter(is_public=True).exists():
+        transaction.on_commit(bump_public_feed_generation)
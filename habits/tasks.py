@@ -1,17 +1,133 @@
-from celery import shared_task
+import logging
+import time
+from operator import add
+
+from celery import shared_task, chord, group
+from django.conf import settings
 
 from habits import services
+from habits.locks import run_exclusive
+from habits.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
 def task_send_scheduled_reminder() -> None:
-    """Отправка напоминаний о привычке в соответствии с недельным расписанием пользователям в telegram"""
+    """
+    Отправка напоминаний о привычке в соответствии с недельным расписанием пользователям в telegram
+
+    Рассылка делится на REMINDER_DISPATCH_SHARDS параллельных подзадач, итоги собирает task_aggregate_dispatch.
+    Если работает диспетчер напоминаний (REMINDER_DISPATCHER_ENABLED), рассылку выполняет он
+    """
 
-    services.send_scheduled_reminder()
+    if settings.REMINDER_DISPATCHER_ENABLED:
+        return
+    shards = settings.REMINDER_DISPATCH_SHARDS
+    chord(
+        task_send_scheduled_reminder_shard.s(shard, shards) for shard in range(shards)
+    )(task_aggregate_dispatch.s('scheduled'))
 
 
 @shared_task
 def task_send_interval_reminder() -> None:
-    """Отправка напоминаний о привычке с заданным интервалом пользователям в telegram"""
+    """
+    Отправка напоминаний о привычке с заданным интервалом пользователям в telegram
+
+    Рассылка делится на REMINDER_DISPATCH_SHARDS параллельных подзадач, итоги собирает task_aggregate_dispatch.
+    Если работает диспетчер напоминаний (REMINDER_DISPATCHER_ENABLED), рассылку выполняет он
+    """
+
+    if settings.REMINDER_DISPATCHER_ENABLED:
+        return
+    shards = settings.REMINDER_DISPATCH_SHARDS
+    chord(
+        task_send_interval_reminder_shard.s(shard, shards) for shard in range(shards)
+    )(task_aggregate_dispatch.s('interval'))
+
+
+@shared_task
+def task_send_scheduled_reminder_shard(shard: int, shards: int) -> dict:
+    """
+    Постановка в очередь напоминаний по расписанию для одного шарда пользователей, затем запуск доставки
+
+    Запуски для одного шарда не перекрываются (run_exclusive): если предыдущий еще идет, этот пропускается
+    """
+
+    start = time.monotonic()
+    count = run_exclusive(f'scheduled:{shard}:{shards}', lambda: services.send_scheduled_reminder(shard, shards), add)
+    if count:
+        task_deliver_reminders_shard.delay(shard, shards)
+    return finish_dispatch('scheduled', shard, count, time.monotonic() - start)
+
+
+@shared_task
+def task_send_interval_reminder_shard(shard: int, shards: int) -> dict:
+    """
+    Постановка в очередь напоминаний с интервалом для одного шарда пользователей, затем запуск доставки
+
+    Запуски для одного шарда не перекрываются (run_exclusive): если предыдущий еще идет, этот пропускается
+    """
+
+    start = time.monotonic()
+    count = run_exclusive(f'interval:{shard}:{shards}', lambda: services.send_interval_reminder(shard, shards), add)
+    if count:
+        task_deliver_reminders_shard.delay(shard, shards)
+    return finish_dispatch('interval', shard, count, time.monotonic() - start)
+
+
+@shared_task
+def task_deliver_reminders() -> None:
+    """
+    Доставка напоминаний из очереди пользователям в telegram
+
+    Запускается периодически, чтобы повторить отложенные отправки; сразу после постановки
+    напоминаний в очередь доставку запускают сами задачи рассылки
+    """
+
+    shards = settings.REMINDER_DISPATCH_SHARDS
+    group(task_deliver_reminders_shard.s(shard, shards) for shard in range(shards))()
+
+
+@shared_task
+def task_deliver_reminders_shard(shard: int, shards: int) -> int:
+    """Доставка напоминаний из очереди для одного шарда чатов (выполняется в отдельной очереди delivery)"""
+
+    try:
+        return services.deliver_reminders(shard, shards)
+    finally:
+        metrics.flush()
+
+
+@shared_task
+def task_cleanup_reminder_outbox() -> int:
+    """Удаление из очереди давно обработанных напоминаний"""
+
+    return services.cleanup_reminder_outbox()
+
+
+def finish_dispatch(kind: str, shard: int, count: int | None, duration: float) -> dict:
+    """Итог запуска рассылки для шарда: длительность пишется в метрики, count=None означает пропущенный запуск"""
+
+    if count is not None:
+        metrics.observe('habits_dispatch_tick_seconds', duration, kind=kind)
+    metrics.flush()
+    return {'shard': shard, 'count': count or 0, 'duration': duration, 'skipped': count is None}
+
+
+@shared_task
+def task_aggregate_dispatch(results: list[dict], name: str) -> dict:
+    """Сводка по рассылке: сколько напоминаний поставили в очередь шарды и сколько длился самый медленный из них"""
 
-    services.send_interval_reminder()
+    summary = {
+        'name': name,
+        'shards': len(results),
+        'count': sum(result['count'] for result in results),
+        'duration': max((result['duration'] for result in results), default=0),
+    }
+    skipped = sum(1 for result in results if result.get('skipped'))
+    if skipped:
+        logger.warning(f"Рассылка {name}: пропущено шардов, которые еще выполняли предыдущий запуск: {skipped}")
+    logger.info(f"Рассылка {name}: в очередь поставлено {summary['count']} напоминаний в {summary['shards']} шардах "
+                f"за {summary['duration']:.2f} с.")
+    return summary
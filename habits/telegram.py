@@ -0,0 +1,231 @@
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import NamedTuple, Iterable, Callable
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from habits.circuit_breaker import CircuitBreaker
+from habits.metrics import metrics
+from habits.ratelimit import TelegramRateLimiter, RedisTelegramRateLimiter
+from habits.scheduler import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramMessage(NamedTuple):
+    """Сообщение для отправки в чат telegram"""
+
+    chat_id: int
+    text: str
+
+
+class DeliveryResult(NamedTuple):
+    """Результат отправки сообщения через Telegram Bot API"""
+
+    message: TelegramMessage
+    is_sent: bool
+    status_code: int | None = None
+    description: str = ''
+    retry_after: int | None = None
+    is_deferred: bool = False
+
+    @property
+    def is_chat_unavailable(self) -> bool:
+        """Чат недоступен и повторные отправки бесполезны: бот заблокирован пользователем (403) или чат не найден"""
+
+        return self.status_code == 403 or (self.status_code == 400 and 'chat not found' in self.description.lower())
+
+
+class TelegramSender:
+    """
+    Пакетная отправка сообщений через Telegram Bot API.
+
+    Соединения с API переиспользуются (keep-alive) через общий пул,
+    сообщения пакета отправляются параллельно, не более чем в `concurrency` потоков.
+    Скорость отправки ограничивается лимитами Telegram (по умолчанию общими для всех процессов, в Redis),
+    сообщения, получившие ответ 429, ставятся в очередь повторно после retry_after (не более `max_retries` раз).
+    Если запросы к API массово завершаются ошибками соединения или ответами 5xx, выключатель (breaker)
+    размыкается, и сообщения не отправляются, а сразу откладываются (is_deferred) до пробного запроса
+    """
+
+    def __init__(self,
+                 concurrency: int | None = None,
+                 timeout: float | None = None,
+                 limiter: TelegramRateLimiter | None = None,
+                 max_retries: int | None = None,
+                 breaker: CircuitBreaker | None = None):
+        self.concurrency = concurrency or settings.TELEGRAM_SEND_CONCURRENCY
+        self.timeout = timeout or settings.TELEGRAM_SEND_TIMEOUT
+        self.limiter = limiter or RedisTelegramRateLimiter(
+            get_redis_client(),
+            global_rate=settings.TELEGRAM_GLOBAL_RATE_LIMIT,
+            chat_rate=settings.TELEGRAM_CHAT_RATE_LIMIT,
+            group_rate=settings.TELEGRAM_GROUP_RATE_LIMIT
+        )
+        self.max_retries = settings.TELEGRAM_SEND_MAX_RETRIES if max_retries is None else max_retries
+        self.breaker = breaker or CircuitBreaker(
+            failure_rate=settings.TELEGRAM_CIRCUIT_FAILURE_RATE,
+            min_requests=settings.TELEGRAM_CIRCUIT_MIN_REQUESTS,
+            window=settings.TELEGRAM_CIRCUIT_WINDOW,
+            open_timeout=settings.TELEGRAM_CIRCUIT_OPEN_TIMEOUT
+        )
+        self.url = settings.TELEGRAM_MAIN_URL + settings.TELEGRAM_TOKEN + '/sendMessage'
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def send(self, message: TelegramMessage) -> DeliveryResult:
+        """Отправляет одно сообщение, ошибки не выбрасываются, а возвращаются в результате"""
+
+        if not self.breaker.allow_request():
+            metrics.inc('habits_telegram_circuit_rejected_total')
+            return DeliveryResult(message, False, description='Отправка отложена: Telegram Bot API недоступен',
+                                  retry_after=max(math.ceil(self.breaker.retry_after()), 1), is_deferred=True)
+
+        # Исход запроса сообщается выключателю в любом случае, в том числе при непредвиденном исключении,
+        # иначе пробный запрос полуоткрытого выключателя остался бы незавершенным
+        is_failure = True
+        try:
+            result = self._send(message)
+            is_failure = result.status_code is None or result.status_code >= 500
+            return result
+        finally:
+            if is_failure:
+                self._record_failure()
+            else:
+                self.breaker.record_success()
+
+    def _send(self, message: TelegramMessage) -> DeliveryResult:
+        self.limiter.acquire(message.chat_id)
+        start = time.monotonic()
+        try:
+            response = self.session.post(
+                self.url,
+                json={'chat_id': message.chat_id, 'text': message.text},
+                timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            logger.error(f"Ошибка при отправке сообщения в чат {message.chat_id}. Ошибка: {e}")
+            metrics.inc('habits_telegram_send_failures_total', status='error')
+            return DeliveryResult(message, False, description=str(e))
+        finally:
+            metrics.observe('habits_telegram_send_seconds', time.monotonic() - start)
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            data = {'description': response.text}
+        description = data.get('description', '')
+
+        if not response.ok:
+            metrics.inc('habits_telegram_send_failures_total', status=response.status_code)
+
+        if response.status_code == 429:
+            retry_after = data.get('parameters', {}).get('retry_after', 1)
+            self.limiter.pause(retry_after)
+            logger.warning(f"Превышен лимит Telegram при отправке в чат {message.chat_id}, "
+                           f"повтор через {retry_after} с.")
+            return DeliveryResult(message, False, response.status_code, description, retry_after)
+
+        if not response.ok:
+            logger.error(f"Ошибка при отправке сообщения в чат {message.chat_id}. "
+                         f"Ответ: {response.status_code} {description}")
+            return DeliveryResult(message, False, response.status_code, description)
+
+        logger.info(f"Сообщение отправлено в чат {message.chat_id}")
+        return DeliveryResult(message, True, response.status_code, description)
+
+    def send_batch(self,
+                   messages: Iterable[TelegramMessage],
+                   on_result: Callable[[int, DeliveryResult], None] | None = None) -> list[DeliveryResult]:
+        """
+        Отправляет пакет сообщений, результаты возвращаются в порядке сообщений
+
+        Сообщение, на которое пришел ответ 429, ставится в очередь повторно;
+        если попытки закончились, результат содержит retry_after, и сообщение можно отправить позже.
+        on_result вызывается с номером сообщения и результатом сразу по завершении отправки, в том числе
+        для уже начатых отправок, если пакет прерван исключением: так вызывающий код узнает обо всех
+        доставленных сообщениях
+        """
+
+        messages = list(messages)
+        results = [None] * len(messages)
+        if not messages:
+            return results
+
+        def complete(future, i):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f"Ошибка при отправке сообщения в чат {messages[i].chat_id}")
+                result = DeliveryResult(messages[i], False, description=str(e))
+            results[i] = result
+            if on_result:
+                on_result(i, result)
+
+        attempts = [0] * len(messages)
+        executor = ThreadPoolExecutor(max_workers=min(self.concurrency, len(messages)))
+        pending = {executor.submit(self.send, message): i for i, message in enumerate(messages)}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = pending.pop(future)
+                    attempts[i] += 1
+                    if future.exception() is None and future.result().retry_after is not None \
+                            and not future.result().is_deferred and attempts[i] <= self.max_retries:
+                        pending[executor.submit(self.send, messages[i])] = i
+                    else:
+                        complete(future, i)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            for future, i in pending.items():
+                if not future.cancelled():
+                    complete(future, i)
+        return results
+
+    def _record_failure(self) -> None:
+        if self.breaker.record_failure():
+            metrics.inc('habits_telegram_circuit_opened_total')
+            logger.warning(f"Telegram Bot API недоступен, отправка приостановлена "
+                           f"на {self.breaker.open_timeout} с.")
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_sender = None
+
+
+def get_telegram_sender() -> TelegramSender:
+    """
+    Общий для процесса отправщик, чтобы соединения с API переиспользовались между запусками задач.
+    Лимиты Telegram при этом общие для всех процессов и шардов рассылки (RedisTelegramRateLimiter)
+    """
+
+    global _sender
+    if _sender is None:
+        _sender = TelegramSender()
+    return _sender
+
+
+def send_messages(messages: Iterable[tuple[int, str]]) -> list[DeliveryResult]:
+    """Отправляет пакет сообщений вида (chat_id, text)"""
+
+    return get_telegram_sender().send_batch(TelegramMessage(*message) for message in messages)
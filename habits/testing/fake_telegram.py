@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов к локальному серверу, имитирующему Telegram Bot API"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        payload = json.loads(body or b'{}')
+        chat_id = payload.get('chat_id')
+
+        fake.request_started(self.client_address)
+        try:
+            if fake.latency:
+                time.sleep(fake.latency)
+            status_code, response = fake.get_response(chat_id, payload.get('text'))
+        finally:
+            fake.request_finished()
+
+        data = json.dumps(response).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTelegramServer:
+    """
+    Локальный HTTP-сервер, имитирующий метод sendMessage Telegram Bot API.
+
+    Используется в тестах и нагрузочных замерах: запоминает полученные сообщения,
+    умеет добавлять задержку ответа и возвращать заранее заданные ответы для отдельных чатов
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.messages = []
+        self.responses = {}
+        self.connections = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), FakeTelegramHandler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Адрес, который подставляется в TELEGRAM_MAIN_URL (токен дописывается к нему)"""
+
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/bot'
+
+    def add_response(self, chat_id: int, status_code: int, response: dict) -> None:
+        """Задает ответ на следующий запрос для чата (ответы выдаются в порядке добавления)"""
+
+        with self._lock:
+            self.responses.setdefault(chat_id, []).append((status_code, response))
+
+    def get_response(self, chat_id: int, text: str) -> tuple[int, dict]:
+        with self._lock:
+            if self.responses.get(chat_id):
+                return self.responses[chat_id].pop(0)
+            self.messages.append((chat_id, text))
+            message_id = len(self.messages)
+        return 200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': chat_id}, 'text': text}}
+
+    def request_started(self, client_address) -> None:
+        with self._lock:
+            self.connections.add(client_address)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def start(self) -> 'FakeTelegramServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
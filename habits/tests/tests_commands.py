@@ -0,0 +1,74 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from habits.management.commands.benchmark_reminders import percentile
+from habits.models import Habit, Schedule, Interval, ReminderOutbox, DAYS_OF_WEEK_FIELDS
+from users.models import User
+
+
+class BenchmarkRemindersCommandTestCase(TestCase):
+
+    def test_benchmark_reminders(self):
+        out = StringIO()
+        call_command('benchmark_reminders', users=10, habits_per_user=3, ticks=3, shards=2, stdout=out)
+        result = out.getvalue()
+
+        self.assertIn('Поставлено в очередь: 30, отправлено: 30, получено сервером: 30', result)
+        self.assertIn('Запросов к БД на напоминание', result)
+        self.assertIn('Длительность тика: p50', result)
+        self.assertNotIn('Пиковая память постановки в очередь', result)
+
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Habit.objects.exists())
+        self.assertFalse(Schedule.objects.exists())
+        self.assertFalse(Interval.objects.exists())
+        self.assertFalse(ReminderOutbox.objects.exists())
+
+    def test_benchmark_reminders_skips_other_users(self):
+        now = timezone.now()
+        user = User.objects.create(username='ksu', telegram_username='@ksu', telegram_user_id=100)
+        schedule = Schedule.objects.create(**{field_name: (now - timedelta(minutes=2)).time()
+                                              for field_name in DAYS_OF_WEEK_FIELDS})
+        scheduled_habit = Habit.objects.create(user=user, operation='почитать', schedule=schedule)
+        interval = Interval.objects.create(interval=timedelta(hours=1), next_fire_at=now - timedelta(hours=1))
+        Habit.objects.create(user=user, operation='помедитировать', interval=interval)
+        reminder = ReminderOutbox.objects.create(habit=scheduled_habit, fire_slot=now, chat_id=100, text='текст')
+
+        out = StringIO()
+        call_command('benchmark_reminders', users=10, habits_per_user=2, ticks=2, stdout=out)
+
+        self.assertIn('Поставлено в очередь: 20, отправлено: 20, получено сервером: 20', out.getvalue())
+        scheduled_habit.refresh_from_db()
+        self.assertIsNone(scheduled_habit.schedule_last_event)
+        interval.refresh_from_db()
+        self.assertIsNone(interval.last_event)
+        reminder.refresh_from_db()
+        self.assertEqual(reminder.status, ReminderOutbox.STATUS_PENDING)
+        self.assertEqual(ReminderOutbox.objects.count(), 1)
+
+    def test_benchmark_reminders_trace_memory(self):
+        out = StringIO()
+        call_command('benchmark_reminders', users=10, habits_per_user=2, ticks=1, trace_memory=True, stdout=out)
+
+        self.assertIn('Пиковая память постановки в очередь', out.getvalue())
+
+    def test_benchmark_habit_list(self):
+        out = StringIO()
+        call_command('benchmark_habit_list', habits=20, repeat=1, stdout=out)
+
+        self.assertIn('JSON совпадает побайтно', out.getvalue())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Habit.objects.exists())
+        self.assertFalse(Schedule.objects.exists())
+        self.assertFalse(Interval.objects.exists())
+
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([3.0], 99), 3.0)
+        self.assertEqual(percentile([], 50), 0.0)
@@ -0,0 +1,133 @@
+import math
+import random
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+import fakeredis
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from habits.dispatcher import ReminderDispatcher
+from habits.models import Habit, Schedule, Interval, ReminderOutbox
+from habits.timing_wheel import HierarchicalTimingWheel
+from users.models import User
+
+
+class HierarchicalTimingWheelTestCase(SimpleTestCase):
+
+    def test_advance(self):
+        wheel = HierarchicalTimingWheel(tick=1, start=100)
+        wheel.add('a', 102.5)
+        wheel.add('b', 101)
+
+        self.assertEqual(wheel.advance(100.9), [])
+        self.assertEqual(wheel.advance(101), ['b'])
+        self.assertEqual(wheel.advance(102.9), [])
+        self.assertEqual(wheel.advance(103), ['a'])
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_deadline_fires_on_next_tick(self):
+        wheel = HierarchicalTimingWheel(tick=1, start=100)
+        wheel.add('a', 50)
+        self.assertEqual(wheel.advance(101), ['a'])
+
+    def test_remove_and_reschedule(self):
+        wheel = HierarchicalTimingWheel(tick=1, slots=4, levels=2, start=0)
+        wheel.add('a', 3)
+        wheel.add('b', 3)
+        wheel.add('a', 10)
+        wheel.remove('b')
+
+        self.assertEqual(wheel.advance(9), [])
+        self.assertEqual(wheel.advance(10), ['a'])
+
+    def test_cascade(self):
+        rng = random.Random(1)
+        wheel = HierarchicalTimingWheel(tick=1, slots=4, levels=3, start=5)
+        deadlines = {key: rng.uniform(0, 200) for key in range(300)}
+        for key, deadline in deadlines.items():
+            wheel.add(key, deadline)
+
+        fired = {}
+        for now in range(6, 210):
+            for key in wheel.advance(now):
+                fired[key] = now
+
+        self.assertEqual(fired, {key: max(math.ceil(deadline), 6) for key, deadline in deadlines.items()})
+
+
+class ReminderDispatcherTestCase(TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch('habits.tasks.task_deliver_reminders.delay')
+        self.deliver = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('habits.metrics.get_redis_client', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.now = datetime(2023, 10, 23, 13, 59, 30, tzinfo=dt_timezone.utc)
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu', telegram_user_id=100)
+        self.habit_schedule = Habit.objects.create(user=self.user, operation='решать ката',
+                                                   schedule=Schedule.objects.create(monday='14:00:00'))
+        self.habit_interval = Habit.objects.create(
+            user=self.user,
+            operation='помедитировать',
+            interval=Interval.objects.create(interval=timedelta(minutes=30),
+                                             last_event=self.now - timedelta(minutes=20))
+        )
+        self.dispatcher = ReminderDispatcher(horizon=timedelta(hours=1), tick=1, clock=lambda: self.now)
+
+    def test_step(self):
+        self.assertEqual(self.dispatcher.step(self.now), [])
+        self.assertIn(self.habit_schedule.pk, self.dispatcher.wheel)
+        self.assertIn(self.habit_interval.pk, self.dispatcher.wheel)
+
+        self.assertEqual(self.dispatcher.step(self.now + timedelta(seconds=29)), [])
+        self.assertEqual(self.dispatcher.step(self.now + timedelta(seconds=30)), [self.habit_schedule.pk])
+        self.assertEqual(ReminderOutbox.objects.get().habit, self.habit_schedule)
+        self.deliver.assert_called_once()
+        self.assertNotIn(self.habit_schedule.pk, self.dispatcher.wheel)
+
+        self.assertEqual(self.dispatcher.step(self.now + timedelta(minutes=10)), [self.habit_interval.pk])
+        self.assertEqual(ReminderOutbox.objects.count(), 2)
+        self.assertIn(self.habit_interval.pk, self.dispatcher.wheel)
+
+        self.assertEqual(self.dispatcher.step(self.now + timedelta(minutes=39)), [])
+        self.assertEqual(self.dispatcher.step(self.now + timedelta(minutes=40)), [self.habit_interval.pk])
+
+    def test_apply_changes(self):
+        self.dispatcher.step(self.now)
+
+        habit = Habit.objects.create(user=self.user, operation='почитать',
+                                     schedule=Schedule.objects.create(monday='14:10:00'))
+        self.dispatcher.apply_changes([f'habit:{habit.pk}'])
+        self.assertIn(habit.pk, self.dispatcher.wheel)
+
+        self.habit_schedule.schedule.monday = '18:00:00'
+        self.habit_schedule.schedule.save()
+        self.dispatcher.apply_changes([f'schedule:{self.habit_schedule.schedule_id}'])
+        self.assertNotIn(self.habit_schedule.pk, self.dispatcher.wheel)
+
+        habit_id = habit.pk
+        habit.delete()
+        self.user.telegram_user_id = None
+        self.user.save()
+        self.dispatcher.apply_changes([f'habit:{habit_id}', f'user:{self.user.pk}', 'bad'])
+        self.assertEqual(len(self.dispatcher.wheel), 0)
+
+
+@override_settings(REMINDER_DISPATCHER_ENABLED=True)
+class ReminderDispatcherNotifyTestCase(TransactionTestCase):
+
+    def test_wait_for_changes(self):
+        dispatcher = ReminderDispatcher()
+        dispatcher.listen()
+
+        user = User.objects.create(username='ksu', telegram_username='@ksu', telegram_user_id=100)
+        habit = Habit.objects.create(user=user, operation='решать ката',
+                                     schedule=Schedule.objects.create(monday='14:00:00'))
+
+        changes = dispatcher.wait_for_changes(1)
+        self.assertIn(f'user:{user.pk}', changes)
+        self.assertIn(f'schedule:{habit.schedule_id}', changes)
+        self.assertIn(f'habit:{habit.pk}', changes)
@@ -0,0 +1,104 @@
+from unittest import mock
+
+import fakeredis
+import redis
+from django.test import SimpleTestCase, override_settings
+from rest_framework.reverse import reverse
+
+from habits.metrics import MetricsBuffer, metrics, render_metrics, METRICS_KEY
+from habits.ratelimit import TelegramRateLimiter
+from habits.telegram import TelegramSender, TelegramMessage
+from habits.testing.fake_telegram import FakeTelegramServer
+
+
+class MetricsTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.client_redis = fakeredis.FakeRedis()
+        patcher = mock.patch('habits.metrics.get_redis_client', return_value=self.client_redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.values.clear()
+        self.addCleanup(metrics.values.clear)
+
+    def test_flush(self):
+        buffer = MetricsBuffer()
+        buffer.inc('habits_dispatch_rows_scanned_total', 10, kind='interval')
+        buffer.inc('habits_dispatch_rows_scanned_total', 5, kind='interval')
+        buffer.flush()
+        buffer.inc('habits_dispatch_rows_scanned_total', 1, kind='interval')
+        buffer.flush()
+
+        self.assertEqual(buffer.values, {})
+        self.assertEqual(
+            self.client_redis.hgetall(METRICS_KEY),
+            {b'habits_dispatch_rows_scanned_total{kind="interval"}': b'16'}
+        )
+
+    def test_flush_without_redis(self):
+        buffer = MetricsBuffer()
+        buffer.inc('habits_dispatch_skipped_ticks_total', task='tick')
+        client = mock.Mock()
+        client.pipeline.return_value.execute.side_effect = redis.ConnectionError
+
+        with mock.patch('habits.metrics.get_redis_client', return_value=client), \
+                self.assertLogs('habits.metrics', 'ERROR'):
+            buffer.flush()
+        self.assertEqual(buffer.values, {})
+
+    def test_render(self):
+        buffer = MetricsBuffer()
+        buffer.inc('habits_dispatch_reminders_due_total', 3, kind='scheduled')
+        buffer.observe('habits_reminder_lag_seconds', 4)
+        buffer.observe('habits_reminder_lag_seconds', 20)
+        buffer.flush()
+
+        lines = render_metrics().splitlines()
+
+        self.assertIn('# TYPE habits_dispatch_reminders_due_total counter', lines)
+        self.assertIn('habits_dispatch_reminders_due_total{kind="scheduled"} 3', lines)
+        self.assertIn('# TYPE habits_reminder_lag_seconds histogram', lines)
+        self.assertIn('habits_reminder_lag_seconds_bucket{le="1"} 0', lines)
+        self.assertIn('habits_reminder_lag_seconds_bucket{le="5"} 1', lines)
+        self.assertIn('habits_reminder_lag_seconds_bucket{le="30"} 2', lines)
+        self.assertIn('habits_reminder_lag_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('habits_reminder_lag_seconds_sum 24', lines)
+        self.assertIn('habits_reminder_lag_seconds_count 2', lines)
+        self.assertNotIn('habits_dispatch_tick_seconds_count 0', lines)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_view(self):
+        metrics.inc('habits_dispatch_skipped_ticks_total', task='scheduled:0:1')
+        metrics.flush()
+
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('habits_dispatch_skipped_ticks_total{task="scheduled:0:1"} 1', response.content.decode())
+
+        self.client_redis.hgetall = mock.Mock(side_effect=redis.ConnectionError)
+        with self.assertLogs('habits.views', 'ERROR'):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 503)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_view_forbidden(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer None').status_code, 403)
+
+    def test_telegram_send(self):
+        server = FakeTelegramServer().start()
+        self.addCleanup(server.stop)
+        server.add_response(2, 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'})
+        limiter = TelegramRateLimiter(global_rate=10000, chat_rate=10000, group_rate=10000)
+
+        with override_settings(TELEGRAM_MAIN_URL=server.url, TELEGRAM_TOKEN='token'), \
+                TelegramSender(concurrency=1, limiter=limiter) as sender:
+            sender.send_batch([TelegramMessage(1, 'первое'), TelegramMessage(2, 'второе')])
+
+        self.assertEqual(metrics.values['habits_telegram_send_seconds_count'], 2)
+        self.assertEqual(metrics.values['habits_telegram_send_failures_total{status="400"}'], 1)
@@ -1,4 +1,5 @@
 from django.test import TestCase
+from habits import services
 from habits.models import Habit, Schedule, Interval
 from users.models import User
 
@@ -14,6 +15,16 @@ class ScheduleStrTestCase(TestCase):
     def test_str(self):
         self.assertEqual(str(self.schedule), 'пн: 14:00:00, пт: 17:00:00')
 
+    def test_fire_times(self):
+        minutes = sorted(self.schedule.fire_times.values_list('minute_of_week', flat=True))
+        self.assertEqual(minutes, [14 * 60, 4 * 24 * 60 + 17 * 60])
+
+        self.schedule.friday = None
+        self.schedule.sunday = '08:30:00'
+        self.schedule.save()
+        minutes = sorted(self.schedule.fire_times.values_list('minute_of_week', flat=True))
+        self.assertEqual(minutes, [14 * 60, 6 * 24 * 60 + 8 * 60 + 30])
+
 
 class IntervalStrTestCase(TestCase):
 
@@ -85,6 +96,47 @@ class HabitStrTestCase(TestCase):
         self.assertEqual(str(self.someone_public_habit), 'Поработать с интервалом в 02:00:00 часов на работе')
 
 
+class HabitDeliverableTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu')
+        self.habit = Habit.objects.create(user=self.user, operation='решать ката',
+                                          schedule=Schedule.objects.create(monday='14:00:00'))
+        self.enjoyable_habit = Habit.objects.create(user=self.user, operation='съесть авокадо', is_enjoyable=True)
+
+    def get_deliverable(self):
+        return set(Habit.objects.filter(is_deliverable=True).values_list('operation', flat=True))
+
+    def test_user_chat(self):
+        self.assertEqual(self.get_deliverable(), set())
+
+        self.user.telegram_user_id = 100
+        self.user.save()
+        self.assertEqual(self.get_deliverable(), {'решать ката'})
+
+        services.block_telegram_chats([100])
+        self.assertEqual(self.get_deliverable(), set())
+
+        self.user.refresh_from_db()
+        self.user.telegram_blocked = False
+        self.user.save(update_fields=['telegram_blocked'])
+        self.assertEqual(self.get_deliverable(), {'решать ката'})
+
+    def test_habit_type(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+
+        self.habit.is_enjoyable = True
+        self.habit.schedule = None
+        self.habit.save()
+        self.assertEqual(self.get_deliverable(), set())
+
+        self.enjoyable_habit.is_enjoyable = False
+        self.enjoyable_habit.interval = Interval.objects.create(interval='03:00:00')
+        self.enjoyable_habit.save(update_fields=['is_enjoyable', 'interval'])
+        self.assertEqual(self.get_deliverable(), {'съесть авокадо'})
+
+
 class ServicesTestCase(TestCase):
     def setUp(self) -> None:
         self.user = User.objects.create(
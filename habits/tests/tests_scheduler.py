@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
+
+import fakeredis
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from habits import scheduler, services
+from habits.models import Habit, Interval, ReminderOutbox
+from habits.scheduler import RedisDueQueue
+from users.models import User
+
+
+class RedisDueQueueTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.queue = RedisDueQueue(fakeredis.FakeRedis(), shards=2)
+        self.now = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+
+    def test_claim_due(self):
+        self.queue.add([
+            (1, 10, self.now - timedelta(minutes=2)),
+            (2, 20, self.now - timedelta(minutes=1)),
+            (3, 30, self.now),
+            (4, 40, self.now + timedelta(minutes=1)),
+            (5, 11, self.now),
+        ])
+
+        self.assertEqual(self.queue.claim_due(0, self.now, 2), [1, 2])
+        self.assertEqual(self.queue.claim_due(0, self.now, 2), [3])
+        self.assertEqual(self.queue.claim_due(0, self.now, 2), [])
+        self.assertEqual(self.queue.claim_due(1, self.now, 2), [5])
+        self.assertEqual(self.queue.claim_due(0, self.now + timedelta(minutes=1), 2), [4])
+
+    def test_claim_due_lease(self):
+        self.queue.add([(1, 10, self.now), (2, 20, self.now + timedelta(minutes=1))])
+
+        with mock.patch('habits.scheduler.time.time', return_value=self.now.timestamp()):
+            self.assertEqual(self.queue.claim_due(0, self.now, 10, lease=timedelta(minutes=5)), [1])
+            self.assertEqual(
+                self.queue.claim_due(0, self.now + timedelta(minutes=4), 10, lease=timedelta(minutes=5)), [2])
+
+        # Обработчик не вернул привычки в очередь: по окончании аренды их снова можно забрать
+        self.assertEqual(self.queue.claim_due(0, self.now + timedelta(minutes=4, seconds=59), 10), [])
+        self.assertEqual(self.queue.claim_due(0, self.now + timedelta(minutes=5), 10, lease=timedelta(minutes=5)), [1])
+        self.assertEqual(self.queue.claim_due(0, self.now + timedelta(minutes=9), 10, lease=timedelta(minutes=5)), [2])
+
+    def test_add_reschedules(self):
+        self.queue.add([(1, 10, self.now)])
+        self.queue.add([(1, 10, self.now + timedelta(hours=1))])
+        self.assertEqual(self.queue.claim_due(0, self.now, 10), [])
+
+        self.queue.remove([1])
+        self.assertEqual(self.queue.claim_due(0, self.now + timedelta(hours=1), 10), [])
+
+    def test_clear(self):
+        self.queue.add([(1, 10, self.now), (2, 11, self.now)])
+        self.queue.clear()
+        self.assertEqual(self.queue.claim_due(0, self.now, 10), [])
+        self.assertEqual(self.queue.claim_due(1, self.now, 10), [])
+
+
+@override_settings(REMINDER_SCHEDULER_BACKEND='redis', REMINDER_DISPATCH_SHARDS=2)
+class RedisSchedulerTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch('habits.scheduler.get_redis_client', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scheduler._queue = None
+        self.addCleanup(setattr, scheduler, '_queue', None)
+
+        self.now = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu', telegram_user_id=100)
+        self.habit = Habit.objects.create(
+            user=self.user,
+            operation='помедитировать',
+            interval=Interval.objects.create(interval=timedelta(hours=3), next_fire_at=self.now)
+        )
+        self.habit_outside_window = Habit.objects.create(
+            user=self.user,
+            operation='почитать',
+            interval=Interval.objects.create(interval=timedelta(hours=3), next_fire_at=self.now,
+                                             start_time='18:00:00', end_time='22:00:00')
+        )
+
+    def get_score(self, habit: Habit) -> datetime:
+        score = self.redis.zscore(scheduler.get_due_queue().key(0), habit.pk)
+        return datetime.fromtimestamp(score, tz=dt_timezone.utc)
+
+    def test_send_interval_reminder(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_reminder_queue', stdout=StringIO())
+        deleted_habit = Habit.objects.create(user=self.user, operation='удалить',
+                                             interval=Interval.objects.create(interval=timedelta(hours=1),
+                                                                              next_fire_at=self.now))
+        scheduler.schedule_interval_habits([deleted_habit])
+        deleted_habit.interval.delete()
+
+        self.assertEqual(services.send_interval_reminder(0, 2, self.now), 1)
+        self.assertEqual(services.send_interval_reminder(1, 2, self.now), 0)
+
+        reminder = ReminderOutbox.objects.get()
+        self.assertEqual(reminder.habit, self.habit)
+        self.assertEqual(reminder.fire_slot, self.now)
+
+        self.assertEqual(self.get_score(self.habit), self.now + timedelta(hours=3))
+        self.assertEqual(self.get_score(self.habit_outside_window), self.now.replace(hour=18))
+        self.assertEqual(self.redis.zcard(scheduler.get_due_queue().key(0)), 2)
+
+        self.habit.interval.refresh_from_db()
+        self.assertEqual(self.habit.interval.last_event, self.now)
+        self.assertEqual(self.habit.interval.next_fire_at, self.now + timedelta(hours=3))
+
+        self.assertEqual(services.send_interval_reminder(0, 2, self.now + timedelta(hours=1)), 0)
+        self.assertEqual(services.send_interval_reminder(0, 2, self.now.replace(hour=18)), 2)
+
+    def test_send_interval_reminder_failure_keeps_queue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_reminder_queue', stdout=StringIO())
+
+        with mock.patch('habits.scheduler.time.time', return_value=self.now.timestamp()):
+            with mock.patch('habits.services.enqueue_interval_reminders', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    services.send_interval_reminder(0, 2, self.now)
+
+            self.assertEqual(self.get_score(self.habit), self.now + timedelta(minutes=5))
+            self.assertEqual(services.send_interval_reminder(0, 2, self.now + timedelta(minutes=5)), 1)
+        self.assertEqual(ReminderOutbox.objects.get().habit, self.habit)
+
+    def test_send_interval_reminder_shards_mismatch(self):
+        with self.assertRaises(ValueError):
+            services.send_interval_reminder(0, 3, self.now)
+
+    def test_rebuild_reminder_queue(self):
+        Habit.objects.create(user=User.objects.create(username='no_chat', telegram_username='@no_chat'),
+                             operation='без чата', interval=Interval.objects.create(interval=timedelta(hours=1)))
+        self.redis.zadd('habits:interval_due:5', {999: 0})
+
+        out = StringIO()
+        call_command('rebuild_reminder_queue', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'В очередь добавлено привычек: 2.')
+        self.assertEqual(self.get_score(self.habit), self.now)
+        self.assertFalse(self.redis.exists('habits:interval_due:5'))
+
+    def test_reschedule_on_telegram_chat_change(self):
+        queue = scheduler.get_due_queue()
+        self.user.telegram_user_id = None
+        self.user.save()
+        self.assertEqual(queue.claim_due(0, self.now, 10), [])
+
+        self.user.telegram_user_id = 101
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+        self.assertEqual(queue.claim_due(0, self.now, 10), [])
+        self.assertEqual(sorted(queue.claim_due(1, self.now, 10)), [self.habit.pk, self.habit_outside_window.pk])
+
+    @override_settings(REMINDER_SCHEDULER_BACKEND='db')
+    def test_db_backend(self):
+        self.assertIsNone(scheduler.get_due_queue())
+        self.assertEqual(scheduler.schedule_interval_habits([self.habit]), 0)
+        self.assertEqual(services.send_interval_reminder(0, 1, self.now), 1)
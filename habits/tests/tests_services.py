@@ -1,13 +1,22 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from habits import services
-from habits.models import Habit, Schedule, Interval
+from habits.models import Habit, Schedule, Interval, ReminderOutbox
+from habits.telegram import DeliveryResult
+from habits.tests.utils import send_batch
 from users.models import User
 
 
+def count_sent(sender):
+    return sum(len(call.args[0]) for call in sender.send_batch.call_args_list)
+
+
 class ServicesTestCase(TestCase):
 
     def setUp(self) -> None:
@@ -97,3 +106,430 @@ class ServicesTestCase(TestCase):
         result = services.is_reminder_time_active(time_now, start_time, end_time)
         self.assertTrue(result)
 
+    def test_get_interval_next_fire_at(self):
+        interval = Interval.objects.get(pk=self.habit_interval.interval.pk)
+        current_datetime = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+
+        result = services.get_interval_next_fire_at(interval, current_datetime)
+        self.assertEqual(result, current_datetime)
+
+        interval.last_event = datetime(2023, 10, 23, 12, 0, tzinfo=dt_timezone.utc)
+        result = services.get_interval_next_fire_at(interval, current_datetime)
+        self.assertEqual(result, datetime(2023, 10, 23, 15, 0, tzinfo=dt_timezone.utc))
+
+        interval.last_event = datetime(2023, 10, 23, 17, 0, tzinfo=dt_timezone.utc)
+        result = services.get_interval_next_fire_at(interval, current_datetime)
+        self.assertEqual(result, datetime(2023, 10, 24, 10, 0, tzinfo=dt_timezone.utc))
+
+        interval.last_event = None
+        current_datetime = datetime(2023, 10, 23, 7, 30, tzinfo=dt_timezone.utc)
+        result = services.get_interval_next_fire_at(interval, current_datetime)
+        self.assertEqual(result, datetime(2023, 10, 23, 10, 0, tzinfo=dt_timezone.utc))
+
+        interval.start_time = datetime.strptime("21:00:00", "%H:%M:%S").time()
+        interval.end_time = datetime.strptime("06:00:00", "%H:%M:%S").time()
+        current_datetime = datetime(2023, 10, 23, 5, 0, tzinfo=dt_timezone.utc)
+        interval.last_event = current_datetime - timedelta(hours=1)
+        result = services.get_interval_next_fire_at(interval, current_datetime)
+        self.assertEqual(result, datetime(2023, 10, 23, 21, 0, tzinfo=dt_timezone.utc))
+
+    def test_get_interval_due_q(self):
+        windows = [
+            (None, None),
+            (None, '18:00:00'),
+            ('10:00:00', '19:00:00'),
+            ('21:00:00', '06:00:00'),
+            ('00:00:00', '23:59:00'),
+            ('12:00:00', '12:00:00'),
+        ]
+        current_times = ['00:00:00', '06:00:00', '07:30:00', '10:00:00', '12:00:00', '18:59:59', '19:00:00',
+                         '21:00:00', '23:59:00']
+        elapsed = [None, timedelta(hours=2), timedelta(hours=3), timedelta(hours=4)]
+
+        intervals = [
+            Interval.objects.create(interval='03:00:00', start_time=start_time, end_time=end_time)
+            for start_time, end_time in windows
+        ]
+        intervals = list(Interval.objects.filter(pk__in=[interval.pk for interval in intervals]))
+
+        for current_time in current_times:
+            current_datetime = datetime.combine(datetime(2023, 10, 23),
+                                                datetime.strptime(current_time, "%H:%M:%S").time(),
+                                                tzinfo=dt_timezone.utc)
+            for last_event_ago in elapsed:
+                last_event = current_datetime - last_event_ago if last_event_ago else None
+                Interval.objects.filter(pk__in=[interval.pk for interval in intervals]).update(last_event=last_event)
+
+                expected = {
+                    interval.pk for interval in intervals
+                    if services.is_reminder_time_active(current_datetime.time(), interval.start_time, interval.end_time)
+                    and not (last_event and last_event + interval.interval > current_datetime)
+                }
+                result = set(Interval.objects.filter(
+                    services.get_interval_due_q(current_datetime, prefix=''),
+                    pk__in=[interval.pk for interval in intervals]
+                ).values_list('pk', flat=True))
+                self.assertEqual(result, expected, (current_time, last_event_ago))
+
+    def test_send_interval_reminder_outside_window(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+
+        current_datetime = datetime(2023, 10, 23, 20, 0, tzinfo=dt_timezone.utc)
+        Interval.objects.filter(pk=self.habit_interval.interval.pk).update(
+            next_fire_at=current_datetime - timedelta(hours=2)
+        )
+
+        with mock.patch('habits.services.timezone.now', return_value=current_datetime):
+            self.assertEqual(services.send_interval_reminder(), 0)
+
+        with mock.patch('habits.services.timezone.now', return_value=current_datetime + timedelta(hours=14)):
+            self.assertEqual(services.send_interval_reminder(), 1)
+
+    def test_send_interval_reminder_outside_window_rescheduled(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+
+        current_datetime = datetime(2023, 10, 23, 20, 0, tzinfo=dt_timezone.utc)
+        Interval.objects.filter(pk=self.habit_interval.interval.pk).update(
+            next_fire_at=current_datetime - timedelta(hours=2)
+        )
+
+        self.assertEqual(services.send_interval_reminder(current_datetime=current_datetime), 0)
+        self.habit_interval.interval.refresh_from_db()
+        self.assertEqual(self.habit_interval.interval.next_fire_at,
+                         datetime(2023, 10, 24, 10, 0, tzinfo=dt_timezone.utc))
+
+        with mock.patch('habits.services.get_interval_next_fire_at') as get_interval_next_fire_at:
+            self.assertEqual(
+                services.send_interval_reminder(current_datetime=current_datetime + timedelta(seconds=30)), 0)
+        get_interval_next_fire_at.assert_not_called()
+
+        self.assertEqual(
+            services.send_interval_reminder(current_datetime=datetime(2023, 10, 24, 10, 0, tzinfo=dt_timezone.utc)), 1
+        )
+
+    def test_send_interval_reminder(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+
+        current_datetime = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        interval = Interval.objects.get(pk=self.habit_interval.interval.pk)
+        interval.next_fire_at = current_datetime + timedelta(minutes=1)
+        interval.save()
+
+        with mock.patch('habits.services.timezone.now', return_value=current_datetime):
+            self.assertEqual(services.send_interval_reminder(), 0)
+        self.assertFalse(ReminderOutbox.objects.exists())
+
+        interval.next_fire_at = current_datetime
+        interval.save()
+
+        with mock.patch('habits.services.timezone.now', return_value=current_datetime):
+            self.assertEqual(services.send_interval_reminder(), 1)
+
+        reminder = ReminderOutbox.objects.get()
+        self.assertEqual(reminder.habit, self.habit_interval)
+        self.assertEqual(reminder.chat_id, 100)
+        self.assertEqual(reminder.fire_slot, current_datetime)
+        self.assertEqual(reminder.status, ReminderOutbox.STATUS_PENDING)
+
+        interval.refresh_from_db()
+        self.assertEqual(interval.last_event, current_datetime)
+        self.assertEqual(interval.next_fire_at, current_datetime + timedelta(hours=3))
+
+    def test_send_reminder_blocked_chat(self):
+        self.user.telegram_user_id = 100
+        self.user.telegram_blocked = True
+        self.user.save()
+
+        current_datetime = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        self.assertEqual(services.send_scheduled_reminder(current_datetime=current_datetime), 0)
+        self.assertEqual(services.send_interval_reminder(current_datetime=current_datetime), 0)
+
+        self.user.telegram_blocked = False
+        self.user.save()
+        self.assertEqual(services.send_scheduled_reminder(current_datetime=current_datetime), 1)
+        self.assertEqual(services.send_interval_reminder(current_datetime=current_datetime), 1)
+
+    def test_send_scheduled_reminder(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+
+        monday = datetime(2023, 10, 23, 13, 59, tzinfo=dt_timezone.utc)
+        with mock.patch('habits.services.timezone.now', return_value=monday):
+            services.send_scheduled_reminder()
+        self.assertFalse(ReminderOutbox.objects.exists())
+
+        with mock.patch('habits.services.timezone.now', return_value=monday + timedelta(minutes=5)):
+            services.send_scheduled_reminder()
+            services.send_scheduled_reminder()
+
+        reminder = ReminderOutbox.objects.get()
+        self.assertEqual(reminder.fire_slot, datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(reminder.text, 'Когда: сегодня в 14:00\nЧто сделать: решать ката дома\n'
+                                        'В течение 0:01:00 секунд\nВ качестве поощрения: позалипать в видео\n')
+
+        self.habit_schedule.refresh_from_db()
+        self.assertEqual(self.habit_schedule.schedule_last_event, monday.date())
+
+        with self.settings(SCHEDULED_REMINDER_LOOKBACK_MINUTES=60):
+            friday = datetime(2023, 10, 27, 21, 1, tzinfo=dt_timezone.utc)
+            with mock.patch('habits.services.timezone.now', return_value=friday):
+                services.send_scheduled_reminder()
+            self.assertEqual(ReminderOutbox.objects.count(), 1)
+
+    def test_send_scheduled_reminder_batches(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+        for _ in range(4):
+            Habit.objects.create(user=self.user, operation='решать ката',
+                                 schedule=Schedule.objects.create(monday='14:00:00'))
+
+        monday = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        with self.settings(REMINDER_BATCH_SIZE=2), \
+                mock.patch('habits.services.timezone.now', return_value=monday), \
+                CaptureQueriesContext(connection) as queries:
+            services.send_scheduled_reminder()
+
+        writes = [query for query in queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(writes), 6)
+        self.assertEqual(ReminderOutbox.objects.count(), 5)
+        self.assertFalse(
+            Habit.objects.exclude(schedule_last_event=monday.date()).filter(schedule__isnull=False).exists())
+
+    def test_send_scheduled_reminder_shared_schedule(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+        schedule = services.get_or_create_schedule({'monday': '14:00:00'})
+        self.assertEqual(services.get_or_create_schedule({'monday': '14:00'}), schedule)
+        habits = [Habit.objects.create(user=self.user, operation=f'привычка {i}', schedule=schedule) for i in range(5)]
+
+        monday = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(services.send_scheduled_reminder(current_datetime=monday), 6)
+
+        schedule_queries = [query for query in queries if 'FROM "habits_schedule"' in query['sql']]
+        self.assertEqual(len(schedule_queries), 1)
+        self.assertEqual(ReminderOutbox.objects.filter(habit__in=habits).count(), 5)
+        self.assertEqual(services.send_scheduled_reminder(current_datetime=monday), 0)
+
+    def test_send_reminder_without_users_join(self):
+        user = User.objects.create(username='oleg', telegram_username='@oleg', telegram_user_id=101)
+        Habit.objects.create(user=user, operation='прочитать главу',
+                             schedule=Schedule.objects.create(monday='14:00:00'))
+        Habit.objects.create(user=user, operation='помедитировать',
+                             interval=Interval.objects.create(interval='03:00:00'))
+
+        current_datetime = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(services.send_scheduled_reminder(1, 4, current_datetime), 1)
+            self.assertEqual(services.send_interval_reminder(1, 4, current_datetime), 1)
+
+        self.assertFalse([query for query in queries if '"users_user"' in query['sql']])
+        self.assertEqual(set(ReminderOutbox.objects.values_list('chat_id', flat=True)), {101})
+
+        user.telegram_user_id = 102
+        user.save()
+        self.assertEqual(set(Habit.objects.filter(user=user).values_list('chat_id', flat=True)), {102})
+        services.block_telegram_chats([102])
+        self.assertEqual(set(Habit.objects.filter(user=user).values_list('is_deliverable', 'chat_id')), {(False, None)})
+
+    def test_send_reminder_query_count(self):
+        self.user.telegram_user_id = 100
+        self.user.save()
+
+        query_counts = []
+        for week, habits_count in enumerate((2, 20)):
+            for _ in range(habits_count):
+                related_habit = Habit.objects.create(user=self.user, operation='съесть авокадо', is_enjoyable=True,
+                                                     schedule=Schedule.objects.create(sunday='09:00:00'))
+                Habit.objects.create(user=self.user, operation='прочитать главу', related_habit=related_habit,
+                                     schedule=Schedule.objects.create(monday='14:00:00'))
+                Habit.objects.create(user=self.user, operation='помедитировать', related_habit=related_habit,
+                                     interval=Interval.objects.create(interval='03:00:00'))
+
+            current_datetime = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc) + timedelta(weeks=week)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertGreaterEqual(services.send_scheduled_reminder(current_datetime=current_datetime),
+                                        habits_count)
+                self.assertGreaterEqual(services.send_interval_reminder(current_datetime=current_datetime),
+                                        habits_count)
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        reminder = ReminderOutbox.objects.filter(habit__operation='прочитать главу').first()
+        self.assertIn('В качестве поощрения: Съесть авокадо вс: 09:00:00', reminder.text)
+
+
+class DeliverRemindersTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu', telegram_user_id=100)
+        self.habits = [
+            Habit.objects.create(user=self.user, operation=f'привычка {i}',
+                                 schedule=Schedule.objects.create(monday='14:00:00'))
+            for i in range(3)
+        ]
+        self.fire_slot = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        self.reminders = [
+            ReminderOutbox.objects.create(habit=habit, fire_slot=self.fire_slot, chat_id=100 + i, text=f'текст {i}')
+            for i, habit in enumerate(self.habits)
+        ]
+
+        patcher = mock.patch('habits.services.get_telegram_sender')
+        self.sender = patcher.start().return_value
+        self.sender.send_batch.side_effect = send_batch
+        self.sender.breaker.is_open.return_value = False
+        self.addCleanup(patcher.stop)
+
+    def test_deliver_reminders(self):
+        with self.settings(OUTBOX_BATCH_SIZE=2):
+            self.assertEqual(services.deliver_reminders(), 3)
+            self.assertEqual(services.deliver_reminders(), 0)
+
+        self.assertEqual(self.sender.send_batch.call_count, 2)
+        self.assertEqual(ReminderOutbox.objects.filter(status=ReminderOutbox.STATUS_SENT).count(), 3)
+
+    def test_deliver_reminders_shard(self):
+        services.deliver_reminders(shard=1, shards=2)
+
+        self.assertEqual(count_sent(self.sender), 1)
+        self.assertEqual(ReminderOutbox.objects.get(status=ReminderOutbox.STATUS_SENT).chat_id, 101)
+
+    def test_deliver_reminders_failed(self):
+        current_datetime = timezone.now()
+        self.sender.send_batch.side_effect = lambda messages, on_result=None: [
+            on_result(i, DeliveryResult(message, False, 502, 'Bad Gateway') if message.chat_id != 101
+                      else DeliveryResult(message, False, 429, 'Too Many Requests', retry_after=20))
+            for i, message in enumerate(messages)
+        ]
+
+        with self.settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_DELAY=timedelta(seconds=30)):
+            self.assertEqual(services.deliver_reminders(), 0)
+
+            reminder = ReminderOutbox.objects.get(chat_id=100)
+            self.assertEqual(reminder.status, ReminderOutbox.STATUS_PENDING)
+            self.assertEqual(reminder.attempts, 1)
+            self.assertEqual(reminder.last_error, '502 Bad Gateway')
+            self.assertAlmostEqual(reminder.next_attempt_at - current_datetime, timedelta(seconds=30),
+                                   delta=timedelta(seconds=5))
+
+            reminder = ReminderOutbox.objects.get(chat_id=101)
+            self.assertAlmostEqual(reminder.next_attempt_at - current_datetime, timedelta(seconds=20),
+                                   delta=timedelta(seconds=5))
+
+            ReminderOutbox.objects.update(next_attempt_at=current_datetime)
+            services.deliver_reminders()
+
+        self.assertEqual(ReminderOutbox.objects.get(chat_id=100).status, ReminderOutbox.STATUS_FAILED)
+        self.assertEqual(ReminderOutbox.objects.get(chat_id=101).status, ReminderOutbox.STATUS_PENDING)
+
+    def test_deliver_reminders_deferred(self):
+        current_datetime = timezone.now()
+        self.sender.send_batch.side_effect = lambda messages, on_result=None: [
+            on_result(i, DeliveryResult(message, False, description='Отправка отложена', retry_after=15,
+                                        is_deferred=True))
+            for i, message in enumerate(messages)
+        ]
+
+        self.assertEqual(services.deliver_reminders(), 0)
+
+        for reminder in ReminderOutbox.objects.all():
+            self.assertEqual(reminder.status, ReminderOutbox.STATUS_PENDING)
+            self.assertEqual(reminder.attempts, 0)
+            self.assertAlmostEqual(reminder.next_attempt_at - current_datetime, timedelta(seconds=15),
+                                   delta=timedelta(seconds=5))
+
+        ReminderOutbox.objects.update(next_attempt_at=current_datetime)
+        self.sender.send_batch.reset_mock()
+        self.sender.breaker.is_open.return_value = True
+        self.assertEqual(services.deliver_reminders(), 0)
+        self.sender.send_batch.assert_not_called()
+        self.assertFalse(ReminderOutbox.objects.filter(next_attempt_at__gt=current_datetime).exists())
+
+    def test_deliver_reminders_blocked_chat(self):
+        other_user = User.objects.create(username='other', telegram_username='@other', telegram_user_id=101)
+        ReminderOutbox.objects.create(habit=self.habits[0], fire_slot=self.fire_slot + timedelta(hours=1),
+                                      chat_id=100, text='текст', next_attempt_at=timezone.now() + timedelta(hours=1))
+        self.sender.send_batch.side_effect = lambda messages, on_result=None: [
+            on_result(i, DeliveryResult(message, False, 403, 'Forbidden: bot was blocked by the user')
+                      if message.chat_id == 100
+                      else DeliveryResult(message, False, 400, 'Bad Request: chat not found') if message.chat_id == 101
+                      else DeliveryResult(message, False, 400, 'Bad Request: message is too long'))
+            for i, message in enumerate(messages)
+        ]
+
+        services.deliver_reminders()
+
+        self.user.refresh_from_db()
+        other_user.refresh_from_db()
+        self.assertTrue(self.user.telegram_blocked)
+        self.assertTrue(other_user.telegram_blocked)
+        self.assertEqual(ReminderOutbox.objects.filter(status=ReminderOutbox.STATUS_FAILED).count(), 3)
+        self.assertEqual(ReminderOutbox.objects.get(chat_id=102).status, ReminderOutbox.STATUS_PENDING)
+
+    def test_deliver_reminders_interrupted(self):
+        def interrupted_send_batch(messages, on_result=None):
+            on_result(0, DeliveryResult(messages[0], True, 200))
+            raise RuntimeError('worker stopped')
+
+        self.sender.send_batch.side_effect = interrupted_send_batch
+
+        with self.assertRaises(RuntimeError):
+            services.deliver_reminders()
+
+        self.assertEqual(ReminderOutbox.objects.filter(status=ReminderOutbox.STATUS_SENT).count(), 1)
+        pending = ReminderOutbox.objects.filter(status=ReminderOutbox.STATUS_PENDING)
+        self.assertEqual(pending.count(), 2)
+        self.assertFalse(pending.filter(next_attempt_at__lte=timezone.now()).exists())
+
+    def test_deliver_reminders_text(self):
+        services.deliver_reminders()
+
+        texts = sorted(message.text for call in self.sender.send_batch.call_args_list for message in call.args[0])
+        self.assertEqual(texts[0], 'Напоминание! Формируем привычку, следуй указанию\n\nтекст 0Успехов!')
+
+    @override_settings(REMINDER_DIGEST_ENABLED=True)
+    def test_deliver_reminders_digest(self):
+        ReminderOutbox.objects.update(chat_id=100, text='Что сделать: привычка\n')
+        other_habit = Habit.objects.create(user=self.user, operation='другое')
+        ReminderOutbox.objects.create(habit=other_habit, fire_slot=self.fire_slot, chat_id=200, text='другое\n')
+
+        self.assertEqual(services.deliver_reminders(), 4)
+
+        messages = sorted(self.sender.send_batch.call_args.args[0])
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[0].text, 'Напоминание! Формируем привычку, следуй указанию\n\n'
+                                           'Что сделать: привычка\n\n'
+                                           'Что сделать: привычка\n\n'
+                                           'Что сделать: привычка\n'
+                                           'Успехов!')
+        self.assertEqual(ReminderOutbox.objects.filter(status=ReminderOutbox.STATUS_SENT).count(), 4)
+
+    @override_settings(REMINDER_DIGEST_ENABLED=True, TELEGRAM_MESSAGE_MAX_LENGTH=100)
+    def test_deliver_reminders_digest_split(self):
+        ReminderOutbox.objects.update(chat_id=100, text='x' * 39 + '\n')
+
+        services.deliver_reminders()
+
+        messages = self.sender.send_batch.call_args.args[0]
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(all(len(message.text) <= 100 for message in messages))
+        self.assertEqual(ReminderOutbox.objects.filter(status=ReminderOutbox.STATUS_SENT).count(), 3)
+
+        ReminderOutbox.objects.update(status=ReminderOutbox.STATUS_PENDING, next_attempt_at=timezone.now(),
+                                      text='x' * 18 + '\n')
+        services.deliver_reminders()
+
+        messages = self.sender.send_batch.call_args.args[0]
+        self.assertEqual(len(messages), 2)
+
+    def test_cleanup_reminder_outbox(self):
+        ReminderOutbox.objects.filter(pk=self.reminders[0].pk).update(
+            status=ReminderOutbox.STATUS_SENT, created_at=timezone.now() - timedelta(days=30)
+        )
+        ReminderOutbox.objects.filter(pk=self.reminders[1].pk).update(created_at=timezone.now() - timedelta(days=30))
+
+        self.assertEqual(services.cleanup_reminder_outbox(), 1)
+        self.assertEqual(ReminderOutbox.objects.count(), 2)
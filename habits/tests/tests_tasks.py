@@ -0,0 +1,155 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from operator import add
+from unittest import mock
+
+import fakeredis
+import redis
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from config.celery import app
+from habits import services, tasks
+from habits.locks import LeaderLock, run_exclusive
+from habits.metrics import metrics
+from habits.models import Habit, Schedule, Interval, ReminderOutbox
+from habits.tests.utils import send_batch
+from users.models import User
+
+
+@override_settings(REMINDER_DISPATCH_SHARDS=3)
+class DispatchTasksTestCase(TestCase):
+
+    def setUp(self) -> None:
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+        client = fakeredis.FakeRedis()
+        for target in ('habits.locks.get_redis_client', 'habits.metrics.get_redis_client'):
+            redis_patcher = mock.patch(target, return_value=client)
+            redis_patcher.start()
+            self.addCleanup(redis_patcher.stop)
+
+        for i in range(1, 8):
+            user = User.objects.create(username=f'user{i}', telegram_username=f'@user_{i}', telegram_user_id=i)
+            Habit.objects.create(user=user, operation='решать ката',
+                                 schedule=Schedule.objects.create(monday='14:00:00'))
+            Habit.objects.create(user=user, operation='помедитировать',
+                                 interval=Interval.objects.create(interval='03:00:00'))
+
+        self.monday = datetime(2023, 10, 23, 14, 0, tzinfo=dt_timezone.utc)
+        patcher = mock.patch('habits.services.get_telegram_sender')
+        self.sender = patcher.start().return_value
+        self.sender.send_batch.side_effect = send_batch
+        self.sender.breaker.is_open.return_value = False
+        self.addCleanup(patcher.stop)
+
+    def sent_chat_ids(self):
+        return sorted(message.chat_id for call in self.sender.send_batch.call_args_list for message in call.args[0])
+
+    def test_shards_partition_users(self):
+        with mock.patch('habits.services.timezone.now', return_value=self.monday):
+            counts = [services.send_interval_reminder(shard, 3) for shard in range(3)]
+
+        self.assertEqual(sum(counts), 7)
+        self.assertEqual(sorted(ReminderOutbox.objects.values_list('chat_id', flat=True)), list(range(1, 8)))
+
+    def test_task_send_scheduled_reminder(self):
+        with mock.patch('habits.services.timezone.now', return_value=self.monday), \
+                mock.patch('habits.tasks.task_aggregate_dispatch.run', wraps=tasks.task_aggregate_dispatch.run) as run:
+            tasks.task_send_scheduled_reminder()
+
+        results, name = run.call_args.args
+        self.assertEqual(name, 'scheduled')
+        self.assertEqual(sorted(result['shard'] for result in results), [0, 1, 2])
+        self.assertEqual(sum(result['count'] for result in results), 7)
+        self.assertEqual(self.sent_chat_ids(), list(range(1, 8)))
+
+    def test_task_send_interval_reminder(self):
+        with mock.patch('habits.services.timezone.now', return_value=self.monday):
+            tasks.task_send_interval_reminder()
+
+        self.assertEqual(self.sent_chat_ids(), list(range(1, 8)))
+
+    def test_task_deliver_reminders(self):
+        with mock.patch('habits.services.timezone.now', return_value=self.monday):
+            services.send_interval_reminder()
+        tasks.task_deliver_reminders()
+
+        self.assertEqual(self.sent_chat_ids(), list(range(1, 8)))
+        self.assertFalse(ReminderOutbox.objects.exclude(status=ReminderOutbox.STATUS_SENT).exists())
+
+    def test_aggregate_dispatch(self):
+        summary = tasks.task_aggregate_dispatch([
+            {'shard': 0, 'count': 3, 'duration': 0.5},
+            {'shard': 1, 'count': 4, 'duration': 1.5},
+        ], 'interval')
+        self.assertEqual(summary, {'name': 'interval', 'shards': 2, 'count': 7, 'duration': 1.5})
+
+    def test_task_send_interval_reminder_shard_skipped(self):
+        lock = LeaderLock(fakeredis.FakeRedis(), 'interval:0:3', 60)
+        with mock.patch('habits.locks.get_redis_client', return_value=lock.client):
+            lock.acquire()
+            result = tasks.task_send_interval_reminder_shard(0, 3)
+
+        self.assertTrue(result['skipped'])
+        self.assertEqual(result['count'], 0)
+        self.assertTrue(lock.pop_rerun())
+
+
+class LeaderLockTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.client = fakeredis.FakeRedis()
+        patcher = mock.patch('habits.locks.get_redis_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.values.clear()
+        self.addCleanup(metrics.values.clear)
+
+    def test_lock(self):
+        lock = LeaderLock(self.client, 'tick', 60)
+        other = LeaderLock(self.client, 'tick', 60)
+
+        self.assertTrue(lock.acquire())
+        self.assertFalse(other.acquire())
+        self.assertFalse(other.renew())
+        other.release()
+        self.assertTrue(lock.renew())
+
+        lock.release()
+        self.assertTrue(other.acquire())
+
+    def test_lease_expires(self):
+        lock = LeaderLock(self.client, 'tick', 0.05)
+        self.assertTrue(lock.acquire())
+        time.sleep(0.1)
+        self.assertTrue(LeaderLock(self.client, 'tick', 60).acquire())
+        self.assertFalse(lock.renew())
+
+    def test_lease_renewal(self):
+        def work():
+            time.sleep(0.2)
+            return LeaderLock(self.client, 'tick', 60).acquire()
+
+        with override_settings(DISPATCH_LOCK_LEASE=timedelta(seconds=0.09)):
+            self.assertFalse(run_exclusive('tick', work, add))
+        self.assertFalse(self.client.exists('habits:dispatch_lock:tick'))
+
+    def test_run_exclusive_coalesces(self):
+        calls = []
+
+        def work():
+            calls.append(1)
+            if len(calls) == 1:
+                self.assertIsNone(run_exclusive('tick', work, add))
+                self.assertIsNone(run_exclusive('tick', work, add))
+            return 1
+
+        self.assertEqual(run_exclusive('tick', work, add), 2)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(metrics.values['habits_dispatch_skipped_ticks_total{task="tick"}'], 2)
+
+    def test_run_exclusive_without_redis(self):
+        client = mock.Mock()
+        client.set.side_effect = redis.ConnectionError()
+        with mock.patch('habits.locks.get_redis_client', return_value=client):
+            self.assertEqual(run_exclusive('tick', lambda: 5, add), 5)
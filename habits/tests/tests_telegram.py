@@ -0,0 +1,251 @@
+import time
+from unittest import mock
+
+import fakeredis
+import redis
+from django.test import SimpleTestCase, override_settings
+
+from habits.circuit_breaker import CircuitBreaker
+from habits.ratelimit import TelegramRateLimiter, RedisTelegramRateLimiter
+from habits.telegram import TelegramSender, TelegramMessage
+from habits.testing.fake_telegram import FakeTelegramServer
+
+
+def unlimited():
+    return TelegramRateLimiter(global_rate=10000, chat_rate=10000, group_rate=10000)
+
+
+class TelegramSenderTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.server = FakeTelegramServer(latency=0.02).start()
+        self.settings_override = override_settings(TELEGRAM_MAIN_URL=self.server.url, TELEGRAM_TOKEN='token')
+        self.settings_override.enable()
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        self.server.stop()
+
+    def test_send_batch(self):
+        messages = [TelegramMessage(chat_id, f'Напоминание {chat_id}') for chat_id in range(1, 41)]
+
+        with TelegramSender(concurrency=4, limiter=unlimited()) as sender:
+            results = sender.send_batch(messages)
+
+        self.assertEqual([result.message for result in results], messages)
+        self.assertTrue(all(result.is_sent for result in results))
+        self.assertEqual(sorted(self.server.messages), sorted(messages))
+        self.assertLessEqual(self.server.max_in_flight, 4)
+        self.assertLessEqual(len(self.server.connections), 4)
+
+    def test_send_errors(self):
+        self.server.add_response(2, 400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'})
+
+        with TelegramSender(concurrency=2, limiter=unlimited()) as sender:
+            results = sender.send_batch([TelegramMessage(1, 'первое'), TelegramMessage(2, 'второе')])
+
+        self.assertTrue(results[0].is_sent)
+        self.assertFalse(results[1].is_sent)
+        self.assertEqual(results[1].status_code, 400)
+        self.assertEqual(results[1].description, 'Bad Request: chat not found')
+        self.assertTrue(results[1].is_chat_unavailable)
+        self.assertEqual(self.server.messages, [(1, 'первое')])
+
+    @override_settings(TELEGRAM_MAIN_URL='http://127.0.0.1:1/bot')
+    def test_connection_error(self):
+        with TelegramSender(concurrency=1, limiter=unlimited()) as sender:
+            result = sender.send(TelegramMessage(1, 'текст'))
+
+        self.assertFalse(result.is_sent)
+        self.assertIsNone(result.status_code)
+
+    def test_retry_after(self):
+        flood = {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                 'parameters': {'retry_after': 1}}
+        self.server.add_response(1, 429, flood)
+
+        start = time.monotonic()
+        with TelegramSender(concurrency=2, limiter=unlimited()) as sender:
+            results = sender.send_batch([TelegramMessage(1, 'первое'), TelegramMessage(2, 'второе')])
+
+        self.assertTrue(all(result.is_sent for result in results))
+        self.assertGreaterEqual(time.monotonic() - start, 1)
+        self.assertIn((1, 'первое'), self.server.messages)
+
+        self.server.add_response(1, 429, flood)
+        with TelegramSender(concurrency=1, limiter=unlimited(), max_retries=0) as sender:
+            result = sender.send_batch([TelegramMessage(1, 'третье')])[0]
+
+        self.assertFalse(result.is_sent)
+        self.assertEqual(result.retry_after, 1)
+
+    def test_circuit_breaker(self):
+        error = {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}
+        for chat_id in range(1, 5):
+            self.server.add_response(chat_id, 502, error)
+        breaker = CircuitBreaker(failure_rate=0.5, min_requests=4, window=60, open_timeout=30)
+
+        with TelegramSender(concurrency=1, limiter=unlimited(), breaker=breaker) as sender:
+            results = sender.send_batch([TelegramMessage(chat_id, 'текст') for chat_id in range(1, 7)])
+
+        self.assertEqual([result.status_code for result in results[:4]], [502] * 4)
+        self.assertTrue(all(result.is_deferred and result.retry_after == 30 for result in results[4:]))
+        self.assertEqual(len(self.server.messages), 0)
+        self.assertTrue(breaker.is_open())
+
+    def test_circuit_breaker_probe_exception(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_rate=0.5, min_requests=1, window=60, open_timeout=30, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 30
+
+        with TelegramSender(concurrency=1, limiter=unlimited(), breaker=breaker) as sender, \
+                mock.patch.object(sender.session, 'post', side_effect=RuntimeError('мягкий лимит времени задачи')):
+            with self.assertRaises(RuntimeError):
+                sender.send(TelegramMessage(1, 'текст'))
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.retry_after(), 30)
+
+        now[0] = 60
+        self.server.add_response(1, 200, ['не словарь'])
+        with TelegramSender(concurrency=1, limiter=unlimited(), breaker=breaker) as sender:
+            self.assertTrue(sender.send(TelegramMessage(1, 'текст')).is_sent)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+class TelegramRateLimiterTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.limiter = TelegramRateLimiter(global_rate=30, chat_rate=1, group_rate=20 / 60,
+                                           clock=lambda: self.now, sleep=self.sleep)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def test_chat_limit(self):
+        self.assertEqual([self.limiter.acquire(1) for _ in range(3)], [0, 1, 2])
+
+        first, second = self.limiter.acquire(-100), self.limiter.acquire(-100)
+        self.assertAlmostEqual(second - first, 3)
+
+    def test_global_limit(self):
+        send_times = [self.limiter.acquire(chat_id) for chat_id in range(1, 91)]
+
+        self.assertEqual(send_times[0], 0)
+        self.assertAlmostEqual(send_times[-1], 89 / 30)
+        for previous, current in zip(send_times, send_times[1:]):
+            self.assertAlmostEqual(current - previous, 1 / 30)
+
+    def test_chat_wait_does_not_block_other_chats(self):
+        self.limiter.acquire(1)
+        self.limiter.acquire(2)
+        self.now = 0.5
+        self.assertEqual(self.limiter.acquire(3), 0.5)
+
+    def test_pause(self):
+        self.limiter.pause(5)
+        self.assertEqual(self.limiter.acquire(1), 5)
+        self.assertAlmostEqual(self.limiter.acquire(2), 5 + 1 / 30)
+
+
+class RedisTelegramRateLimiterTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.now = 1000.0
+        self.redis = fakeredis.FakeRedis()
+        self.limiters = [self.create_limiter() for _ in range(2)]
+
+    def create_limiter(self) -> RedisTelegramRateLimiter:
+        return RedisTelegramRateLimiter(self.redis, global_rate=30, chat_rate=1, group_rate=20 / 60,
+                                        clock=lambda: self.now, sleep=self.sleep)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def test_global_limit_shared(self):
+        send_times = [self.limiters[chat_id % 2].acquire(chat_id) for chat_id in range(1, 61)]
+
+        self.assertAlmostEqual(send_times[-1] - send_times[0], 59 / 30, places=3)
+        for previous, current in zip(send_times, send_times[1:]):
+            self.assertAlmostEqual(current - previous, 1 / 30, places=3)
+
+    def test_chat_limit_shared(self):
+        first, second = self.limiters[0].acquire(1), self.limiters[1].acquire(1)
+        self.assertAlmostEqual(second - first, 1, places=3)
+
+        first, second = self.limiters[0].acquire(-100), self.limiters[1].acquire(-100)
+        self.assertAlmostEqual(second - first, 3, places=3)
+
+    def test_pause_shared(self):
+        self.limiters[0].pause(5)
+        self.assertAlmostEqual(self.limiters[1].acquire(1), 1005, places=3)
+
+    def test_redis_unavailable(self):
+        limiter = self.limiters[0]
+        with mock.patch.object(self.redis, 'eval', side_effect=redis.ConnectionError), \
+                self.assertLogs('habits.ratelimit', 'WARNING'):
+            limiter.pause(5)
+            self.assertEqual([limiter.acquire(1), limiter.acquire(1)], [1005, 1006])
+
+
+class CircuitBreakerTestCase(SimpleTestCase):
+
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failure_rate=0.5, min_requests=4, window=10, open_timeout=30,
+                                      clock=lambda: self.now)
+
+    def test_failure_rate(self):
+        for is_failure in (True, False, True):
+            self.assertFalse(self.breaker.record_failure() if is_failure else self.breaker.record_success())
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.record_failure())
+
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+    def test_window(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now = 10
+        self.assertFalse(self.breaker.record_failure())
+        self.assertTrue(self.breaker.allow_request())
+
+    def test_half_open(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+
+        self.now = 30
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.assertTrue(self.breaker.is_open())
+        self.assertTrue(self.breaker.record_failure())
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+        self.now = 60
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.is_open())
+
+    def test_half_open_probe_timeout(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+
+        self.now = 30
+        self.assertTrue(self.breaker.allow_request())
+        self.now = 45
+        self.assertTrue(self.breaker.is_open())
+        self.assertEqual(self.breaker.retry_after(), 15)
+
+        self.now = 60
+        self.assertFalse(self.breaker.allow_request())
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+        self.now = 90
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open())
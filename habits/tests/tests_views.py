@@ -1,7 +1,16 @@
+from datetime import datetime, timezone as dt_timezone
+from unittest import mock
+
+import fakeredis
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from habits.metrics import metrics
 from habits.models import Habit, Schedule, Interval
 from users.models import User
 
@@ -204,6 +213,7 @@ class HabitTestCase(APITestCase):
         response = self.client.post(url, data=good_data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertIsNotNone(response.json()['interval'])
+        self.assertIsNotNone(Interval.objects.get(pk=response.json()['interval']['id']).next_fire_at)
 
     def test_public_list_habits(self):
         self.client.force_authenticate(user=self.regular_user)
@@ -215,6 +225,33 @@ class HabitTestCase(APITestCase):
         self.assertTrue(response.json()['results'][0]['is_public'])
         self.assertEqual(response.json()['results'][0]['user'], self.other_user.pk)
 
+    def test_cursor_pagination(self):
+        self.client.force_authenticate(user=self.other_user)
+        habits = [
+            Habit.objects.create(user=self.other_user, operation=f'привычка {i}', is_public=True, is_enjoyable=True)
+            for i in range(6)
+        ]
+
+        url = reverse('habits:public_habits') + '?pagination=cursor&page_size=3'
+        operations = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.json())
+            self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+            operations.extend(habit['operation'] for habit in response.json()['results'])
+            url = response.json()['next']
+
+        self.assertEqual(operations, ['поработать'] + [habit.operation for habit in habits])
+
+        response = self.client.get(reverse('habits:habits'), {'pagination': 'cursor', 'page_size': 1000})
+        self.assertEqual(len(response.json()['results']), 8)
+
+        response = self.client.get(reverse('habits:habits'), {'page_size': 1000})
+        self.assertEqual(response.json()['count'], 8)
+        self.assertEqual(len(response.json()['results']), 5)
+
     def test_retrieve_habit(self):
         self.client.force_authenticate(user=self.regular_user)
 
@@ -401,4 +438,352 @@ class HabitTestCase(APITestCase):
         response = self.client.patch(url, data={'schedule': {'monday': '16:00:00'}}, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIsNone(response.json()['interval'])
-        self.assertEqual(response.json()['schedule']['monday'], '16:00:00')
\ No newline at end of file
+        self.assertEqual(response.json()['schedule']['monday'], '16:00:00')
+
+
+@override_settings(SCHEDULE_INTERNING_ENABLED=True)
+class ScheduleInterningTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu')
+        self.client.force_authenticate(user=self.user)
+
+    def create_habit(self, operation, schedule):
+        response = self.client.post(reverse('habits:habits'), data={
+            'operation': operation,
+            'reward': 'похлопать себе',
+            'schedule': schedule
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Habit.objects.get(operation=operation)
+
+    def test_shared_schedule(self):
+        first = self.create_habit('решать ката', {'monday': '09:00:00', 'friday': '18:00:00'})
+        second = self.create_habit('читать', {'friday': '18:00', 'monday': '09:00'})
+        third = self.create_habit('бегать', {'monday': '09:00:00'})
+
+        self.assertEqual(first.schedule_id, second.schedule_id)
+        self.assertNotEqual(first.schedule_id, third.schedule_id)
+        self.assertEqual(Schedule.objects.count(), 2)
+
+    def test_update_shared_schedule(self):
+        first = self.create_habit('решать ката', {'monday': '09:00:00'})
+        second = self.create_habit('читать', {'monday': '09:00:00'})
+        shared_schedule = first.schedule
+
+        url = reverse('habits:user_habits', kwargs={'pk': first.pk})
+        response = self.client.patch(url, data={'schedule': {'tuesday': '10:00:00'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['schedule']['monday'], '09:00:00')
+        self.assertEqual(response.json()['schedule']['tuesday'], '10:00:00')
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        shared_schedule.refresh_from_db()
+        self.assertNotEqual(first.schedule_id, shared_schedule.pk)
+        self.assertEqual(second.schedule_id, shared_schedule.pk)
+        self.assertIsNone(shared_schedule.tuesday)
+
+        response = self.client.patch(reverse('habits:user_habits', kwargs={'pk': second.pk}),
+                                     data={'interval': {'interval': '03:00:00'}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(Schedule.objects.filter(pk=shared_schedule.pk).exists())
+
+
+@override_settings(CACHE_ENABLED=True)
+class PublicFeedCacheTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch('habits.metrics.get_redis_client', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.values.clear()
+        self.addCleanup(metrics.values.clear)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu')
+        self.client.force_authenticate(user=self.user)
+        self.habit = Habit.objects.create(user=self.user, operation='решать ката', is_public=True,
+                                          interval=Interval.objects.create(interval='02:00:00'))
+        self.private_habit = Habit.objects.create(user=self.user, operation='читать',
+                                                  schedule=Schedule.objects.create(monday='09:00:00'))
+        self.url = reverse('habits:public_habits')
+
+    def get_operations(self, max_queries=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        if max_queries is not None:
+            self.assertLessEqual(len(queries), max_queries)
+        return [habit['operation'] for habit in response.json()['results']]
+
+    def test_cache_hit(self):
+        self.assertEqual(self.get_operations(), ['решать ката'])
+        self.assertEqual(self.get_operations(max_queries=0), ['решать ката'])
+        self.assertEqual(self.client.get(self.url, {'page': 2}).status_code, status.HTTP_404_NOT_FOUND)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.client.get(self.url)['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(queries), 0)
+
+        metrics.flush()
+        self.assertEqual(metrics.values, {})
+        with mock.patch('habits.metrics.get_redis_client') as get_redis_client:
+            self.get_operations()
+        self.assertEqual(metrics.values['habits_public_feed_cache_total{result="hit"}'], 1)
+        get_redis_client.assert_not_called()
+
+    def test_invalidation(self):
+        self.get_operations()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Habit.objects.get(pk=self.habit.pk).save()
+        self.assertEqual(self.get_operations(), ['решать ката'])
+        self.assertEqual(self.get_operations(max_queries=0), ['решать ката'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private_habit.operation = 'читать книгу'
+            self.private_habit.save()
+            self.private_habit.schedule.save()
+        self.assertEqual(self.get_operations(max_queries=0), ['решать ката'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.habit.interval.start_time = '10:00:00'
+            self.habit.interval.end_time = '18:00:00'
+            self.habit.interval.save()
+        self.get_operations()
+        self.assertEqual(self.client.get(self.url).json()['results'][0]['interval']['start_time'], '10:00:00')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            habit = Habit.objects.get(pk=self.habit.pk)
+            habit.is_public = False
+            habit.save()
+        self.assertEqual(self.get_operations(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private_habit.is_public = True
+            self.private_habit.save()
+        self.assertEqual(self.get_operations(), ['читать книгу'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private_habit.delete()
+        self.assertEqual(self.get_operations(), [])
+        self.assertEqual(metrics.values['habits_public_feed_cache_total{result="miss"}'], 6)
+
+
+class HabitETagTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu')
+        self.client.force_authenticate(user=self.user)
+        self.habit = Habit.objects.create(user=self.user, operation='решать ката', is_public=True,
+                                          interval=Interval.objects.create(interval='02:00:00'))
+        self.url = reverse('habits:user_habits', kwargs={'pk': self.habit.pk})
+
+    def test_retrieve_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+
+        with mock.patch('habits.views.HabitSerializer.to_representation') as to_representation:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        to_representation.assert_not_called()
+
+        self.habit.interval.start_time = '10:00:00'
+        self.habit.interval.end_time = '18:00:00'
+        self.habit.interval.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_update_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.patch(self.url, data={'place': 'дома'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        new_etag = response['ETag']
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(self.client.get(self.url)['ETag'], new_etag)
+
+        response = self.client.patch(self.url, data={'place': 'в парке'}, format='json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(response['ETag'], new_etag)
+        self.habit.refresh_from_db()
+        self.assertEqual(self.habit.place, 'дома')
+
+        response = self.client.delete(self.url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(self.url, HTTP_IF_MATCH=new_etag)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Habit.objects.filter(pk=self.habit.pk).exists())
+
+    def test_list_not_modified(self):
+        url = reverse('habits:habits')
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        related_habit = Habit.objects.create(user=self.user, operation='выпить кофе', is_enjoyable=True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        Habit.objects.filter(pk=self.habit.pk).update(related_habit=related_habit)
+        related_habit.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class HabitBatchTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu', telegram_user_id=100)
+        self.other_user = User.objects.create(username='other_user', telegram_username='@other_user')
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse('habits:batch')
+
+    def create_habits(self, count):
+        return self.client.post(self.url, data=[
+            {'operation': f'привычка {i}', 'reward': 'похлопать себе', 'schedule': {'monday': '09:00:00'}}
+            if i % 2 else
+            {'operation': f'привычка {i}', 'reward': 'похлопать себе', 'interval': {'interval': '02:00:00'}}
+            for i in range(count)
+        ], format='json')
+
+    def test_create(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.create_habits(20)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({result['status'] for result in response.json()}, {status.HTTP_201_CREATED})
+        self.assertLessEqual(len(queries), 10)
+
+        habits = Habit.objects.filter(user=self.user)
+        self.assertEqual(habits.count(), 20)
+        self.assertEqual(habits.filter(is_deliverable=True).count(), 20)
+        self.assertEqual(Schedule.objects.filter(fire_times__minute_of_week=9 * 60).count(), 10)
+        self.assertFalse(Interval.objects.filter(next_fire_at__isnull=True).exists())
+
+        result = response.json()[1]
+        self.assertEqual(Habit.objects.get(pk=result['id']).operation, 'привычка 1')
+        self.assertEqual(result['habit']['schedule']['monday'], '09:00:00')
+
+    def test_create_errors(self):
+        response = self.client.post(self.url, data=[
+            {'operation': 'решать ката', 'reward': 'похлопать себе', 'schedule': {'monday': '09:00:00'}},
+            {'operation': 'читать', 'reward': 'похлопать себе'},
+            'привычка',
+        ], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.json()], [201, 400, 400])
+        self.assertEqual(response.json()[1]['errors'],
+                         {'non_field_errors': ['Нужно выбрать что-то одно: расписание или интервал.']})
+        self.assertEqual(Habit.objects.count(), 1)
+
+        response = self.client.post(self.url, data={'operation': 'решать ката'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(HABITS_BATCH_MAX_SIZE=3):
+            self.assertEqual(self.create_habits(4).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(SCHEDULE_INTERNING_ENABLED=True)
+    def test_create_shared_schedules(self):
+        Habit.objects.create(user=self.other_user, operation='бегать',
+                             schedule=Schedule.objects.create(monday='09:00:00',
+                                                              digest=Schedule.get_digest({'monday': '09:00:00'})))
+        self.create_habits(6)
+        self.client.post(self.url, data=[
+            {'operation': 'читать', 'reward': 'похлопать себе', 'schedule': {'friday': '18:00:00'}},
+        ], format='json')
+
+        self.assertEqual(Schedule.objects.count(), 2)
+        self.assertEqual(Habit.objects.filter(schedule__monday='09:00:00').count(), 4)
+        self.assertEqual(Schedule.objects.get(friday='18:00:00').fire_times.count(), 1)
+
+    def test_update(self):
+        ids = [result['id'] for result in self.create_habits(4).json()]
+        other_habit = Habit.objects.create(user=self.other_user, operation='бегать')
+        old_interval_id = Habit.objects.get(pk=ids[0]).interval_id
+
+        response = self.client.patch(self.url, data=[
+            {'id': ids[0], 'schedule': {'tuesday': '10:00:00'}},
+            {'id': ids[1], 'schedule': {'monday': '08:00:00'}, 'is_public': True},
+            {'id': ids[2], 'interval': {'interval': '03:00:00'}},
+            {'id': ids[3], 'interval': {'interval': '03:00:00'}},
+            {'id': ids[3], 'place': 'дома'},
+            {'id': other_habit.pk, 'place': 'дома'},
+            {'id': ids[2], 'interval': {'interval': '200:00:00'}},
+        ], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.json()], [200, 200, 200, 200, 400, 404, 400])
+        self.assertEqual(response.json()[4]['errors'], {'id': ['Повторяющийся идентификатор.']})
+        self.assertEqual(response.json()[5]['errors'], {'id': ['Привычка не найдена.']})
+
+        habits = Habit.objects.in_bulk(ids)
+        self.assertIsNone(habits[ids[0]].interval)
+        self.assertFalse(Interval.objects.filter(pk=old_interval_id).exists())
+        self.assertEqual(list(habits[ids[0]].schedule.fire_times.values_list('minute_of_week', flat=True)),
+                         [24 * 60 + 10 * 60])
+        self.assertTrue(habits[ids[1]].is_public)
+        self.assertEqual(habits[ids[1]].schedule.fire_times.get().minute_of_week, 8 * 60)
+        self.assertEqual(habits[ids[2]].interval.interval.total_seconds(), 3 * 3600)
+        self.assertIsNone(habits[ids[3]].schedule)
+        self.assertIsNotNone(habits[ids[3]].interval.next_fire_at)
+        self.assertEqual(Schedule.objects.count(), 2)
+        self.assertEqual(response.json()[1]['habit']['schedule']['monday'], '08:00:00')
+
+    def test_delete(self):
+        ids = [result['id'] for result in self.create_habits(3).json()]
+        other_habit = Habit.objects.create(user=self.other_user, operation='бегать')
+
+        response = self.client.delete(self.url, data=[ids[0], ids[2], other_habit.pk, 'id', ids[0]], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.json()], [204, 204, 404, 404, 400])
+        self.assertEqual(list(Habit.objects.filter(user=self.user).values_list('pk', flat=True)), [ids[1]])
+        self.assertTrue(Habit.objects.filter(pk=other_habit.pk).exists())
+
+
+class HabitListProjectionTestCase(APITestCase):
+
+    def setUp(self) -> None:
+        self.user = User.objects.create(username='ksu', telegram_username='@ksu')
+        self.client.force_authenticate(user=self.user)
+        related_habit = Habit.objects.create(user=self.user, operation='выпить кофе', is_enjoyable=True,
+                                             is_public=True)
+        Habit.objects.create(user=self.user, operation='решать ката', place='дома', lead_time='90', is_public=True,
+                             related_habit=related_habit,
+                             schedule=Schedule.objects.create(monday='09:00:00', sunday='18:30:15.250000'))
+        Habit.objects.create(user=self.user, operation='читать', reward='похлопать себе', is_public=True,
+                             interval=Interval.objects.create(
+                                 interval='05:30:00', start_time='10:00:00', end_time='20:00:00',
+                                 last_event=datetime(2023, 10, 23, 13, 59, 30, 123456, tzinfo=dt_timezone.utc)
+                             ))
+        for i in range(3):
+            Habit.objects.create(user=self.user, operation=f'бегать {i}', reward='отдохнуть', is_public=True,
+                                 interval=Interval.objects.create(interval='01:00:00'))
+
+    def test_same_response(self):
+        urls = [
+            reverse('habits:habits'),
+            reverse('habits:habits') + '?page=2',
+            reverse('habits:public_habits') + '?pagination=cursor&page_size=2',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                expected = self.client.get(url)
+                with override_settings(HABIT_LIST_PROJECTION_ENABLED=True):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(response['ETag'], expected['ETag'])
+
+        with override_settings(HABIT_LIST_PROJECTION_ENABLED=True), \
+                mock.patch('habits.views.HabitSerializer.to_representation') as to_representation:
+            response = self.client.get(reverse('habits:habits'))
+        to_representation.assert_not_called()
+        self.assertEqual(len(response.json()['results']), 5)
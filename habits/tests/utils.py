@@ -0,0 +1,9 @@
+from habits.telegram import DeliveryResult
+
+
+def send_batch(messages, on_result=None):
+    results = [DeliveryResult(message, True, 200) for message in messages]
+    for i, result in enumerate(results):
+        if on_result:
+            on_result(i, result)
+    return results
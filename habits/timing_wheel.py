@@ -0,0 +1,81 @@
+import math
+from typing import Hashable
+
+
+class HierarchicalTimingWheel:
+    """
+    Иерархическое колесо таймеров.
+
+    Колесо уровня `level` состоит из `slots` ячеек по slots ** level тиков. Таймер кладется на самый нижний
+    уровень, в пределы которого попадает его срок, и по мере движения времени опускается на уровни ниже
+    (каскад), пока не окажется в ячейке текущего тика нижнего уровня. Добавление, перенос и удаление таймера
+    выполняются за O(1), за тик просматриваются только ячейки, срок которых наступил.
+    Таймеры за пределами всех уровней хранятся отдельно и переносятся в колесо при каскаде верхнего уровня
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64, levels: int = 4, start: float = 0.0):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current_tick = int(start // tick)
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.overflow = set()
+        self.deadlines = {}
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.deadlines
+
+    def add(self, key: Hashable, deadline: float) -> None:
+        """
+        Ставит таймер `key` на момент `deadline` (в тех же единицах, что и start), прежний срок таймера отменяется.
+        Таймер с наступившим сроком сработает на следующем тике
+        """
+
+        fire_tick = max(math.ceil(deadline / self.tick), self.current_tick + 1)
+        self.deadlines[key] = fire_tick
+        self._place(key, fire_tick)
+
+    def remove(self, key: Hashable) -> None:
+        """Отменяет таймер (запись в ячейке удаляется лениво, при ее обработке)"""
+
+        self.deadlines.pop(key, None)
+
+    def advance(self, now: float) -> list[Hashable]:
+        """Продвигает колесо до момента `now` и возвращает таймеры, срок которых наступил, в порядке срабатывания"""
+
+        expired = []
+        target_tick = int(now // self.tick)
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if self.current_tick % span == 0:
+                    if level == self.levels - 1:
+                        self._cascade(self.overflow)
+                    self._cascade(self.wheels[level][(self.current_tick // span) % self.slots])
+
+            bucket = self.wheels[0][self.current_tick % self.slots]
+            for key, fire_tick in bucket:
+                if self.deadlines.get(key) == fire_tick:
+                    del self.deadlines[key]
+                    expired.append(key)
+            bucket.clear()
+        return expired
+
+    def _place(self, key: Hashable, fire_tick: int) -> None:
+        delta = fire_tick - self.current_tick
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1):
+                self.wheels[level][(fire_tick // self.slots ** level) % self.slots].add((key, fire_tick))
+                return
+        self.overflow.add((key, fire_tick))
+
+    def _cascade(self, bucket: set) -> None:
+        entries = list(bucket)
+        bucket.clear()
+        for key, fire_tick in entries:
+            if self.deadlines.get(key) == fire_tick:
+                self._place(key, fire_tick)
@@ -1,7 +1,8 @@
 from django.urls import path
 
 from habits.apps import HabitsConfig
-from habits.views import PublicHabitListAPIView, HabitRetrieveUpdateDestroyAPIView, HabitListCreateAPIView
+from habits.views import PublicHabitListAPIView, HabitRetrieveUpdateDestroyAPIView, HabitListCreateAPIView, \
+    HabitBatchAPIView
 
 app_name = HabitsConfig.name
 
@@ -9,4 +10,5 @@ urlpatterns = [
     path('<int:pk>/', HabitRetrieveUpdateDestroyAPIView.as_view(), name='user_habits'),
     path('', HabitListCreateAPIView.as_view(), name='habits'),
     path('public/', PublicHabitListAPIView.as_view(), name='public_habits'),
+    path('batch/', HabitBatchAPIView.as_view(), name='batch'),
 ]
\ No newline at end of file
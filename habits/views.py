@@ -1,14 +1,33 @@
+import hmac
+import logging
+
+import redis
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
+from rest_framework import status
 from rest_framework.generics import ListAPIView, CreateAPIView, UpdateAPIView, DestroyAPIView, RetrieveAPIView, \
-    RetrieveUpdateDestroyAPIView, ListCreateAPIView
+    RetrieveUpdateDestroyAPIView, ListCreateAPIView, GenericAPIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from habits.batch import bulk_create_habits, bulk_update_habits, bulk_delete_habits
+from habits.cache import get_cached_public_feed_page, set_cached_public_feed_page
+from habits.etags import HabitETagMixin, HabitListETagMixin, get_etag_response
+from habits.metrics import render_metrics, metrics
 from habits.models import Habit
-from habits.pagination import FiveObjectsPagination
+from habits.pagination import FiveObjectsPagination, CursorPaginationMixin
 from habits.permissions import OnlyOwnerOrSuperuser
 from habits.serializers import HabitSerializer
 
+logger = logging.getLogger(__name__)
+
+# Результаты пакетной обработки для элементов с недоступной или повторно указанной привычкой
+NOT_FOUND_RESULT = {'status': status.HTTP_404_NOT_FOUND, 'errors': {'id': ['Привычка не найдена.']}}
+DUPLICATE_ID_RESULT = {'status': status.HTTP_400_BAD_REQUEST, 'errors': {'id': ['Повторяющийся идентификатор.']}}
 
-class PublicHabitListAPIView(ListAPIView):
+
+class PublicHabitListAPIView(CursorPaginationMixin, HabitListETagMixin, ListAPIView):
     """Отображение списка публичных привычек"""
 
     serializer_class = HabitSerializer
@@ -18,6 +37,25 @@ class PublicHabitListAPIView(ListAPIView):
     def get_queryset(self):
         return Habit.objects.filter(is_public=True).select_related('schedule', 'interval', 'related_habit')
 
+    def list(self, request, *args, **kwargs):
+        """
+        Страница ленты и ее ETag берутся из кеша Redis, если он включен (CACHE_ENABLED) и страница уже строилась
+        """
+
+        if not settings.CACHE_ENABLED:
+            return super().list(request, *args, **kwargs)
+
+        key, page = get_cached_public_feed_page(request.build_absolute_uri())
+        metrics.inc('habits_public_feed_cache_total', result='miss' if page is None else 'hit')
+        metrics.flush(min_interval=settings.METRICS_FLUSH_INTERVAL)
+        if page is not None:
+            return get_etag_response(request, page['etag'], lambda: Response(page['data']))
+
+        response = super().list(request, *args, **kwargs)
+        if key is not None and response.status_code == 200:
+            set_cached_public_feed_page(key, {'etag': response['ETag'], 'data': response.data})
+        return response
+
 
 # class UserHabitListAPIView(ListAPIView):
 #     """Отображение списка привычек, принадлежащих текущему пользователю"""
@@ -66,12 +104,13 @@ class PublicHabitListAPIView(ListAPIView):
 # Мультидженерики
 # Преимущество в одном url на них, с разницей наличии/отсутствии id
 # Это более правильный способ работы с REST API
-class HabitRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
+class HabitRetrieveUpdateDestroyAPIView(HabitETagMixin, RetrieveUpdateDestroyAPIView):
     """
     Представление для отображения привычек,
     обрабатывает методы 'GET', 'DELETE', 'PUT', 'PATCH'
 
-    Доступ только для владельца или суперюзера
+    Доступ только для владельца или суперюзера.
+    Поддерживаются условные запросы: If-None-Match для 'GET' и If-Match для остальных методов
     """
 
     serializer_class = HabitSerializer
@@ -79,12 +118,13 @@ class HabitRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
 
     def get_queryset(self):
         if self.request.method == 'DELETE':
-            return Habit.objects.all()
+            # Расписание и интервал нужны для ETag
+            return Habit.objects.all().select_related('schedule', 'interval')
         elif self.request.method in ('GET', 'PUT', 'PATCH'):
             return Habit.objects.all().select_related('schedule', 'interval', 'related_habit')
 
 
-class HabitListCreateAPIView(ListCreateAPIView):
+class HabitListCreateAPIView(CursorPaginationMixin, HabitListETagMixin, ListCreateAPIView):
     """
     Представление для отображения привычек,
     обрабатывает методы 'GET', 'POST'
@@ -102,3 +142,128 @@ class HabitListCreateAPIView(ListCreateAPIView):
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+
+
+class HabitBatchAPIView(GenericAPIView):
+    """
+    Пакетная обработка привычек текущего пользователя (суперюзеру доступны все привычки):
+    'POST' - создание по списку данных привычек, 'PATCH' - изменение по списку данных с 'id',
+    'DELETE' - удаление по списку id.
+
+    Каждый элемент проверяется отдельно, корректные записываются пакетными запросами, а в ответе
+    для каждого элемента в порядке запроса указан результат: статус и привычка или ошибки.
+    Повторно указанная в запросе привычка не изменяется и не удаляется второй раз (ошибка 400)
+    """
+
+    serializer_class = HabitSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = Habit.objects.all().select_related('schedule', 'interval', 'related_habit', 'user')
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def post(self, request, *args, **kwargs):
+        items = self.get_items()
+        if isinstance(items, Response):
+            return items
+
+        results, valid = [], []
+        for item in items:
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                valid.append((len(results), serializer))
+                results.append(None)
+            else:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+
+        habits = bulk_create_habits(request.user, [serializer.validated_data for _, serializer in valid])
+        for (index, _), habit, data in zip(valid, habits, self.get_serializer(habits, many=True).data):
+            results[index] = {'status': status.HTTP_201_CREATED, 'id': habit.pk, 'habit': data}
+        return Response(results)
+
+    def patch(self, request, *args, **kwargs):
+        items = self.get_items()
+        if isinstance(items, Response):
+            return items
+
+        habits = self.get_habits(item.get('id') for item in items if isinstance(item, dict))
+        results, valid, seen_ids = [], [], set()
+        for item in items:
+            pk = item.get('id') if isinstance(item, dict) else None
+            habit = habits.get(pk) if is_id(pk) else None
+            if habit is None:
+                results.append(NOT_FOUND_RESULT)
+                continue
+            if pk in seen_ids:
+                results.append(DUPLICATE_ID_RESULT)
+                continue
+            seen_ids.add(pk)
+            serializer = self.get_serializer(habit, data=item, partial=True)
+            if serializer.is_valid():
+                valid.append((len(results), serializer))
+                results.append(None)
+            else:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors})
+
+        habits = bulk_update_habits([(serializer.instance, serializer.validated_data) for _, serializer in valid])
+        for (index, _), habit, data in zip(valid, habits, self.get_serializer(habits, many=True).data):
+            results[index] = {'status': status.HTTP_200_OK, 'id': habit.pk, 'habit': data}
+        return Response(results)
+
+    def delete(self, request, *args, **kwargs):
+        items = self.get_items()
+        if isinstance(items, Response):
+            return items
+
+        habits = self.get_habits(items)
+        bulk_delete_habits(list(habits.values()))
+        results, seen_ids = [], set()
+        for item in items:
+            if not is_id(item) or item not in habits:
+                results.append(NOT_FOUND_RESULT)
+            elif item in seen_ids:
+                results.append(DUPLICATE_ID_RESULT)
+            else:
+                seen_ids.add(item)
+                results.append({'status': status.HTTP_204_NO_CONTENT, 'id': item})
+        return Response(results)
+
+    def get_items(self) -> list | Response:
+        """Список элементов запроса или ответ с ошибкой, если это не список допустимой длины"""
+
+        items = self.request.data
+        if not isinstance(items, list):
+            return Response({'errors': ['Ожидался список.']}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.HABITS_BATCH_MAX_SIZE:
+            return Response({'errors': [f'Не больше {settings.HABITS_BATCH_MAX_SIZE} элементов в запросе.']},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return items
+
+    def get_habits(self, ids) -> dict[int, Habit]:
+        """Доступные пользователю привычки с заданными id (одним запросом)"""
+
+        return {habit.pk: habit for habit in self.get_queryset().filter(pk__in={pk for pk in ids if is_id(pk)})}
+
+
+def is_id(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def metrics_view(request):
+    """
+    Метрики рассылки напоминаний в текстовом формате Prometheus.
+    Доступны только с токеном METRICS_TOKEN в заголовке Authorization: Bearer, иначе ответ 403
+    """
+
+    token = settings.METRICS_TOKEN
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=403)
+
+    try:
+        body = render_metrics()
+    except redis.RedisError:
+        logger.exception('Не удалось прочитать метрики рассылки')
+        return HttpResponse(status=503)
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
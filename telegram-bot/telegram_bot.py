@@ -32,6 +32,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if user:
         user.telegram_user_id = user_id
+        user.telegram_blocked = False
         await sync_to_async(user.save, thread_sensitive=True)()
     else:
         print('не нашел')
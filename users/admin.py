@@ -5,4 +5,4 @@ from users.models import User
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'telegram_username')
+    list_display = ('id', 'username', 'telegram_username', 'telegram_blocked')
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_telegram_user_id_alter_user_telegram_username'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='telegram_blocked',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='Чат телеграм недоступен (бот заблокирован или чат не найден)'),
+        ),
+    ]
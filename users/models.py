@@ -22,6 +22,10 @@ class User(AbstractUser):
                                                    blank=True,
                                                    verbose_name='Уникальный идентификатор чата телеграм')
 
+    telegram_blocked = models.BooleanField(default=False,
+                                           db_index=True,
+                                           verbose_name='Чат телеграм недоступен (бот заблокирован или чат не найден)')
+
     USERNAME_FIELD = 'username'
     REQUIRED_FIELDS = ['telegram_username']
 